@@ -0,0 +1,340 @@
+import lzma
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils import xml_pixel_format_nptypes
+from sensor import xml_pixel_format_type
+from sequence import SEQ_METADATA_DTYPE
+from decoders import pack_mono10p, unpack_mono10p
+
+# Archive file layout, all little endian:
+#   header (ARC_HEADER_SIZE bytes)
+#   chunks of frames_per_chunk frames, each one packed then compressed on its own, or stored packed when the codec
+#   does not make it smaller
+#   chunk index (ARC_INDEX_DTYPE), then frame_count metadata records (SEQ_METADATA_DTYPE)
+ARC_MAGIC = b"EKARC\x00\x00\x00"
+ARC_VERSION = 2
+ARC_HEADER_SIZE = 96
+# magic, version, header size, width, height, channels, pixel format, dtype, codec, packing, frames per chunk,
+# frame count, chunk count, index offset
+_arc_header = struct.Struct("<8sHHIIII8s8s8sIQQQ")
+
+ARC_INDEX_DTYPE = np.dtype([("offset", "<u8"), ("size", "<u8"), ("first_frame", "<u8"), ("frame_count", "<u4"),
+                            ("compressed", "u1")])
+# version 1 compressed every chunk
+_arc_index_dtype_v1 = np.dtype([("offset", "<u8"), ("size", "<u8"), ("first_frame", "<u8"), ("frame_count", "<u4")])
+
+# "none" stores the chunks as is
+ARC_CODECS = ("none", "zlib", "lzma")
+# "mono10p" stores 10 bits samples in 1.25 bytes, "none" stores the samples as is
+ARC_PACKINGS = ("none", "mono10p")
+
+
+def _compress(codec, level, data):
+    # runs in the worker processes
+    # returns (compressed, bytes to store), noise does not compress and is stored as is
+    if codec == "zlib":
+        compressed = zlib.compress(data, level)
+    elif codec == "lzma":
+        compressed = lzma.compress(data, preset=level)
+    else:
+        return False, data
+    if len(compressed) >= len(data):
+        return False, data
+    return True, compressed
+
+
+def _decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    return data
+
+
+class ArchiveWriter:
+    """Writes a long capture into a compact chunked file, that ArchiveReader reads back frame by frame.
+    10 bits frames are packed to 1.25 bytes per pixel in the calling thread, then each chunk of frames is compressed
+    in a pool of processes while the next frames are packed. The chunks are written in order as they are ready.
+    NOTE: On Windows the pool starts new interpreters, the script creating the writer needs an
+          if __name__ == "__main__": guard."""
+
+    def __init__(self, path, width, height, pixel_format="Mono10p", dtype=None, codec="zlib", level=1,
+                 frames_per_chunk=8, packing=None, workers=None):
+        """Constructor
+        :param path: Name of the archive file.
+        :param width: Width of the frames in pixels.
+        :param height: Height of the frames in pixels.
+        :param pixel_format: EK/XML pixel format name, e.g. camera.pixel_format.
+        :param dtype: Numpy type of the samples. By default the type used by get_image for this pixel format.
+        :param codec: One of ARC_CODECS.
+        :param level: Compression level, zlib level or lzma preset.
+        :param frames_per_chunk: Number of frames compressed together.
+        :param packing: One of ARC_PACKINGS. By default "mono10p" for the Mono10p pixel format.
+        :param workers: Number of compression processes, by default the number of cores. 0 compresses in the calling
+                        thread."""
+        if codec not in ARC_CODECS:
+            raise ValueError(f"Unknown codec {codec}, expected one of {ARC_CODECS}")
+        if packing is None:
+            packing = "mono10p" if pixel_format == "Mono10p" else "none"
+        if packing not in ARC_PACKINGS:
+            raise ValueError(f"Unknown packing {packing}, expected one of {ARC_PACKINGS}")
+        if dtype is None:
+            dtype = xml_pixel_format_nptypes[pixel_format]
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = 3 if pixel_format == "RGB24" else 1
+        self.pixel_format = pixel_format
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.codec = codec
+        self.level = level
+        self.packing = packing
+        self.frames_per_chunk = frames_per_chunk
+        npixels = width * height * self.channels
+        if packing == "mono10p":
+            if npixels % 4:
+                raise ValueError("Mono10p packing needs a multiple of 4 pixels per frame")
+            self.frame_bytes = npixels // 4 * 5
+        else:
+            self.frame_bytes = npixels * self.dtype.itemsize
+        self.frame_count = 0
+        self.bytes_written = 0
+        self._chunk = np.empty((frames_per_chunk, self.frame_bytes), dtype=np.uint8)
+        self._chunk_frames = 0
+        self._index = []
+        self._metadata = np.zeros(1024, dtype=SEQ_METADATA_DTYPE)
+        self._pool = None
+        if codec != "none" and workers != 0:
+            workers = workers or os.cpu_count() or 1
+            self._pool = ProcessPoolExecutor(workers)
+            # chunks waiting for compression, bounds the memory when the disk or the cores do not keep up
+            self._max_pending = 2 * workers
+        # (first frame, frame count, future or compressed bytes) in file order
+        self._pending = deque()
+        self._file = open(path, "wb")
+        self._write_header(0, 0)
+
+    @classmethod
+    def for_camera(cls, path, camera, **kwargs):
+        # archive matching the current camera setting
+        return cls(path, camera.sensor_width, camera.sensor_height, camera.pixel_format, camera.frame_dtype, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def ratio(self):
+        # size of the frames as returned by get_image over their size in the archive
+        if self.bytes_written == 0:
+            return 0.0
+        return self.frame_count * self.width * self.height * self.channels * self.dtype.itemsize / self.bytes_written
+
+    def _write_header(self, chunk_count, index_offset):
+        header = _arc_header.pack(
+            ARC_MAGIC,
+            ARC_VERSION,
+            ARC_HEADER_SIZE,
+            self.width,
+            self.height,
+            self.channels,
+            xml_pixel_format_type[self.pixel_format],
+            self.dtype.str.encode(),
+            self.codec.encode(),
+            self.packing.encode(),
+            self.frames_per_chunk,
+            self.frame_count,
+            chunk_count,
+            index_offset,
+        )
+        self._file.write(header.ljust(ARC_HEADER_SIZE, b"\x00"))
+
+    def append(self, image, block_id=0, timestamp=0, exposure=np.nan):
+        """This function appends a frame to the archive.
+        :param image: The frame, as returned by get_image.
+        :param block_id: Block id of the frame.
+        :param timestamp: Timestamp of the frame.
+        :param exposure: Exposure time of the frame in ms."""
+        row = self._chunk[self._chunk_frames]
+        if self.packing == "mono10p":
+            if image.size * 5 // 4 != self.frame_bytes:
+                raise ValueError(f"Frame of {image.size} pixels does not match the archive")
+            pack_mono10p(image, out=row)
+        else:
+            if image.nbytes != self.frame_bytes:
+                raise ValueError(f"Frame of {image.nbytes} bytes does not match the archive ({self.frame_bytes} bytes)")
+            row[...] = np.frombuffer(np.ascontiguousarray(image, dtype=self.dtype).data, dtype=np.uint8)
+        if self.frame_count == len(self._metadata):
+            self._metadata = np.resize(self._metadata, 2 * len(self._metadata))
+        self._metadata[self.frame_count] = (block_id, timestamp, exposure)
+        self.frame_count += 1
+        self._chunk_frames += 1
+        if self._chunk_frames == self.frames_per_chunk:
+            self._submit()
+
+    def _submit(self):
+        # hands the current chunk over to the compression and starts a new one
+        count = self._chunk_frames
+        data = self._chunk[:count].tobytes()
+        self._chunk_frames = 0
+        if self._pool is None:
+            self._pending.append((self.frame_count - count, count, _compress(self.codec, self.level, data)))
+        else:
+            self._pending.append((self.frame_count - count, count,
+                                  self._pool.submit(_compress, self.codec, self.level, data)))
+        self._write_ready(self._max_pending if self._pool is not None else 0)
+
+    def _write_ready(self, keep):
+        # writes the compressed chunks in order, waits while more than keep are pending
+        while self._pending:
+            first_frame, count, data = self._pending[0]
+            if not isinstance(data, tuple):
+                if len(self._pending) <= keep and not data.done():
+                    return
+                data = data.result()
+            compressed, data = data
+            self._pending.popleft()
+            self._index.append((self._file.tell(), len(data), first_frame, count, compressed))
+            self._file.write(data)
+            self.bytes_written += len(data)
+
+    def flush(self):
+        """This function compresses and writes the frames appended so far."""
+        if self._chunk_frames:
+            self._submit()
+        self._write_ready(0)
+
+    def close(self):
+        """This function writes the last chunk, the index and the final header."""
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+            index_offset = self._file.tell()
+            self._file.write(np.array(self._index, dtype=ARC_INDEX_DTYPE).data)
+            self._file.write(self._metadata[: self.frame_count].data)
+            self._file.seek(0)
+            self._write_header(len(self._index), index_offset)
+        finally:
+            self._file.close()
+            if self._pool is not None:
+                self._pool.shutdown()
+
+
+class ArchiveReader:
+    """Reads the frames of an archive, only the chunks of the requested frames are decompressed and unpacked.
+        with ArchiveReader("capture.eka") as archive:
+            image = archive[10]
+            images = archive.read(100, 200)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        header = self._file.read(_arc_header.size)
+        if len(header) < _arc_header.size or header[:8] != ARC_MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not an EK archive file")
+        (
+            _,
+            self.version,
+            _,
+            self.width,
+            self.height,
+            self.channels,
+            pixel_format,
+            dtype,
+            codec,
+            packing,
+            self.frames_per_chunk,
+            self.frame_count,
+            chunk_count,
+            index_offset,
+        ) = _arc_header.unpack(header)
+        if self.version > ARC_VERSION:
+            self._file.close()
+            raise ValueError(f"{path}: unsupported archive version {self.version}")
+        if index_offset == 0:
+            self._file.close()
+            raise ValueError(f"{path}: the archive was not closed, it has no index")
+        self.pixel_format = xml_pixel_format_type[pixel_format]
+        self.dtype = np.dtype(dtype.rstrip(b"\x00").decode())
+        self.codec = codec.rstrip(b"\x00").decode()
+        self.packing = packing.rstrip(b"\x00").decode()
+        self.shape = (self.height, self.width, 3) if self.channels == 3 else (self.height, self.width)
+        self._file.seek(index_offset)
+        if self.version == 1:
+            index = np.frombuffer(self._file.read(chunk_count * _arc_index_dtype_v1.itemsize),
+                                  dtype=_arc_index_dtype_v1)
+            self.index = np.ones(chunk_count, dtype=ARC_INDEX_DTYPE)
+            for name in _arc_index_dtype_v1.names:
+                self.index[name] = index[name]
+        else:
+            self.index = np.frombuffer(self._file.read(chunk_count * ARC_INDEX_DTYPE.itemsize), dtype=ARC_INDEX_DTYPE)
+        self.metadata = np.frombuffer(self._file.read(self.frame_count * SEQ_METADATA_DTYPE.itemsize),
+                                      dtype=SEQ_METADATA_DTYPE)
+        # last decompressed chunk, consecutive frames are read from it
+        self._cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.frame_count
+        if not 0 <= index < self.frame_count:
+            raise IndexError(f"Frame {index} out of range, the archive has {self.frame_count} frames")
+        return self.read(index, index + 1)[0]
+
+    def __iter__(self):
+        for chunk in range(len(self.index)):
+            first, count = int(self.index[chunk]["first_frame"]), int(self.index[chunk]["frame_count"])
+            yield from self.read(first, first + count)
+
+    def _chunk(self, chunk):
+        # raw bytes of a chunk, (frame count, frame bytes)
+        if self._cached[0] != chunk:
+            entry = self.index[chunk]
+            self._file.seek(int(entry["offset"]))
+            data = self._file.read(int(entry["size"]))
+            if entry["compressed"]:
+                data = _decompress(self.codec, data)
+            self._cached = (chunk, np.frombuffer(data, dtype=np.uint8).reshape(int(entry["frame_count"]), -1))
+        return self._cached[1]
+
+    def read(self, start, stop):
+        """This function reads a range of frames.
+        :param start: Index of the first frame.
+        :param stop: Index after the last frame.
+        returns (stop - start, height, width[, 3]) array"""
+        stop = min(stop, self.frame_count)
+        frames = np.empty((max(stop - start, 0),) + self.shape, dtype=self.dtype)
+        frame = start
+        while frame < stop:
+            # chunks hold frames_per_chunk frames, except the last one
+            chunk = int(np.searchsorted(self.index["first_frame"], frame, side="right")) - 1
+            data = self._chunk(chunk)
+            first = int(self.index[chunk]["first_frame"])
+            rows = data[frame - first: min(stop - first, len(data))]
+            out = frames[frame - start: frame - start + len(rows)]
+            if self.packing == "mono10p":
+                unpack_mono10p(rows.reshape(-1), out.shape, out=out)
+            else:
+                out.reshape(len(rows), -1)[...] = rows.view(self.dtype)
+            frame += len(rows)
+        return frames
+
+    def close(self):
+        self._file.close()
+        self._cached = (None, None)
@@ -0,0 +1,174 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from evaluationkit import *
+
+
+class AsyncCamera:
+    """asyncio facade of an EvaluationKit or a Topaz: the blocking SDK calls run on a dedicated thread, so the event
+    loop keeps serving the other tasks while the camera waits for an image or a register.
+        async with AsyncCamera(Topaz()) as camera:
+            await camera.aset_exposure_time(10)
+            async with camera.astream(100) as frames:
+                async for frame in frames:
+                    ...
+    Cancelling a call, or timing it out with asyncio.wait_for, does not interrupt the SDK: the call ends on its thread
+    and its result is dropped, buffers taken by get_image are requeued in any case.
+    The other attributes of the camera are available as is, e.g. camera.pixel_format."""
+
+    def __init__(self, camera, executor=None):
+        """Constructor
+        :param camera: The EvaluationKit or Topaz.
+        :param executor: Optionally the executor running the SDK calls. By default a thread owned by this object,
+                         so the calls to the camera are serialized."""
+        self.camera = camera
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(1, thread_name_prefix="EK-SDK")
+
+    def __getattr__(self, name):
+        return getattr(self.camera, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def arun(self, function, *args, **kwargs):
+        """This function runs a blocking function on the SDK thread.
+        returns the result of the function"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def aget_image(self, timeout=500000, out=None):
+        """This function gets an image, see get_image.
+        returns (error code, image)"""
+        return await self.arun(self.camera.get_image, timeout, out)
+
+    async def aget_frame(self, timeout=500000, out=None, log=None):
+        """This function gets an image with the metadata of its buffer, see get_frame.
+        returns (error code, Frame)"""
+        return await self.arun(self.camera.get_frame, timeout, out, log)
+
+    async def astart_acquisition(self, flush=True):
+        return await self.arun(self.camera.start_acquisition, flush)
+
+    async def astop_acquisition(self, flush=True):
+        return await self.arun(self.camera.stop_acquisition, flush)
+
+    async def aread(self, address, size, decode=True):
+        return await self.arun(self.camera.read, address, size, decode)
+
+    async def awrite(self, address, data):
+        return await self.arun(self.camera.write, address, data)
+
+    async def aread_sensor_reg(self, address, cached=False):
+        return await self.arun(self.camera.read_sensor_reg, address, cached)
+
+    async def awrite_sensor_reg(self, address, value):
+        return await self.arun(self.camera.write_sensor_reg, address, value)
+
+    async def aget(self, name):
+        """This function reads a property of the camera, e.g. "exposure_time"."""
+        return await self.arun(getattr, self.camera, name)
+
+    async def aset(self, name, value):
+        """This function writes a property of the camera, e.g. "exposure_time"."""
+        return await self.arun(setattr, self.camera, name, value)
+
+    async def aexposure_time(self):
+        # exposure time in ms
+        return await self.aget("exposure_time")
+
+    async def aset_exposure_time(self, value):
+        return await self.aset("exposure_time", value)
+
+    async def aapply_settings(self, settings):
+        return await self.arun(self.camera.apply_settings, settings)
+
+    def astream(self, n=None, timeout=None, buffering=4, log=None):
+        """This function streams Frames as they are acquired, see AsyncFrameStream:
+            async with camera.astream(100) as frames:
+                async for frame in frames:
+                    ...
+        :param n: Number of images to acquire, None to stream until the stream is closed.
+        :param timeout: Maximum time to wait for each image in seconds, None to wait forever.
+        :param buffering: Number of images grabbed ahead of the consumer.
+        :param log: Optionally a FrameLog the metadata of every image is appended to.
+        returns the AsyncFrameStream"""
+        return AsyncFrameStream(self, n, timeout, buffering, log)
+
+    async def aclose(self):
+        """This function closes the camera once the pending SDK calls are done."""
+        await self.arun(getattr(self.camera, "close", self.camera.__del__))
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncFrameStream:
+    """Async iterator of the Frames of AsyncCamera.astream. The images are grabbed by a FrameGrabber thread, the event
+    loop only waits for them to be ready, on a thread of its own so that register calls go through meanwhile.
+    The acquisition starts with the iteration and stops when the stream is closed: at the end of the async with block,
+    when the n images were yielded, or when waiting for an image fails or is cancelled. Without async with, a consumer
+    leaving the async for loop early (break, exception) has to call aclose() itself.
+    NOTE: An image is only valid until the next one is requested, copy it to keep it."""
+
+    def __init__(self, camera, n=None, timeout=None, buffering=4, log=None):
+        self._camera = camera
+        self.n = n
+        self.timeout = timeout
+        self.grabber = camera.camera.grabber(size=buffering, policy="block", log=log)
+        self.count = 0
+        self._waiter = None
+        self._started = False
+        self._closed = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self
+
+    async def start(self):
+        """This function starts the acquisition, the first iteration does it otherwise."""
+        if self._started:
+            return
+        # set first: when cancelled meanwhile, the start still runs on the SDK thread and aclose has to stop it
+        self._started = True
+        self._waiter = ThreadPoolExecutor(1, thread_name_prefix="EK-stream")
+        err = await self._camera.arun(self.grabber.start)
+        if err != CAM_ERR_SUCCESS:
+            raise Exception(f"start_acquisition: {err}")
+
+    async def __anext__(self):
+        if self._closed or (self.n is not None and self.count >= self.n):
+            await self.aclose()
+            raise StopAsyncIteration
+        try:
+            await self.start()
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(self._waiter, self.grabber.get, self.timeout)
+        except BaseException:
+            # failed or cancelled, the consumer may not close the stream
+            await self.aclose()
+            raise
+        if image is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        info = self.grabber.frame_info()
+        self.count += 1
+        return Frame(image, info["block_id"], info["timestamp"], info["arrival"])
+
+    async def aclose(self):
+        """This function stops the grabber and the acquisition."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._started:
+            # also wakes up a pending grabber.get
+            await self._camera.arun(self.grabber.stop)
+            self._waiter.shutdown(wait=False)
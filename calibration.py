@@ -0,0 +1,158 @@
+import numpy as np
+from utils import TemporalStats
+
+CAL_GAIN_BITS = 12  # fractional bits of the fixed point flat-field gains, gains up to 16 on uint16
+CAL_DARK_TOLERANCE = 0.1  # relative difference of exposure time accepted between a frame and its master dark
+
+
+class Calibration:
+    """Dark and flat-field (PRNU) correction.
+    Master darks are averaged per exposure time, the flat-field is turned into a per-pixel fixed point gain map once,
+    so correcting a frame only takes integer operations, in place, on preallocated buffers:
+        calibration = Calibration()
+        calibration.acquire_darks(camera, [5, 10, 20])   # lens covered
+        calibration.acquire_flat(camera, exposure=10)    # uniform light
+        calibration.save("EK-calibration.npz")
+        for image in camera.stream(1000):
+            calibration.apply(image, exposure=10)"""
+
+    def __init__(self, bits=10, gain_bits=CAL_GAIN_BITS, dark_tolerance=CAL_DARK_TOLERANCE):
+        """Constructor
+        :param bits: Number of significant bits of the uint16 frames, corrected values are clipped to this range.
+        :param gain_bits: Fractional bits of the gain map.
+        :param dark_tolerance: Relative difference of exposure time accepted between a frame and the closest master
+                               dark, e.g. 0.1 for 10%."""
+        self.bits = bits
+        self.gain_bits = gain_bits
+        self.dark_tolerance = dark_tolerance
+        # exposure time in ms -> master dark, same type as the frames
+        self.darks = {}
+        # fixed point gains, gain * 2 ** gain_bits
+        self.gain = None
+        self._scratch = None
+
+    def _white(self, dtype):
+        return 255 if dtype == np.uint8 else (1 << self.bits) - 1
+
+    @staticmethod
+    def _average(frames):
+        stats = TemporalStats(frame_stats=False)
+        for frame in frames:
+            stats.update(frame)
+        if stats.count == 0:
+            raise ValueError("No frame to average")
+        return stats
+
+    def add_dark(self, frames, exposure):
+        """This function averages frames acquired without light into the master dark of an exposure time.
+        :param frames: Iterable of frames, e.g. camera.stream(32).
+        :param exposure: Exposure time of the frames in ms.
+        returns the master dark"""
+        stats = self._average(frames)
+        self.darks[round(float(exposure), 3)] = np.rint(stats.mean).astype(stats.min.dtype)
+        return self.darks[round(float(exposure), 3)]
+
+    def add_flat(self, frames, exposure=None):
+        """This function averages frames of a uniform light into the gain map, after dark subtraction.
+        :param frames: Iterable of frames, e.g. camera.stream(32).
+        :param exposure: Exposure time of the frames in ms, selects the master dark to subtract.
+        returns the gain map, as floating point gains"""
+        flat = self._average(frames).mean
+        dark = self.dark_for(exposure)
+        if dark is not None:
+            flat -= dark
+        # pixels without signal keep a gain of 1
+        valid = flat > 0
+        gains = np.ones(flat.shape)
+        gains[valid] = np.mean(flat[valid]) / flat[valid]
+        scale = 1 << self.gain_bits
+        self.gain = np.clip(np.rint(gains * scale), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+        return self.gain / scale
+
+    def acquire_darks(self, camera, exposures, n=32):
+        """This function acquires the master darks of several exposure times, in one acquisition.
+        :param camera: The Topaz, with no light on the sensor.
+        :param exposures: Exposure times in ms.
+        :param n: Number of frames averaged per exposure time."""
+        for _, settings, frames in camera.sweep([{"exposure_time": e} for e in exposures], n):
+            self.add_dark(frames, settings["exposure_time"])
+
+    def acquire_flat(self, camera, exposure=None, n=32):
+        """This function acquires the flat-field.
+        :param camera: The Topaz, under a uniform light.
+        :param exposure: Exposure time in ms, by default the current one.
+        :param n: Number of frames averaged."""
+        if exposure is None:
+            exposure = camera.exposure_time
+        for _, settings, frames in camera.sweep([{"exposure_time": exposure}], n):
+            self.add_flat(frames, exposure)
+
+    def dark_for(self, exposure=None):
+        """This function selects the master dark of the closest exposure time, within dark_tolerance.
+        :param exposure: Exposure time in ms. May be None if there is a single master dark.
+        returns the master dark, or None if there is none"""
+        if not self.darks:
+            return None
+        if exposure is None:
+            if len(self.darks) > 1:
+                raise ValueError(f"Exposure time needed to select a master dark among {sorted(self.darks)}")
+            return next(iter(self.darks.values()))
+        closest = min(self.darks, key=lambda e: abs(e - exposure))
+        if abs(closest - exposure) > self.dark_tolerance * max(abs(exposure), abs(closest)):
+            raise ValueError(f"No master dark within {self.dark_tolerance:.0%} of {exposure} ms, "
+                             f"the closest is {closest} ms")
+        return self.darks[closest]
+
+    def apply(self, image, exposure=None, out=None):
+        """This function corrects a frame: dark subtraction clamped at 0, then fixed point gain rounded and clipped.
+        :param image: The frame, as returned by get_image.
+        :param exposure: Exposure time of the frame in ms, selects the master dark.
+        :param out: Optionally the array to write the corrected frame to. By default the frame is corrected in place.
+        returns the corrected frame"""
+        if out is None:
+            out = image
+        elif out is not image:
+            np.copyto(out, image)
+        dark = self.dark_for(exposure)
+        if dark is not None:
+            np.maximum(out, dark, out=out)
+            np.subtract(out, dark, out=out)
+        if self.gain is not None:
+            if self._scratch is None or self._scratch.shape != out.shape:
+                self._scratch = np.empty(out.shape, dtype=np.uint32)
+            scratch = self._scratch
+            np.multiply(out, self.gain, out=scratch, dtype=np.uint32)
+            scratch += 1 << (self.gain_bits - 1)
+            scratch >>= self.gain_bits
+            np.minimum(scratch, self._white(out.dtype), out=scratch)
+            np.copyto(out, scratch, casting="unsafe")
+        return out
+
+    def save(self, path):
+        """This function saves the master darks and the gain map in a .npz file."""
+        exposures = sorted(self.darks)
+        arrays = {"bits": self.bits, "gain_bits": self.gain_bits, "dark_tolerance": self.dark_tolerance,
+                  "exposures": np.array(exposures, dtype=np.float64)}
+        if exposures:
+            arrays["darks"] = np.stack([self.darks[e] for e in exposures])
+        if self.gain is not None:
+            arrays["gain"] = self.gain
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """This function loads a calibration saved by save().
+        returns the Calibration"""
+        with np.load(path) as data:
+            calibration = cls(int(data["bits"]), int(data["gain_bits"]))
+            if "dark_tolerance" in data:
+                calibration.dark_tolerance = float(data["dark_tolerance"])
+            exposures = data["exposures"]
+            if len(exposures):
+                # each data[...] reads the array from the file again
+                darks = data["darks"]
+                for exposure, dark in zip(exposures, darks):
+                    calibration.darks[float(exposure)] = dark
+            if "gain" in data:
+                calibration.gain = data["gain"]
+        return calibration
@@ -0,0 +1,172 @@
+import time
+import numpy as np
+
+
+class tImagePixelType:
+    eUnknown, eMono8, eMono10, eMono12, eMono14, eMono26, eRGB8, eYUV422, eMono10p = range(9)
+
+
+def rgb24_view(aux):
+    """This function returns an RGB24 image as a (height, width, 3) view, without copying it.
+    :param aux: The (height, width * 3) uint8 image returned by get_image."""
+    return aux.reshape(aux.shape[0], -1, 3)
+
+
+def subsampling22_view(aux, pixel_format):
+    """This function returns the 2x2 subsampled layout as a view, without copying it.
+    :param aux: The image returned by get_image.
+    :param pixel_format: EK/XML pixel format name."""
+    if pixel_format == "RGB24":
+        return rgb24_view(aux)[:, 0::2, :]
+    return aux[:, 0::2]
+
+
+def subsampling22(aux, pixel_format, out=None):
+    """This function copies the 2x2 subsampled layout into a contiguous image.
+    :param out: Optionally a preallocated array to copy into.
+    returns the image, (height, width / 2, 3) for RGB24"""
+    view = subsampling22_view(aux, pixel_format)
+    if out is None:
+        out = np.empty(view.shape, dtype=view.dtype)
+    if view.ndim == 3:
+        # one strided copy per channel is much faster than copying 3 bytes pixels
+        for c in range(view.shape[2]):
+            out[:, :, c] = view[:, :, c]
+    else:
+        out[...] = view
+    return out
+
+
+def unpack_mono10p(packed, shape, out=None):
+    """This function unpacks Mono10p samples, 4 pixels in 5 bytes LSB first, into uint16.
+    :param packed: 1D contiguous uint8 array of the packed buffer.
+    :param shape: Shape of the image, the number of pixels has to be a multiple of 4.
+    :param out: Optionally a preallocated uint16 array to unpack into.
+    returns the unpacked image"""
+    if out is None:
+        out = np.empty(shape, dtype=np.uint16)
+    npixels = int(np.prod(shape))
+    if npixels % 4:
+        raise ValueError("Mono10p images need a multiple of 4 pixels")
+    o = out.reshape(-1, 4)
+    # pixel j of each 5 bytes group is in the little endian 16 bits word at byte j, shifted by 2 * j bits.
+    # The words are read in place through a strided view of the buffer, nothing is allocated.
+    for j in range(4):
+        word = np.ndarray((npixels // 4,), dtype="<u2", buffer=packed, offset=j, strides=(5,))
+        np.right_shift(word, 2 * j, out=o[:, j])
+        if j < 3:
+            o[:, j] &= 0x3FF
+    return out
+
+
+def pack_mono10p(image, out=None):
+    """This function packs 10 bits samples into Mono10p, 4 pixels in 5 bytes LSB first, the reverse of unpack_mono10p.
+    :param image: uint16 image, the number of pixels has to be a multiple of 4. Bits above the 10th are dropped.
+    :param out: Optionally a preallocated uint8 array of 5 / 4 bytes per pixel to pack into.
+    returns the 1D packed buffer"""
+    npixels = image.size
+    if npixels % 4:
+        raise ValueError("Mono10p images need a multiple of 4 pixels")
+    if out is None:
+        out = np.empty(npixels // 4 * 5, dtype=np.uint8)
+    p = np.ascontiguousarray(image, dtype=np.uint16).reshape(-1, 4)
+    o = out.reshape(-1, 5)
+    # uint8 outputs keep the low byte of each shifted sample
+    np.bitwise_and(p[:, 0], 0xFF, out=o[:, 0], casting="unsafe")
+    o[:, 1] = (p[:, 0] >> 8) & 0x3 | (p[:, 1] << 2) & 0xFC
+    o[:, 2] = (p[:, 1] >> 6) & 0xF | (p[:, 2] << 4) & 0xF0
+    o[:, 3] = (p[:, 2] >> 4) & 0x3F | (p[:, 3] << 6) & 0xC0
+    np.right_shift(p[:, 3], 2, out=o[:, 4], casting="unsafe")
+    return out
+
+
+# formats delivered packed and unpacked to uint16: pixel type -> (packed size in bytes of a height x width image,
+# unpack function)
+_packed_formats = {
+    tImagePixelType.eMono10p: (lambda height, width: height * width * 5 // 4, unpack_mono10p),
+}
+
+
+def layout(pixel_type, size, height, width):
+    """This function gets the layout of the image held by a pigentl buffer, as get_image returns it.
+    A packed format is only unpacked when the buffer has its packed size: the 10 bits formats can also be delivered on
+    2 bytes per pixel. Otherwise the layout follows the number of bytes per pixel.
+    :param pixel_type: eImagePixelType of the buffer.
+    :param size: iImageSize of the buffer in bytes.
+    :param height: Image height.
+    :param width: Image width.
+    returns (shape, dtype, packed), RGB24 being (height, width * 3) uint8"""
+    packed = _packed_formats.get(pixel_type)
+    if packed is not None and size == packed[0](height, width):
+        return (height, width), np.uint16, True
+    bytesPerPixel = size // (height * width)
+    if bytesPerPixel == 3:  # Packed format
+        return (height, width * 3), np.uint8, False
+    elif bytesPerPixel == 1:  # 8bit
+        return (height, width), np.uint8, False
+    else:  # 16bit
+        return (height, width), np.uint16, False
+
+
+def decode(raw, pixel_type, height, width, out=None, copy=True):
+    """This function decodes a pigentl buffer according to its eImagePixelType and size, see layout.
+    :param raw: 1D uint8 array of the buffer.
+    :param pixel_type: eImagePixelType of the buffer.
+    :param height: Image height.
+    :param width: Image width.
+    :param out: Optionally a preallocated array to decode into.
+    :param copy: If False and the format is not packed, return a view on raw.
+    returns the image"""
+    shape, dtype, packed = layout(pixel_type, raw.size, height, width)
+    if packed:
+        return _packed_formats[pixel_type][1](raw, shape, out=out)
+    image = raw[: int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+    if out is not None:
+        np.copyto(out, image.reshape(out.shape))
+        return out
+    return image.copy() if copy else image
+
+
+def _unpack_mono10p_columns(packed, out):
+    # reference implementation, one pass per byte column
+    b = packed.reshape(-1, 5).astype(np.uint16)
+    o = out.reshape(-1, 4)
+    o[:, 0] = b[:, 0] | ((b[:, 1] & 0x3) << 8)
+    o[:, 1] = (b[:, 1] >> 2) | ((b[:, 2] & 0xF) << 6)
+    o[:, 2] = (b[:, 2] >> 4) | ((b[:, 3] & 0x3F) << 4)
+    o[:, 3] = (b[:, 3] >> 6) | (b[:, 4] << 2)
+    return out
+
+
+def _benchmark(height=1080, width=1920, repeat=20):
+    # throughput of the decoders against the former copy and stack implementation
+    def timeit(f):
+        f()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            f()
+        return (time.perf_counter() - start) / repeat
+
+    rgb = np.random.randint(0, 256, (height, width * 3), dtype=np.uint8)
+    mono = np.random.randint(0, 1024, (height, width), dtype=np.uint16)
+    packed = np.random.randint(0, 256, height * width * 5 // 4, dtype=np.uint8)
+    unpacked = np.empty((height, width), dtype=np.uint16)
+    results = {
+        "RGB24 copy+stack": timeit(lambda: np.stack((rgb[:, 0::3].copy(), rgb[:, 1::3].copy(),
+                                                     rgb[:, 2::3].copy()), axis=2)),
+        "RGB24 view+copy": timeit(lambda: rgb24_view(rgb).copy()),
+        "RGB24 2x2 copy+stack": timeit(lambda: np.stack((rgb[:, 0::6].copy(), rgb[:, 1::6].copy(),
+                                                         rgb[:, 2::6].copy()), axis=2)),
+        "RGB24 2x2 subsampling22": timeit(lambda: subsampling22(rgb, "RGB24")),
+        "Mono 2x2 copy": timeit(lambda: mono[:, 0::2].copy()),
+        "Mono10p unpack columns": timeit(lambda: _unpack_mono10p_columns(packed, unpacked)),
+        "Mono10p unpack": timeit(lambda: unpack_mono10p(packed, (height, width), out=unpacked)),
+        "Mono10p pack": timeit(lambda: pack_mono10p(unpacked, out=packed)),
+    }
+    for name, duration in results.items():
+        print("{:24s} {:8.3f} ms  {:8.0f} MB/s".format(name, duration * 1e3, rgb.nbytes / duration / 1e6
+                                                       if name.startswith("RGB") else mono.nbytes / duration / 1e6))
+
+
+if __name__ == "__main__":
+    _benchmark()
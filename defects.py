@@ -0,0 +1,134 @@
+import numpy as np
+
+DEFECT_THRESHOLD = 6.0  # outlier threshold in robust standard deviations (1.4826 * MAD)
+DEFECT_MIN_SIGMA = 1.0  # smallest robust standard deviation in DN, one quantization step of the codes
+
+
+def _robust_outliers(values, threshold, min_sigma=DEFECT_MIN_SIGMA):
+    # |value - median| > threshold * sigma, sigma estimated from the median absolute deviation. Integer frames often
+    # have a MAD of 0, the floor keeps pixels a few DN off the median from being flagged.
+    median = np.median(values)
+    deviation = np.abs(values - median)
+    sigma = max(1.4826 * np.median(deviation), min_sigma)
+    return deviation > threshold * sigma
+
+
+class DefectMap:
+    """Hot and dead pixels of a sensor, stored as the flat indexes of the defects and replaced by the mean of their
+    valid neighbours of the same channel. The neighbour indexes are computed once, so correcting a frame gathers
+    4 values per defect and costs nothing for the other pixels:
+        defects = DefectMap.detect(dark_stack, flat_stack)
+        defects.save("EK-defects.npz")
+        for image in camera.stream(1000):
+            defects.apply(image)
+    RGB24 frames can be corrected either as returned by get_image, (height, width * 3), or by image_rearange,
+    (height, width, 3): both have the same memory layout."""
+
+    def __init__(self, indices, height, width, channels=1):
+        """Constructor
+        :param indices: Flat indexes of the defects in the (height, width, channels) layout.
+        :param height: Height of the frames.
+        :param width: Width of the frames in pixels.
+        :param channels: 3 for RGB24."""
+        self.height = height
+        self.width = width
+        self.channels = channels
+        self.indices = np.unique(np.asarray(indices, dtype=np.int64))
+        self._prepare()
+
+    @classmethod
+    def detect(cls, dark=None, flat=None, threshold=DEFECT_THRESHOLD, channels=None, min_sigma=DEFECT_MIN_SIGMA):
+        """This function finds the defects from dark and flat frames, with median/MAD statistics per channel.
+        Hot pixels are outliers of the dark mean, blinking pixels outliers of the dark temporal noise, dead or weak
+        pixels outliers of the flat mean.
+        :param dark: Dark frame, or stack of dark frames (n, height, width[, 3]).
+        :param flat: Flat frame, or stack of flat frames.
+        :param threshold: Outlier threshold in robust standard deviations.
+        :param channels: 3 for RGB24 frames as returned by get_image. By default guessed from the frames shape.
+        :param min_sigma: Floor of the robust standard deviation in DN, for frames with a MAD of 0.
+        returns the DefectMap"""
+        if dark is None and flat is None:
+            raise ValueError("A dark or a flat is needed to detect defects")
+        frames = [np.asarray(f) for f in (dark, flat) if f is not None]
+        sample = frames[0]
+        # frame shape: (height, width, 3) or (height, width[ * 3]), possibly preceded by the stack axis
+        spatial = 3 if sample.ndim >= 3 and sample.shape[-1] == 3 else 2
+        if channels is None:
+            channels = 3 if spatial == 3 else 1
+        height = sample.shape[-spatial]
+        width = sample.shape[-spatial + 1] // (channels if spatial == 2 else 1)
+        maps = []
+        for stack, is_dark in ((dark, True), (flat, False)):
+            if stack is None:
+                continue
+            stack = np.asarray(stack, dtype=np.float32).reshape(-1, height * width, channels)
+            maps.append(stack.mean(axis=0))
+            if is_dark and len(stack) > 1:
+                maps.append(stack.std(axis=0))
+        defective = np.zeros((height * width, channels), dtype=bool)
+        for values in maps:
+            for c in range(channels):
+                defective[:, c] |= _robust_outliers(values[:, c], threshold, min_sigma)
+        return cls(np.flatnonzero(defective), height, width, channels)
+
+    def _prepare(self):
+        # gather indexes of the left, right, up and down neighbours of each defect, and their weights
+        c = self.channels
+        row_stride = self.width * c
+        rows = self.indices // row_stride
+        cols = (self.indices % row_stride) // c
+        offsets = np.array([-c, c, -row_stride, row_stride])
+        neighbours = self.indices[:, None] + offsets[None, :]
+        valid = np.stack([cols > 0, cols < self.width - 1, rows > 0, rows < self.height - 1], axis=1)
+        # neighbours that are defects too are not used
+        valid &= ~np.isin(neighbours, self.indices)
+        self._neighbours = np.where(valid, neighbours, self.indices[:, None])
+        self._weights = valid.astype(np.uint32)
+        self._counts = self._weights.sum(axis=1)
+        # defects without any valid neighbour are left as they are
+        keep = self._counts > 0
+        self._targets = self.indices[keep]
+        self._neighbours = self._neighbours[keep]
+        self._weights = self._weights[keep]
+        self._counts = self._counts[keep]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def coordinates(self):
+        """This function gets the positions of the defects.
+        returns (rows, columns, channels) arrays"""
+        row_stride = self.width * self.channels
+        return self.indices // row_stride, (self.indices % row_stride) // self.channels, self.indices % self.channels
+
+    def mask(self):
+        """This function gets the defects as a boolean image.
+        returns (height, width) or (height, width, 3) array"""
+        mask = np.zeros(self.height * self.width * self.channels, dtype=bool)
+        mask[self.indices] = True
+        return mask.reshape((self.height, self.width, 3) if self.channels == 3 else (self.height, self.width))
+
+    def apply(self, image):
+        """This function replaces the defects of a frame by the mean of their neighbours, in place.
+        :param image: Contiguous frame, as returned by get_image or image_rearange.
+        returns the frame"""
+        if image.size != self.height * self.width * self.channels:
+            raise ValueError(f"Frame of {image.size} samples does not match the defect map")
+        flat = image.reshape(-1)
+        if not np.shares_memory(flat, image):
+            raise ValueError("The frame has to be contiguous to be corrected in place")
+        values = flat[self._neighbours] * self._weights
+        flat[self._targets] = (values.sum(axis=1) + self._counts // 2) // self._counts
+        return image
+
+    def save(self, path):
+        """This function saves the defect map in a .npz file."""
+        np.savez(path, indices=self.indices, shape=np.array([self.height, self.width, self.channels]))
+
+    @classmethod
+    def load(cls, path):
+        """This function loads a defect map saved by save().
+        returns the DefectMap"""
+        with np.load(path) as data:
+            height, width, channels = (int(v) for v in data["shape"])
+            return cls(data["indices"], height, width, channels)
@@ -1,16 +1,50 @@
 import time
 import struct
+import threading
 from utils import *
-import win32api
+from decoders import *
+from metrics import Metrics
+from frames import *
 
 CAM_ERR_SUCCESS = 0
-NBUFFER = 100
+CAM_ERR_TIMEOUT = -1011  # GenTL GC_ERR_TIMEOUT
+CAM_ERR_BUSY = -1022  # GenTL GC_ERR_BUSY
+NBUFFER = 100  # default number of pigentl buffers
+BUFFER_MEMORY_BUDGET = 256e6  # host memory in bytes the automatic buffer count may use
+BUFFER_STALL = 0.5  # consumer stall in seconds the automatic buffer count absorbs without dropping a frame
+BUFFER_RANGE = (4, 1000)  # bounds of the automatic buffer count
+ACQUISITION_TIMEOUT = 1.0  # maximum time in seconds to wait for the acquisition engine to change state
+ACQUISITION_POLL = 0.001  # interval in seconds between two attempts
+# error codes after which a call to the acquisition engine is tried again, the engine is still changing state. The
+# other errors are returned at once.
+ACQUISITION_RETRY_ERRORS = (CAM_ERR_TIMEOUT, CAM_ERR_BUSY)
 
-# set up access to Python 3 PyMemoryView_FromMemory() function
-PyBUF_READ = 0x200
-buf_from_mem = ctypes.pythonapi.PyMemoryView_FromMemory
-buf_from_mem.restype = ctypes.py_object
-buf_from_mem.argtypes = (ctypes.c_void_p, ctypes.c_int, ctypes.c_int)
+
+# the pigentl library is initialized once for all the cameras opened by the process
+_library_lock = threading.Lock()
+_library_users = 0
+
+
+def _initialize_library(lib):
+    # returns error code of PiGentlSdkInitializeLibrary, or CAM_ERR_SUCCESS if it is already initialized
+    global _library_users
+    with _library_lock:
+        if _library_users == 0:
+            err = lib.PiGentlSdkInitializeLibrary()
+            if err != CAM_ERR_SUCCESS:
+                return err
+        _library_users += 1
+        return CAM_ERR_SUCCESS
+
+
+def _terminate_library(lib):
+    # the library is terminated when its last camera is closed
+    global _library_users
+    with _library_lock:
+        _library_users -= 1
+        if _library_users == 0:
+            return lib.PiGentlSdkTerminateLibrary()
+        return CAM_ERR_SUCCESS
 
 
 # Define structs C
@@ -23,10 +57,6 @@ class tCameraInfo(ctypes.Structure):
     ]
 
 
-class tImagePixelType:
-    eUnknown, eMono8, eMono10, eMono12, eMono14, eMono26, eRGB8, eYUV422, eMono10p = range(9)
-
-
 class tImageInfos(ctypes.Structure):
     _fields_ = [
         ("hBuffer", ctypes.c_void_p),
@@ -48,32 +78,79 @@ class tImageInfos(ctypes.Structure):
     ]
 
 
+class ImageLease:
+    """Zero-copy access to an image still held in a pigentl buffer.
+    The image is a read-only numpy view on the driver memory, valid until release() requeues the buffer.
+    Use it as a context manager to requeue automatically:
+        with camera.lease_image() as lease:
+            process(lease.image)"""
+
+    def __init__(self, ek, image_infos, image):
+        self._ek = ek
+        self.infos = image_infos
+        self.image = image
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def released(self):
+        return self._ek is None
+
+    def release(self):
+        """This function gives the buffer back to the acquisition engine.
+        returns error code"""
+        if self._ek is None:
+            return CAM_ERR_SUCCESS
+        ek, self._ek = self._ek, None
+        self.image = None
+        return ek._requeue_buffer(self.infos)
+
+
 class EvaluationKit:
     """A Python wrapper for the pigentl-sdk library."""
 
-    def __init__(self, dll_path=None, cti_path=None):
+    def __init__(self, dll_path=None, cti_path=None, buffers=None, camera=0):
         """Constructor
         :param dll_path: Optionally specify the absolute path to the pigentl DLL.
         :param cti_path: Optionally specify the absolute path to the pigentl CTI.
-                      is in the directory of the DLL."""
+                      is in the directory of the DLL.
+        :param buffers: Number of pigentl buffers, NBUFFER by default.
+        :param camera: Index of the camera to open in the camera list, or its serial number."""
         self._is_init = False
         self.camera_opened = False
+        self._acquisition_started = None
+        # time in seconds from start_acquisition to the first buffer of the acquisition
+        self.first_frame_latency = None
+        # stage timers and frame counters, camera.metrics.enabled = False to turn them off
+        self.metrics = Metrics()
+        self.buffers = 0
+        # estimated number of filled buffers waiting in the output queue, see queue_occupancy
+        self.occupancy = 0
+        self._clock_offset = None
+        self._frame_period = None
+        self._last_buffer = None
 
+        if dll_path is None:
+            dll_path = os.environ.get("PIGENTL_DLL")
+        if cti_path is None:
+            cti_path = os.environ.get("PIGENTL_CTI")
+        if dll_path is None or cti_path is None:
+            raise FileNotFoundError("The pigentl-sdk DLL and CTI paths are needed, or the PIGENTL_DLL and PIGENTL_CTI "
+                                    "environment variables")
         if not os.path.isfile(dll_path):
             raise FileNotFoundError(f"The pigentl-sdk DLL was not found at the following location: {dll_path}")
         if not os.path.isfile(cti_path):
             raise FileNotFoundError(f"The pigentl-sdk CTI was not found at the following location: {cti_path}")
-        try:
-            ctypes.cdll.LoadLibrary(cti_path)
-            libc = ctypes.cdll.LoadLibrary(dll_path)
-        except ModuleNotFoundError:
-            raise ModuleNotFoundError("The pigentl-sdk DLL, CTI, or one or more of their dependencies were not found.")
-        self.lib = self._register_lib_args(libc)
+        self.lib = self._register_lib_args(self._load_library(dll_path, cti_path))
 
         # Initializate library
         print("pigentl-sdk lib path:  " + str(dll_path))
         print("pigentl-sdk version:   " + str(self.getSdkVersion(dll_path)))
-        err = self.lib.PiGentlSdkInitializeLibrary()
+        err = _initialize_library(self.lib)
         if err != CAM_ERR_SUCCESS:
             raise Exception(f"PiGentlSdkInitializeLibrary: {err}. Is the camera already in use?")
         else:
@@ -81,7 +158,7 @@ class EvaluationKit:
             # update camera list
             ulNbCameras = ctypes.c_ulong(0)
             numattempts = 0
-            while ulNbCameras.value == 0 & numattempts < 10:
+            while ulNbCameras.value == 0 and numattempts < 10:
                 err = self.lib.PiGentlSdkUpdateCameraList(ctypes.byref(ulNbCameras))
                 numattempts += 1
             if err != CAM_ERR_SUCCESS:
@@ -89,29 +166,124 @@ class EvaluationKit:
             else:
                 print(str(ulNbCameras.value) + " camera(s) found")
                 # Retrieve camera info
-                camera_info = tCameraInfo()
-                err = self.lib.PiGentlSdkGetCameraInfo(ctypes.c_ulong(0), ctypes.byref(camera_info))
+                self.cameras = self._camera_infos(ulNbCameras.value)
+                camera_info = self.camera_info = self._select_camera(camera)
+                print("\t\tCamera found: " + camera_info.pcID.decode())
+                self._handle = ctypes.c_void_p()
+                err = self.lib.PiGentlSdkOpenCamera(ctypes.byref(camera_info), self._handle)
                 if err != CAM_ERR_SUCCESS:
-                    raise Exception(f"PiGentlSdkGetCameraInfo: {err}")
+                    raise Exception(f"PiGentlSdkOpenCamera: {err}. Is the camera connected? Is it already in use?")
                 else:
-                    print("\t\tCamera found: " + camera_info.pcID.decode())
-                    self._handle = ctypes.c_void_p()
-                    err = self.lib.PiGentlSdkOpenCamera(ctypes.byref(camera_info), self._handle)
+                    print("\t\t\t\tPiGentlSdkOpenCamera OK")
+                    self.camera_opened = True
+                    # Before acquiring an image the height of the image and the number of buffers has to be defined
+                    err = self.set_number_of_buffers(NBUFFER if buffers is None else buffers)
                     if err != CAM_ERR_SUCCESS:
-                        raise Exception(f"PiGentlSdkOpenCamera: {err}. Is the camera connected? Is it already in use?")
+                        raise Exception(f"PiGentlSdkSetNumberOfBuffers: {err}")
                     else:
-                        print("\t\t\t\tPiGentlSdkOpenCamera OK")
-                        self.camera_opened = True
-                        # Before acquiring an image the height of the image and the number of buffers has to be defined
-                        err = self.lib.PiGentlSdkSetNumberOfBuffers(self._handle, ctypes.c_size_t(NBUFFER))
-                        if err != CAM_ERR_SUCCESS:
-                            raise Exception(f"PiGentlSdkSetNumberOfBuffers: {err}")
-                        else:
-                            print("\t\t\t\t\t\tBuffers allocation OK")
+                        print("\t\t\t\t\t\tBuffers allocation OK")
 
     def __del__(self):
-        self.lib.PiGentlSdkCloseCamera(self._handle)
-        self.lib.PiGentlSdkTerminateLibrary()
+        # close() and the garbage collector both end here, only the first call releases the camera
+        if self.camera_opened:
+            self.lib.PiGentlSdkCloseCamera(self._handle)
+            self.camera_opened = False
+        if self._is_init:
+            _terminate_library(self.lib)
+            self._is_init = False
+
+    def _camera_infos(self, count):
+        """This function gets the description of the cameras of the camera list.
+        :param count: Number of cameras returned by PiGentlSdkUpdateCameraList.
+        returns list of tCameraInfo"""
+        infos = []
+        for index in range(count):
+            camera_info = tCameraInfo()
+            err = self.lib.PiGentlSdkGetCameraInfo(ctypes.c_ulong(index), ctypes.byref(camera_info))
+            if err != CAM_ERR_SUCCESS:
+                raise Exception(f"PiGentlSdkGetCameraInfo: {err}")
+            infos.append(camera_info)
+        return infos
+
+    def _select_camera(self, camera):
+        """This function finds a camera of the camera list.
+        :param camera: Index in the list, or serial number.
+        returns the tCameraInfo of the camera"""
+        if isinstance(camera, str):
+            for camera_info in self.cameras:
+                if camera in (camera_info.serial.decode(), camera_info.pcID.decode()):
+                    return camera_info
+            serials = [camera_info.serial.decode() for camera_info in self.cameras]
+            raise Exception(f"Camera {camera} not found, available serial numbers: {serials}")
+        if not 0 <= camera < len(self.cameras):
+            raise Exception(f"Camera {camera} not found, {len(self.cameras)} camera(s) available")
+        return self.cameras[camera]
+
+    @property
+    def serial(self):
+        return self.camera_info.serial.decode()
+
+    def set_number_of_buffers(self, count):
+        """This function sets the number of pigentl buffers. The acquisition has to be stopped.
+        :param count: Number of buffers.
+        returns error code"""
+        err = self.lib.PiGentlSdkSetNumberOfBuffers(self._handle, ctypes.c_size_t(count))
+        if err == CAM_ERR_SUCCESS:
+            self.buffers = count
+        return err
+
+    @staticmethod
+    def buffers_for(frame_bytes, fps=None, burst=None, budget=BUFFER_MEMORY_BUDGET, stall=BUFFER_STALL):
+        """This function derives a number of buffers from the frame size and the expected frame rate.
+        :param frame_bytes: Size of one frame in bytes.
+        :param fps: Expected frame rate, the buffers hold the frames acquired during a consumer stall.
+        :param burst: Optionally the number of frames of a trigger burst, that all have to fit in the buffers.
+        :param budget: Maximum host memory used by the buffers in bytes.
+        :param stall: Consumer stall in seconds absorbed without dropping a frame.
+        returns the number of buffers, within BUFFER_RANGE and the memory budget"""
+        count = BUFFER_RANGE[0]
+        if fps:
+            count = max(count, int(np.ceil(fps * stall)))
+        if burst:
+            count = max(count, burst)
+        count = min(count, BUFFER_RANGE[1], int(budget // frame_bytes))
+        return max(count, 2)
+
+    def queue_occupancy(self):
+        """This function estimates how full the output queue was when the last buffer was retrieved.
+        The frames acquired since the one retrieved are counted from its sensor timestamp, mapped on the host clock
+        with the smallest transfer delay seen, and the frame period.
+        returns (waiting buffers, fraction of the buffers)"""
+        return self.occupancy, self.occupancy / self.buffers if self.buffers else 0.0
+
+    def _track_queue(self, ImageInfos, arrival):
+        # occupancy estimate, updated for each retrieved buffer
+        sensor_time = ImageInfos.iTimestamp * TIMESTAMP_TICK
+        offset = arrival - sensor_time
+        if self._clock_offset is None or offset < self._clock_offset:
+            self._clock_offset = offset
+        last = self._last_buffer
+        if last is not None and ImageInfos.iBlockId > last[0] and ImageInfos.iTimestamp > last[1]:
+            period = (ImageInfos.iTimestamp - last[1]) * TIMESTAMP_TICK / (ImageInfos.iBlockId - last[0])
+            self._frame_period = period if self._frame_period is None else 0.9 * self._frame_period + 0.1 * period
+        self._last_buffer = (ImageInfos.iBlockId, ImageInfos.iTimestamp)
+        if self._frame_period:
+            self.occupancy = int((offset - self._clock_offset) / self._frame_period)
+            if self.buffers:
+                self.occupancy = min(self.occupancy, self.buffers)
+            if self.metrics.enabled:
+                self.metrics.sample("occupancy", self.occupancy)
+
+    @staticmethod
+    def _load_library(dll_path, cti_path):
+        """This function loads the pigentl CTI and SDK, a DLL on Windows, a shared library elsewhere.
+        returns the ctypes library of the SDK"""
+        try:
+            ctypes.cdll.LoadLibrary(cti_path)
+            return ctypes.cdll.LoadLibrary(dll_path)
+        except (ModuleNotFoundError, OSError) as e:
+            raise ModuleNotFoundError(
+                f"The pigentl-sdk DLL, CTI, or one or more of their dependencies were not found: {e}") from e
 
     @staticmethod
     def _register_lib_args(libc):
@@ -159,18 +331,31 @@ class EvaluationKit:
             data = byte_buffer.raw
         return err, data
 
+    @staticmethod
+    def _pack(data):
+        """This function packs a register value the way write sends it.
+        returns the little endian bytearray"""
+        if type(data) == int:  # integer
+            return bytearray(struct.pack("<i", data))
+        elif type(data) == float:  # float
+            return bytearray(struct.pack("<f", data))
+        else:  # unsigned integer
+            return bytearray(struct.pack("<I", data))
+
     def write(self, address, data):
         """This function writes a camera register at a specified address.
         :param address:     The register address to write.
         :param data:     A user allocated byte buffer to send data.
-        returns (error code, size of buffer written)
+        returns error code
         NOTE: The buffer endianness is little endian"""
-        if type(data) == int:  # integer
-            ba = bytearray(struct.pack("<i", data))
-        elif type(data) == float:  # float
-            ba = bytearray(struct.pack("<f", data))
-        else:  # unsigned integer
-            ba = bytearray(struct.pack("<I", data))
+        return self.write_block(address, self._pack(data))
+
+    def write_block(self, address, data):
+        """This function writes a contiguous range of registers in one transaction.
+        :param address:     The address of the first register.
+        :param data:     The little endian bytes to write.
+        returns error code"""
+        ba = bytearray(data)
         ulAddress = ctypes.c_ulong(address)
         char_array = ctypes.c_char * len(ba)
         byte_buffer = char_array.from_buffer(ba)
@@ -178,54 +363,262 @@ class EvaluationKit:
         err = self.lib.PiGentlSdkWriteRegister(self._handle, ulAddress, byte_buffer, ctypes.byref(size))
         return err
 
-    def start_acquisition(self):
+    def write_many(self, writes):
+        """This function writes a list of registers, with as few transactions as possible.
+        Consecutive entries of the list that are also contiguous in the address space are sent in one transaction,
+        for the addresses accepted by _coalescable.
+        :param writes: List of (address, value), values are packed the same way as write does.
+        returns the first error code"""
+        blocks = []
+        for address, value in writes:
+            if blocks and blocks[-1][0] + len(blocks[-1][1]) == address and self._coalescable(address):
+                blocks[-1][1].extend(self._pack(value))
+            else:
+                blocks.append((address, self._pack(value)))
+        err = CAM_ERR_SUCCESS
+        for address, data in blocks:
+            err_write = self.write_block(address, data)
+            if err == CAM_ERR_SUCCESS:
+                err = err_write
+        return err
+
+    def _coalescable(self, address):
+        # whether the register at address can be written in the same transaction as the 32 bits register before it
+        return True
+
+    def read_block(self, address, size):
+        """This function reads a contiguous range of registers in one transaction.
+        :param address:     The address of the first register.
+        :param size: Number of bytes to read.
+        returns (error code, raw bytes)"""
+        return self.read(address, size, decode=False)
+
+    def read_fields(self, address, layout, names):
+        """This function reads a block of registers and decodes it into fields.
+        :param address:     The address of the block.
+        :param layout: Precompiled struct.Struct describing the block.
+        :param names: Name of each field unpacked by the layout.
+        returns (error code, dict of the fields)"""
+        err, data = self.read_block(address, layout.size)
+        return err, dict(zip(names, layout.unpack(data)))
+
+    def _poll(self, name, timeout):
+        """This function calls an acquisition engine function until it succeeds, rather than waiting a fixed delay.
+        Only the errors of ACQUISITION_RETRY_ERRORS are retried, the others are returned at once.
+        :param name: Name of the pigentl function, called with the camera handle.
+        :param timeout: Maximum time to retry in seconds.
+        returns error code of the last call"""
+        function = getattr(self.lib, name)
+        deadline = time.perf_counter() + timeout
+        while True:
+            err = function(self._handle)
+            if err not in ACQUISITION_RETRY_ERRORS or time.perf_counter() >= deadline:
+                return err
+            time.sleep(ACQUISITION_POLL)
+
+    def start_acquisition(self, flush=True, timeout=ACQUISITION_TIMEOUT):
         """This function starts the acquisition engine for the specified camera.
+        :param flush: Flush the buffers first. Skip it only if all buffers are known to be back in the input queue.
+        :param timeout: Maximum time in seconds to wait for the engine to accept each call.
         returns error code
         NOTE: Once started, the acquisition engine uses all buffers in the "InputQueue" and when grabbed, moves them to
               the "OutputQueue" where they can be retrieved with getBuffer.
         NOTE: Before starting acquisition the SDK internally calls flushBuffers to restore all buffers from the
-              output queue to the input queue"""
-        err = self.lib.PiGentlSdkFlushBuffers(self._handle)
-        time.sleep(0.1)
-        err = self.lib.PiGentlSdkStartAcquisition(self._handle)
+              output queue to the input queue
+        NOTE: first_frame_latency is updated when the first buffer is retrieved"""
+        self.first_frame_latency = None
+        # block ids and timestamps restart with the acquisition
+        self._clock_offset = None
+        self._last_buffer = None
+        if flush:
+            err = self._poll("PiGentlSdkFlushBuffers", timeout)
+            if err != CAM_ERR_SUCCESS:
+                return err
+        self._acquisition_started = time.perf_counter()
+        err = self._poll("PiGentlSdkStartAcquisition", timeout)
+        if err != CAM_ERR_SUCCESS:
+            self._acquisition_started = None
         return err
 
-    def stop_acquisition(self):
+    def stop_acquisition(self, flush=True, timeout=ACQUISITION_TIMEOUT):
         """This function stops the acquisition engine for the specified camera.
+        :param flush: Flush the buffers once stopped.
+        :param timeout: Maximum time in seconds to wait for the engine to accept each call.
         NOTE: SDK automatically allocates the size of the memory for each buffer specified by setNumberOfBuffers.
         returns error code"""
-        err = self.lib.PiGentlSdkStopAcquisition(self._handle)
-        time.sleep(0.1)
-        err = self.lib.PiGentlSdkFlushBuffers(self._handle)
+        err = self._poll("PiGentlSdkStopAcquisition", timeout)
+        if err != CAM_ERR_SUCCESS:
+            return err
+        self._acquisition_started = None
+        if flush:
+            err = self._poll("PiGentlSdkFlushBuffers", timeout)
         return err
 
-    def get_image(self, timeout=500000):
-        """This function get an image from preallocated buffer.
-        """
-        image = None
+    def restart_acquisition(self, flush=True, timeout=ACQUISITION_TIMEOUT):
+        """This function stops and starts the acquisition engine again.
+        :param flush: Flush the buffers in between. Skip it only if all buffers were requeued, e.g. by get_image.
+        :param timeout: Maximum time in seconds to wait for the engine to accept each call.
+        returns error code"""
+        err = self.stop_acquisition(flush=flush, timeout=timeout)
+        if err != CAM_ERR_SUCCESS:
+            return err
+        return self.start_acquisition(flush=False, timeout=timeout)
+
+    def _get_buffer(self, timeout):
+        """This function waits for the next filled buffer of the output queue.
+        returns the tImageInfos describing the buffer, which has to be requeued after use
+        NOTE: Raises TimeoutError when no buffer was filled within the timeout.
+        NOTE: Incomplete buffers are returned too, flagged by isIncomplete (Frame.incomplete, metrics "incomplete")."""
         ImageInfos = tImageInfos()
+        metrics = self.metrics if self.metrics.enabled else None
+        if metrics:
+            start = time.perf_counter()
         err = self.lib.PiGentlSdkGetBuffer(self._handle, ctypes.byref(ImageInfos), timeout)
-        if err == (CAM_ERR_SUCCESS & (not ImageInfos.isIncomplete) & ImageInfos.isNewData):
-            data = ctypes.cast(ImageInfos.pDatas, ctypes.POINTER(ctypes.c_ubyte))
-            bytesPerPixel = int((ImageInfos.iImageSize / (ImageInfos.iImageHeight * ImageInfos.iImageWidth)))
-            # Get image from byte buffer
-            if bytesPerPixel == 3:  # Packed format
-                shape = (ImageInfos.iImageHeight, ImageInfos.iImageWidth * bytesPerPixel)
-                image = make_nd_array(data, shape, dtype=np.uint8, order="C")
-            else:
-                if bytesPerPixel == 1:  # 8bit
-                    shape = (ImageInfos.iImageHeight, ImageInfos.iImageWidth)
-                    image = make_nd_array(data, shape, dtype=np.uint8, order="C")
-                else:  # 16bit
-                    shape = (ImageInfos.iImageHeight, ImageInfos.iImageWidth)
-                    image = make_nd_array(data, shape, dtype=np.uint16, order="C")
-            err = self.lib.PiGentlSdkRequeueBuffer(self._handle, ImageInfos.hBuffer)
-            if err != CAM_ERR_SUCCESS:
-                raise Exception(f"PiGentlSdkRequeueBuffer: {err}")
-        else:
+        if metrics:
+            metrics.add("get_buffer", time.perf_counter() - start)
+        if err == CAM_ERR_TIMEOUT:
+            raise TimeoutError(f"getBuffer: {err}")
+        if err != CAM_ERR_SUCCESS:
+            if metrics:
+                metrics.count("errors")
             raise Exception(f"getBuffer: {err}")
+        if not ImageInfos.isNewData:
+            # nothing was written to the buffer, it goes back to the engine
+            self.lib.PiGentlSdkRequeueBuffer(self._handle, ImageInfos.hBuffer)
+            if metrics:
+                metrics.count("errors")
+            raise Exception("getBuffer: buffer without new data")
+        if metrics:
+            metrics.frame(ImageInfos)
+        arrival = time.perf_counter()
+        if self._acquisition_started is not None:
+            self.first_frame_latency = arrival - self._acquisition_started
+            self._acquisition_started = None
+        self._track_queue(ImageInfos, arrival)
+        return ImageInfos
+
+    def _requeue_buffer(self, ImageInfos):
+        """This function gives a buffer back to the input queue of the acquisition engine.
+        returns error code"""
+        metrics = self.metrics if self.metrics.enabled else None
+        if metrics:
+            start = time.perf_counter()
+        err = self.lib.PiGentlSdkRequeueBuffer(self._handle, ImageInfos.hBuffer)
+        if metrics:
+            metrics.add("requeue", time.perf_counter() - start)
+        if err != CAM_ERR_SUCCESS:
+            raise Exception(f"PiGentlSdkRequeueBuffer: {err}")
+        return err
+
+    @staticmethod
+    def _image_layout(ImageInfos):
+        """This function gets the shape and numpy type of the image held by a buffer.
+        returns (shape, dtype)"""
+        shape, dtype, _ = layout(ImageInfos.eImagePixelType, ImageInfos.iImageSize, ImageInfos.iImageHeight,
+                                 ImageInfos.iImageWidth)
+        return shape, dtype
+
+    def _decode(self, ImageInfos, out=None, copy=True):
+        """This function gets the image held by a buffer.
+        :param out: Optionally a preallocated array to decode into.
+        :param copy: If False and the pixel format does not need unpacking, return a view on the buffer.
+        returns the image"""
+        metrics = self.metrics if self.metrics.enabled else None
+        if metrics:
+            start = time.perf_counter()
+        raw = make_nd_array(ImageInfos.pDatas, (ImageInfos.iImageSize,), dtype=np.uint8, copy=False)
+        image = decode(raw, ImageInfos.eImagePixelType, ImageInfos.iImageHeight, ImageInfos.iImageWidth, out=out,
+                       copy=copy)
+        if metrics:
+            if layout(ImageInfos.eImagePixelType, ImageInfos.iImageSize, ImageInfos.iImageHeight,
+                      ImageInfos.iImageWidth)[2]:
+                stage = "unpack"
+            else:
+                stage = "copy" if copy or out is not None else "view"
+            metrics.add(stage, time.perf_counter() - start)
+        return image
+
+    def get_image(self, timeout=500000, out=None):
+        """This function get an image from preallocated buffer.
+        :param timeout: Maximum time to wait for an image.
+        :param out: Optionally a preallocated array, or a FramePool, the image is copied into. By default a new array
+                    is allocated for each image.
+        returns (error code, image)"""
+        if isinstance(out, FramePool):
+            out = out.next()
+        ImageInfos = self._get_buffer(timeout)
+        try:
+            image = self._decode(ImageInfos, out=out)
+        finally:
+            err = self._requeue_buffer(ImageInfos)
         return err, image
 
+    def get_frame(self, timeout=500000, out=None, log=None):
+        """This function gets an image with the metadata of its buffer.
+        :param timeout: Maximum time to wait for an image.
+        :param out: Optionally a preallocated array, or a FramePool, the image is copied into.
+        :param log: Optionally a FrameLog the metadata is appended to.
+        returns (error code, Frame)"""
+        if isinstance(out, FramePool):
+            out = out.next()
+        ImageInfos = self._get_buffer(timeout)
+        arrival = time.perf_counter()
+        try:
+            frame = Frame.from_infos(self._decode(ImageInfos, out=out), ImageInfos, arrival)
+        finally:
+            err = self._requeue_buffer(ImageInfos)
+        if log is not None:
+            log.append(frame)
+        return err, frame
+
+    def lease_image(self, timeout=500000):
+        """This function get an image without copying it out of the pigentl buffer.
+        :param timeout: Maximum time to wait for an image.
+        returns an ImageLease, whose image is valid until it is released
+        NOTE: The acquisition engine can not reuse the buffer while it is leased. Holding more leases than there are
+              buffers stalls the acquisition.
+        NOTE: Packed formats (Mono10p) can not be viewed in place, their image is unpacked into a new array."""
+        ImageInfos = self._get_buffer(timeout)
+        image = self._decode(ImageInfos, copy=False)
+        return ImageLease(self, ImageInfos, image)
+
+    def grabber(self, size=8, policy="drop-oldest", shape=None, dtype=None, log=None):
+        """This function creates a FrameGrabber running the acquisition on a dedicated thread.
+        :param size: Number of frames of the ring buffer.
+        :param policy: What to do when the ring is full: "drop-oldest", "drop-newest" or "block".
+        :param log: Optionally a FrameLog the metadata of every grabbed buffer is appended to.
+        returns the FrameGrabber, to start with start() or a with statement"""
+        from grabber import FrameGrabber
+
+        return FrameGrabber(self, shape=shape, dtype=dtype, size=size, policy=policy, log=log)
+
+    def stream(self, n=None, timeout=None, buffering=4, log=None):
+        """This function yields images as they are acquired, without holding the whole acquisition in memory.
+        The acquisition starts when the iteration begins and stops when the generator ends or is closed.
+        :param n: Number of images to acquire, None to stream until the generator is closed.
+        :param timeout: Maximum time to wait for each image in seconds, None to wait forever.
+        :param buffering: Number of images grabbed ahead of the consumer. Grabbing pauses while they are all waiting.
+        :param log: Optionally a FrameLog the metadata of every image is appended to.
+        NOTE: An image is only valid until the next one is requested, copy it to keep it."""
+        grabber = self.grabber(size=buffering, policy="block", log=log)
+        err = grabber.start()
+        if err != CAM_ERR_SUCCESS:
+            raise Exception(f"start_acquisition: {err}")
+        try:
+            count = 0
+            while n is None or count < n:
+                image = grabber.get(timeout)
+                if image is None:
+                    break
+                start = time.perf_counter()
+                yield image
+                # time the consumer spent on the image
+                if self.metrics.enabled:
+                    self.metrics.add("process", time.perf_counter() - start)
+                count += 1
+        finally:
+            grabber.stop()
+
     def get_error_text(self, error_code):
         """This function gets the text corresponding to an error.
         :param error_code:  The error.
@@ -236,7 +629,15 @@ class EvaluationKit:
         return err, buffer.raw.decode("latin-1").replace("\x00", "")
 
     def getSdkVersion(self, dll_path):
-        info = win32api.GetFileVersionInfo(dll_path, '\\')
+        # the version is read from the DLL resources, with pywin32 on Windows only
+        try:
+            import win32api
+        except ImportError:
+            return "unknown"
+        try:
+            info = win32api.GetFileVersionInfo(dll_path, '\\')
+        except Exception:
+            return "unknown"
         ms = info['FileVersionMS']
         ls = info['FileVersionLS']
         return f"{ms >> 16}.{ms & 0xFFFF}.{ls >> 16}.{ls & 0xFFFF}"
\ No newline at end of file
@@ -0,0 +1,151 @@
+import numpy as np
+
+TIMESTAMP_TICK = 1e-9  # duration of one unit of tImageInfos.iTimestamp in seconds
+
+# one record per frame, arrival being the time.perf_counter() when the buffer was retrieved
+FRAME_LOG_DTYPE = np.dtype(
+    [
+        ("block_id", "<u8"),
+        ("timestamp", "<u8"),
+        ("arrival", "<f8"),
+        ("incomplete", "u1"),
+        ("pixel_type", "<i4"),
+        ("contextual_data_size", "<u8"),
+    ]
+)
+
+
+class Frame:
+    """An image with the metadata of the pigentl buffer it was acquired in."""
+
+    __slots__ = ("image", "block_id", "timestamp", "arrival", "incomplete", "pixel_type", "contextual_data_size")
+
+    def __init__(self, image, block_id=0, timestamp=0, arrival=0.0, incomplete=False, pixel_type=0,
+                 contextual_data_size=0):
+        self.image = image
+        self.block_id = block_id
+        self.timestamp = timestamp
+        self.arrival = arrival
+        self.incomplete = incomplete
+        self.pixel_type = pixel_type
+        self.contextual_data_size = contextual_data_size
+
+    @classmethod
+    def from_infos(cls, image, ImageInfos, arrival=0.0):
+        # frame described by the tImageInfos of its buffer
+        return cls(image, ImageInfos.iBlockId, ImageInfos.iTimestamp, arrival, bool(ImageInfos.isIncomplete),
+                   ImageInfos.eImagePixelType, ImageInfos.iContextualDataSize)
+
+    @property
+    def time(self):
+        # sensor timestamp in seconds
+        return self.timestamp * TIMESTAMP_TICK
+
+    def __repr__(self):
+        return (f"Frame(block_id={self.block_id}, timestamp={self.timestamp}, incomplete={self.incomplete}, "
+                f"shape={getattr(self.image, 'shape', None)})")
+
+
+class FrameLog:
+    """Metadata of every frame of an acquisition in a numpy structured array, one column per field.
+    Appending costs one record assignment, the analysis (gaps, jitter) is vectorized over the whole run."""
+
+    def __init__(self, capacity=1024):
+        """Constructor
+        :param capacity: Number of records allocated first, the log doubles its size when it is full."""
+        self._records = np.zeros(capacity, dtype=FRAME_LOG_DTYPE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def records(self):
+        # view of the filled records
+        return self._records[: self.count]
+
+    def append(self, frame):
+        """This function appends the metadata of a frame.
+        :param frame: The Frame."""
+        self._append((frame.block_id, frame.timestamp, frame.arrival, frame.incomplete, frame.pixel_type,
+                      frame.contextual_data_size))
+
+    def append_infos(self, ImageInfos, arrival=0.0):
+        """This function appends the metadata of a pigentl buffer.
+        :param ImageInfos: The tImageInfos of the buffer.
+        :param arrival: time.perf_counter() when the buffer was retrieved."""
+        self._append((ImageInfos.iBlockId, ImageInfos.iTimestamp, arrival, ImageInfos.isIncomplete,
+                      ImageInfos.eImagePixelType, ImageInfos.iContextualDataSize))
+
+    def _append(self, record):
+        if self.count == len(self._records):
+            self._records = np.resize(self._records, 2 * len(self._records))
+        self._records[self.count] = record
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def intervals(self):
+        """This function gets the time between consecutive frames, from the sensor timestamps.
+        returns array of count - 1 intervals in seconds"""
+        return np.diff(self.records["timestamp"].astype(np.int64)) * TIMESTAMP_TICK
+
+    def gaps(self):
+        """This function flags the frames that do not follow the previous one, i.e. frames were lost before them.
+        returns boolean array, one flag per record"""
+        flags = np.zeros(self.count, dtype=bool)
+        flags[1:] = np.diff(self.records["block_id"].astype(np.int64)) != 1
+        return flags
+
+    def lost(self):
+        """This function counts the frames missing from the block id sequence.
+        returns the number of lost frames"""
+        steps = np.diff(self.records["block_id"].astype(np.int64))
+        return int(np.sum(steps[steps > 1] - 1))
+
+    def jitter(self, tolerance=0.1):
+        """This function flags the frames whose interval from the previous frame deviates from the median interval.
+        Intervals that span a gap are compared with the median interval times the number of missing frames.
+        :param tolerance: Accepted deviation, relative to the median interval.
+        returns boolean array, one flag per record"""
+        flags = np.zeros(self.count, dtype=bool)
+        if self.count < 3:
+            return flags
+        intervals = self.intervals()
+        steps = np.maximum(np.diff(self.records["block_id"].astype(np.int64)), 1)
+        period = np.median(intervals / steps)
+        flags[1:] = np.abs(intervals - steps * period) > tolerance * period
+        return flags
+
+    def summary(self, tolerance=0.1):
+        """This function summarizes the log.
+        :param tolerance: Tolerance of the jitter flags, see jitter().
+        returns dict of the numbers of frames, gaps, lost, incomplete and jittered frames, the frame rate and the
+                standard deviation of the intervals in ms"""
+        intervals = self.intervals()
+        steps = np.maximum(np.diff(self.records["block_id"].astype(np.int64)), 1)
+        periods = intervals / steps if len(intervals) else np.zeros(0)
+        return {
+            "frames": self.count,
+            "gaps": int(np.count_nonzero(self.gaps())),
+            "lost": self.lost(),
+            "incomplete": int(np.count_nonzero(self.records["incomplete"])),
+            "jitter": int(np.count_nonzero(self.jitter(tolerance))),
+            "fps": float(1 / np.median(periods)) if len(periods) and np.median(periods) > 0 else 0.0,
+            "interval std": float(np.std(periods) * 1e3) if len(periods) else 0.0,
+        }
+
+    def save(self, path):
+        """This function saves the records in a .npy file."""
+        np.save(path, self.records)
+
+    @classmethod
+    def load(cls, path):
+        """This function loads records saved by save().
+        returns the FrameLog"""
+        records = np.load(path)
+        log = cls(max(len(records), 1))
+        log._records[: len(records)] = records
+        log.count = len(records)
+        return log
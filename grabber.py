@@ -0,0 +1,300 @@
+import threading
+import time
+from collections import deque
+from evaluationkit import *
+
+# what to do with a new image when every frame of the ring is waiting to be consumed
+OVERFLOW_POLICIES = ("drop-oldest", "drop-newest", "block")
+GRAB_MAX_ERRORS = 10  # consecutive failures to grab a buffer after which the grab thread gives up, timeouts excluded
+GRAB_BACKOFF = (0.001, 0.1)  # first and longest wait in seconds after a failure, doubled on each consecutive one
+
+
+class FrameGrabber:
+    """Grabs images on a dedicated thread into a fixed-size ring of preallocated frames.
+    PiGentlSdkGetBuffer/PiGentlSdkRequeueBuffer run on the grab thread (ctypes releases the GIL while waiting), so a
+    slow consumer never delays the requeue of the pigentl buffers. The lock only guards the ring indexes, it is never
+    held while waiting for the SDK or copying an image."""
+
+    def __init__(self, ek, shape=None, dtype=None, size=8, policy="drop-oldest", timeout=500000, log=None,
+                 max_errors=GRAB_MAX_ERRORS):
+        """Constructor
+        :param ek: The EvaluationKit to grab from.
+        :param shape: Shape of the images. If None, the ring is allocated when the first image arrives.
+        :param dtype: Numpy type of the images.
+        :param size: Number of frames the ring can hold before the overflow policy applies.
+        :param policy: One of OVERFLOW_POLICIES. "drop-oldest" overwrites the oldest waiting frame, "drop-newest"
+                       discards the incoming image and "block" stops grabbing until a frame is consumed.
+        :param timeout: Timeout of each PiGentlSdkGetBuffer call, same unit as get_image.
+        :param log: Optionally a FrameLog the metadata of every grabbed buffer is appended to, dropped ones included.
+        :param max_errors: Number of consecutive failures to get, copy or requeue a buffer (e.g. camera lost) after
+                           which the grab thread stops, get() then raises the last error once the ring is empty.
+                           PiGentlSdkGetBuffer timeouts are not failures."""
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy}, expected one of {OVERFLOW_POLICIES}")
+        if size < 1:
+            raise ValueError("FrameGrabber needs at least one frame")
+        self.ek = ek
+        self.size = size
+        self.policy = policy
+        self.timeout = timeout
+        self.log = log
+        self.max_errors = max_errors
+        # one frame more than the ring size: the frame handed to the consumer is never overwritten
+        self._frames = None
+        if shape is not None:
+            self._frames = np.zeros((size + 1,) + tuple(shape), dtype=dtype)
+        # metadata of each frame: block id, sensor timestamp and host time when PiGentlSdkGetBuffer returned
+        self._block_ids = np.zeros(size + 1, dtype=np.uint64)
+        self._timestamps = np.zeros(size + 1, dtype=np.uint64)
+        self._arrivals = np.zeros(size + 1, dtype=np.float64)
+        # smallest (host time - sensor time) seen, maps sensor timestamps to the host clock
+        self.clock_offset = None
+        self._free = deque(range(size + 1))
+        self._filled = deque()
+        self._held = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._own_acquisition = False
+        self.produced = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_error = None
+        # error that stopped the grab thread, raised by get() and latest()
+        self.failure = None
+
+    def __enter__(self):
+        err = self.start()
+        if err != CAM_ERR_SUCCESS:
+            raise Exception(f"FrameGrabber.start: {err}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def pending(self):
+        # number of frames grabbed and not consumed yet
+        with self._cond:
+            return len(self._filled)
+
+    def stats(self):
+        return {
+            "produced": self.produced,
+            "consumed": self.consumed,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "pending": self.pending,
+            "first frame latency": self.ek.first_frame_latency,
+            "queue occupancy": self.ek.occupancy,
+        }
+
+    def start(self, acquisition=True):
+        """This function starts the grab thread.
+        :param acquisition: Also start the acquisition engine, and stop it in stop().
+        returns error code"""
+        if self._running:
+            return CAM_ERR_SUCCESS
+        if self._thread is not None:
+            # the grab thread gave up on errors, release the acquisition it started
+            self.stop()
+        self.failure = None
+        if acquisition:
+            err = self.ek.start_acquisition()
+            if err != CAM_ERR_SUCCESS:
+                return err
+        self._own_acquisition = acquisition
+        self._running = True
+        self._thread = threading.Thread(target=self._grab_loop, name="FrameGrabber", daemon=True)
+        self._thread.start()
+        return CAM_ERR_SUCCESS
+
+    def stop(self):
+        """This function stops the grab thread, and the acquisition engine if start() started it.
+        Frames already grabbed can still be consumed with get().
+        returns error code"""
+        if self._thread is None:
+            return CAM_ERR_SUCCESS
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        err = CAM_ERR_SUCCESS
+        if self._own_acquisition:
+            # stopping the engine also wakes up a pending PiGentlSdkGetBuffer
+            err = self.ek.stop_acquisition()
+        self._thread.join()
+        self._thread = None
+        return err
+
+    def get(self, timeout=None):
+        """This function returns the oldest frame of the ring.
+        :param timeout: Maximum time to wait for a frame in seconds, None to wait forever.
+        returns the frame, or None when the grabber is stopped and the ring is empty
+        NOTE: The frame belongs to the ring. It stays valid until the next call to get() or release().
+        NOTE: Raises the error that stopped the grab thread once the frames grabbed before it are consumed."""
+        with self._cond:
+            self._release_held()
+            if not self._cond.wait_for(lambda: self._filled or not self._running, timeout):
+                raise TimeoutError(f"FrameGrabber.get: no frame within {timeout} s")
+            if not self._filled:
+                self._raise_failure()
+                return None
+            self._held = self._filled.popleft()
+            self.consumed += 1
+            self._cond.notify_all()
+            return self._frames[self._held]
+
+    def latest(self, timeout=None):
+        """This function returns the newest frame of the ring, the older waiting frames are skipped.
+        :param timeout: Maximum time to wait for a frame in seconds, None to wait forever.
+        returns the frame, or None when the grabber is stopped and the ring is empty
+        NOTE: The frame belongs to the ring. It stays valid until the next call to get(), latest() or release()."""
+        with self._cond:
+            self._release_held()
+            if not self._cond.wait_for(lambda: self._filled or not self._running, timeout):
+                raise TimeoutError(f"FrameGrabber.latest: no frame within {timeout} s")
+            if not self._filled:
+                self._raise_failure()
+                return None
+            while len(self._filled) > 1:
+                self._free.append(self._filled.popleft())
+                self.skipped += 1
+            self._held = self._filled.popleft()
+            self.consumed += 1
+            self._cond.notify_all()
+            return self._frames[self._held]
+
+    def frame_info(self):
+        """This function gets the metadata of the frame returned by get() or latest().
+        returns dict(block_id, timestamp, arrival), arrival being the time.perf_counter() of the grab"""
+        with self._cond:
+            if self._held is None:
+                return None
+            return {
+                "block_id": int(self._block_ids[self._held]),
+                "timestamp": int(self._timestamps[self._held]),
+                "arrival": float(self._arrivals[self._held]),
+            }
+
+    def latency(self, now=None):
+        """This function estimates the time since the sensor produced the frame returned by get() or latest().
+        The sensor clock is mapped on time.perf_counter() with the smallest transfer delay seen, so the latency
+        is measured relative to the fastest frame of the acquisition.
+        returns (sensor to now latency, grab to now latency) in seconds"""
+        info = self.frame_info()
+        if info is None or self.clock_offset is None:
+            return None, None
+        if now is None:
+            now = time.perf_counter()
+        sensor_time = info["timestamp"] * TIMESTAMP_TICK + self.clock_offset
+        return now - sensor_time, now - info["arrival"]
+
+    def release(self):
+        """This function gives the frame returned by get() back to the ring."""
+        with self._cond:
+            self._release_held()
+            self._cond.notify_all()
+
+    def _raise_failure(self):
+        if self.failure is not None:
+            raise Exception(f"FrameGrabber: {self.max_errors} consecutive errors, last one: {self.failure}") \
+                from self.failure
+
+    def _release_held(self):
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+
+    def _acquire_slot(self):
+        # returns the index of the frame to fill, or None to drop the incoming image
+        with self._cond:
+            if not self._free and self.policy == "block":
+                self._cond.wait_for(lambda: self._free or not self._running)
+            if self._free:
+                return self._free.popleft()
+            if not self._running:
+                return None
+            if self.policy == "drop-oldest" and self._filled:
+                self.dropped += 1
+                return self._filled.popleft()
+            self.dropped += 1
+            return None
+
+    def _fail(self, consecutive, error):
+        # returns True when the grab thread has to stop, after waiting before the next attempt
+        self.errors += 1
+        self.last_error = error
+        with self._cond:
+            if consecutive >= self.max_errors:
+                self.failure = error
+                self._running = False
+                self._cond.notify_all()
+                return True
+            backoff = min(GRAB_BACKOFF[0] * 2 ** (consecutive - 1), GRAB_BACKOFF[1])
+            self._cond.wait_for(lambda: not self._running, backoff)
+            return False
+
+    def _store(self, ImageInfos, arrival):
+        # copies a buffer into a frame of the ring, returns the exception raised on the way or None
+        slot = None
+        try:
+            if self.log is not None:
+                self.log.append_infos(ImageInfos, arrival)
+            shape, dtype = self.ek._image_layout(ImageInfos)
+            if self._frames is None:
+                self._frames = np.zeros((self.size + 1,) + tuple(shape), dtype=dtype)
+            slot = self._acquire_slot()
+            if slot is not None:
+                self.ek._decode(ImageInfos, out=self._frames[slot])
+                offset = arrival - ImageInfos.iTimestamp * TIMESTAMP_TICK
+                with self._cond:
+                    self._block_ids[slot] = ImageInfos.iBlockId
+                    self._timestamps[slot] = ImageInfos.iTimestamp
+                    self._arrivals[slot] = arrival
+                    if self.clock_offset is None or offset < self.clock_offset:
+                        self.clock_offset = offset
+                    self._filled.append(slot)
+                    self.produced += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            if slot is not None:
+                with self._cond:
+                    self._free.append(slot)
+            return e
+        return None
+
+    def _grab_loop(self):
+        consecutive = 0
+        while self._running:
+            try:
+                ImageInfos = self.ek._get_buffer(self.timeout)
+                arrival = time.perf_counter()
+            except TimeoutError:
+                # no frame within the timeout, e.g. waiting for an external trigger, is not a failure
+                continue
+            except Exception as e:
+                # stopping the acquisition also fails the pending call
+                if not self._running:
+                    break
+                consecutive += 1
+                if self._fail(consecutive, e):
+                    break
+                continue
+            error = self._store(ImageInfos, arrival)
+            try:
+                self.ek._requeue_buffer(ImageInfos)
+            except Exception as e:
+                error = error or e
+            if error is None:
+                consecutive = 0
+                continue
+            consecutive += 1
+            if self._fail(consecutive, error):
+                break
@@ -6,8 +6,10 @@ Created on July 2025
 """
 from sensor import *
 from utils import *
-from time import sleep
-from PIL import Image
+from writer import ImageWriter
+from sequence import SequenceWriter
+from frames import FrameLog
+from defects import DefectMap
 
 # USER PARAMETERS
 from sensor import Topaz
@@ -15,6 +17,7 @@ from sensor import Topaz
 NIMAGES = 5  # Number of images to be acquired
 INTERVAL_PLOT = 0.0001  # Refresh rate in ms
 EXPOSURE_TIME = 25  # Integration time in ms
+DEFECT_MAP = None  # Optionally a defect map saved by DefectMap.save, e.g. "EK-defects.npz"
 
 #  SIMPLE OBJECT CREATION AND IMAGE ACQUISITION
 if __name__ == "__main__":
@@ -30,85 +33,91 @@ if __name__ == "__main__":
         addr = 0x7F
         rval = camera.read_sensor_reg(addr)  # Read chipID
         print("RD 0x{:02x} = 0x{:04x}".format(addr, rval))
-        sleep(0.5)
 
         # Setup camera format
         camera.set_camera_format(10) #10b format
         #camera.set_camera_format(8)  #8b format
 
+        # Size the buffers for the frame size and rate instead of NBUFFER, sized again when the format changes
+        #camera.auto_buffers(fps=100)
+
         # Activate external trigger
         #camera.set_trigger_mode(2)
         #camera.set_trigger_source(2)
 
-        # Pixel format and acquisition image size
-        if camera.pixel_format == "RGB24":
-            shape = (NIMAGES, camera.sensor_height, camera.sensor_width * 3)
-        else:
-            shape = (NIMAGES, camera.sensor_height, camera.sensor_width)
-        im = np.zeros(shape, dtype=xml_pixel_format_nptypes[camera.pixel_format])
-
         # Get current setting
         print_info(camera)
 
+        #to play with numpy and matplotlib: image and profiles, redrawn at most 20 times per second
+        viewer = ImageViewer(cmap=xml_pixel_format_cmap[camera.pixel_format], profiles=True, fps=20)
+
+        # hot and dead pixels are replaced by their neighbours before the statistics
+        defects = DefectMap.load(DEFECT_MAP) if DEFECT_MAP else None
+
+        # images are saved on background threads
+        writer = ImageWriter()
+
         # define a parameter to sweep - example with exposure in ms
+        # The acquisition runs once for the whole sweep, the transition frames after each change are discarded
         param_exposure = [10]
-        for p in param_exposure:
-            camera.exposure_time = p
+        # block id and timestamp of every frame, to check for lost frames afterwards
+        frame_log = FrameLog()
+        sweep = camera.sweep([{"exposure_time": p} for p in param_exposure], NIMAGES, log=frame_log)
+        for step, settings, frames in sweep:
+            p = settings["exposure_time"]
             print("\nparam: exposure=" + str(p))
-            sleep(0.1)
 
             # Image acquisition - NBIMAGES (for each parameter step)
+            # Images are processed while the next ones are acquired, only a few images are held in memory
             print("\nImage acquisition:")
-            if camera.start_acquisition() == 0:
-                NBImageAcquired = 0
-                for i in range(0, NIMAGES):
-                    # Get image from internal buffer
-                    im[i, :, :] = camera.get_image()[1]
-                    NBImageAcquired += 1
-                    print("\r\t" + str(NBImageAcquired) + "/" + str(NIMAGES) + " images acquired", end="\t\t\t")
-                print("")
-
-                # Terminate acquisition and start image processing
-                if camera.stop_acquisition() == 0:
-                    NBImageAcquired = 0
-
-                    #to play with numpy and matplotlib
-                    fig = init_figure(camera)
-
-                for i in range(0, NIMAGES):
-                    NBImageAcquired += 1
-
-                    """
-                    Insert your processing code here
-                    image is the current image acquired
-                    """
-
-                    image = image_rearange(im[i, :, :], camera.pixel_format)
-
-                    imageProfile(image)
-                    update_figure(fig, image, INTERVAL_PLOT, NBImageAcquired)
-
-                    print("\r\t\tEK-image_" + "exp-" + str(p) + "_" + str(NBImageAcquired))
-                    print("\t\t\tMin={}".format(np.min(image)))
-                    print("\t\t\tMax={} ".format(np.max(image)))
-                    print("\t\t\tMean={:.2f} ".format(np.mean(image)))
-                    print("\t\t\tStdDev={:.2f} ".format(np.std(image)))
-
-                    # SAVE IMAGE: RAW FORMAT
-                    imgName = "EK-image_" + "exp-" + str(p) + "_" + str(NBImageAcquired) + ".raw"
-                    with open(imgName, "wb") as f:
-                        f.write(image.tobytes())
-
-                    # SAVE IMAGE: TIFF FORMAT
-                    # Convert to PIL object to save image in a tiff file
-                    img = Image.fromarray(image, )
-                    imgName = "EK-image_" + "exp-" + str(p) + "_" + str(NBImageAcquired) + ".tiff"
-                    img.save(imgName)
-                    print("\r\t" + str(NBImageAcquired) + "/" + str(NIMAGES) + " images processed")
-                    # This method will show image in any image viewer
-                    # img.show()
-            else:
-                raise Exception("Image acquisition error. Please reboot the camera")
+            NBImageAcquired = 0
+            # RAW images of this step are appended to a single sequence file, see sequence.SequenceReader
+            sequence = SequenceWriter.for_camera("EK-sequence_" + "exp-" + str(p) + ".eks", camera)
+            # per-pixel temporal statistics of this step, updated frame by frame
+            temporal = TemporalStats()
+            for frame in frames:
+                NBImageAcquired += 1
+                print("\r\t" + str(NBImageAcquired) + "/" + str(NIMAGES) + " images acquired")
+
+                """
+                Insert your processing code here
+                image is the current image acquired
+                """
+
+                image = image_rearange(frame, camera.pixel_format)
+                if defects is not None:
+                    defects.apply(image)
+
+                viewer.update(image, "#" + str(NBImageAcquired))
+
+                print("\r\t\tEK-image_" + "exp-" + str(p) + "_" + str(NBImageAcquired))
+                print("\t\t\tMin={}".format(np.min(image)))
+                print("\t\t\tMax={} ".format(np.max(image)))
+                print("\t\t\tMean={:.2f} ".format(np.mean(image)))
+                print("\t\t\tStdDev={:.2f} ".format(np.std(image)))
+                temporal.update(image)
+
+                # SAVE IMAGE: RAW FORMAT
+                info = sweep.grabber.frame_info()
+                sequence.append(frame, info["block_id"], info["timestamp"], exposure=p)
+
+                # SAVE IMAGE: TIFF FORMAT
+                # image is a new array for each frame, the writer does not need its own copy
+                imgName = "EK-image_" + "exp-" + str(p) + "_" + str(NBImageAcquired) + ".tiff"
+                writer.write(imgName, image, copy=False)
+                print("\r\t" + str(NBImageAcquired) + "/" + str(NIMAGES) + " images processed")
+            sequence.close()
+            if temporal.count > 1:
+                print("\tTemporal noise={:.2f} ".format(temporal.temporal_noise()))
+
+        print("Sweep: {} images, {} transition images discarded".format(sweep.captured, sweep.discarded))
+        print("Frames: {}".format(frame_log.summary()))
+
+        # Wait for the last images to be saved
+        writer.close()
+        print("Writer: {}".format(writer.stats()))
+        # time spent in each stage of the acquisition, to compare runs
+        camera.metrics.to_json("EK-metrics.json")
 
         # Terminate connection
         camera.close()
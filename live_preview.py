@@ -6,8 +6,7 @@ Created on July 2025
 """
 from sensor import *
 from utils import *
-from time import sleep
-from PIL import Image
+from writer import ImageWriter
 
 # USER PARAMETERS
 from sensor import Topaz
@@ -19,6 +18,8 @@ import numpy as np
 
 INTERVAL_PLOT = 0.0001  # Refresh rate in ms
 EXPOSURE_TIME = 6  # Integration time in ms
+DISPLAY_SIZE = (1280, 720)  # Maximum size of the preview window (width, height)
+AUTO_CONTRAST = (1, 99)  # Percentiles displayed as black and white, None for the full code range
 
 #Mouse drag & drop
 drawing = False
@@ -70,7 +71,6 @@ if __name__ == "__main__":
         addr = 0x7F
         rval = camera.read_sensor_reg(addr)  # Read chipID
         print("RD 0x{:02x} = 0x{:04x}".format(addr, rval))
-        sleep(0.5)
 
         # Setup camera format
         camera.set_camera_format(10) #10b format
@@ -80,11 +80,10 @@ if __name__ == "__main__":
         camera.exposure_time= EXPOSURE_TIME
 
 
-        # Pixel format and acquisition image size
-        if camera.pixel_format == "RGB24":
-            shape = (camera.sensor_height, camera.sensor_width * 3)
-        else:
-            shape = (camera.sensor_height, camera.sensor_width)
+        # Images are grabbed on a background thread, the preview always shows the newest one and skips the others
+        grabber = camera.grabber(size=4, policy="drop-oldest")
+        acquired_fps = RateMeter()
+        displayed_fps = RateMeter()
 
         # Get current setting
         print_info(camera)
@@ -93,17 +92,25 @@ if __name__ == "__main__":
         print("\nLive preview start")
         preview = True
 
-        if camera.start_acquisition() == 0:
+        if grabber.start() == 0:
             NBImageAcquired = 0
             NBImageSaved = 0
+            writer = ImageWriter(workers=1)
+            roi_stats = RoiStats(decimation=1)
+            # 10b/8b codes to display bytes through a LUT, on an image decimated to the window size
+            color = camera.pixel_format == "RGB24"
+            tone = ToneMapper(bits=8 if camera.frame_dtype == np.uint8 else 10, auto=AUTO_CONTRAST,
+                              max_size=DISPLAY_SIZE)
+            # mono images are displayed as 8b gray, the overlay is drawn in white
+            overlay_color = (0, 255, 0) if color else 255
             # fig = init_figure(camera)
             cv2.namedWindow('Live preview', cv2.WINDOW_AUTOSIZE)
             cv2.setMouseCallback('Live preview', mouse_callback)
             cv2.createTrackbar("Exposure", 'Live preview', 1, 500, change_exposure)
 
             while preview:
-                # Get image from internal buffer
-                im = camera.get_image()[1]
+                # Newest image grabbed, stale ones are skipped
+                im = grabber.latest()
                 NBImageAcquired += 1
 
                 """
@@ -116,27 +123,29 @@ if __name__ == "__main__":
                     control = False
 
                 # IMAGE PROCESS
-                if(roi and (not drawing)):
-                    mean = np.mean(imageRoi(im,roi))
-                    sigma = np.std(imageRoi(im,roi))
-                    sharp = sharpness(imageRoi(im,roi))
-                else:
-                    mean = np.mean(im)
-                    sigma = np.std(im)
-                    sharp = sharpness(im)
+                # statistics of the ROI, or of the whole image, in one pass per statistic over a cached view
+                roi_stats.set_rois([[tone.to_image(p) for p in roi]] if roi and (not drawing) else [])
+                stats = roi_stats.compute(im)[0]
+                mean, sigma, sharp = stats["mean"], stats["std"], stats["sharpness"]
 
                 # DISPLAY
-                image_rgb = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+                # RGB24 is shown through a BGR view for OpenCV, no color conversion
+                display = tone.apply(rgb24_view(im)[:, :, ::-1] if color else im)
                 # text overlay
                 text = "Mean={:.2f} | StdDev={:.2f} | Sharpness={:.2f}".format(mean, sigma, sharp)
-                cv2.putText(image_rgb, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2, cv2.LINE_AA)
-                # ROI selection
+                cv2.putText(display, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, overlay_color, 2, cv2.LINE_AA)
+                # sensor to screen latency, displayed vs acquired frame rate
+                latency = grabber.latency()[0]
+                text = "Latency={:.1f} ms | Display={:.1f} fps | Acquisition={:.1f} fps".format(
+                    (latency or 0) * 1e3, displayed_fps.update(NBImageAcquired), acquired_fps.update(grabber.produced))
+                cv2.putText(display, text, (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 0.8, overlay_color, 2, cv2.LINE_AA)
+                # ROI selection, in display coordinates
                 if start_point and end_point:
                     roi=[start_point, end_point]
-                    cv2.rectangle(image_rgb, start_point, end_point, (0, 255, 0), 2)
+                    cv2.rectangle(display, start_point, end_point, overlay_color, 2)
                 else:
                     roi = None
-                cv2.imshow('Live preview', image_rgb)
+                cv2.imshow('Live preview', display)
 
                 k=cv2.waitKey(1)
                 if k == ord('q') or k == 27:
@@ -145,16 +154,17 @@ if __name__ == "__main__":
                 elif k == ord('s'):
                     imgName = "EK-image_" + str(NBImageSaved) + ".raw"
                     NBImageSaved += 1
-                    with open(imgName, "wb") as f:
-                        f.write(im.tobytes())
+                    writer.write(imgName, im)
 
                 # imageProfile(im)
                 # update_figure(fig, im, INTERVAL_PLOT, NBImageAcquired)
 
             # Terminate acquisition
             cv2.destroyAllWindows()
-            if camera.stop_acquisition() == 0:
+            writer.close()
+            if grabber.stop() == 0:
                 NBImageAcquired = 0
+            print("Grabber: {}".format(grabber.stats()))
 
         else:
             raise Exception("Image acquisition error. Please reboot the camera")
@@ -0,0 +1,169 @@
+import csv
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# percentiles reported for each stage
+METRICS_PERCENTILES = (50, 90, 99)
+# counters of every Metrics, other counters can be added with count()
+METRICS_COUNTERS = ("frames", "bytes", "incomplete", "gaps", "lost", "errors")
+# columns of to_csv, the header and the rows are both written from this list
+METRICS_CSV_FIELDS = (("time", "elapsed", "fps", "MB/s") + METRICS_COUNTERS + ("stage", "count", "mean", "max")
+                      + tuple(f"p{p}" for p in METRICS_PERCENTILES))
+
+
+class StageTimer:
+    """Durations of a pipeline stage: totals since the last reset and a rolling window for the percentiles."""
+
+    def __init__(self, window=1024, scale=1e3):
+        """Constructor
+        :param window: Number of most recent durations kept for the percentiles.
+        :param scale: Factor applied to the summary, 1e3 for durations in ms."""
+        self.scale = scale
+        self._samples = np.zeros(window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self._samples[self.count % len(self._samples)] = duration
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def summary(self):
+        """This function summarizes the stage, durations in ms.
+        returns dict of count, mean, max and the METRICS_PERCENTILES of the rolling window"""
+        result = {"count": self.count, "mean": self.total / self.count * self.scale if self.count else 0.0,
+                  "max": self.max * self.scale}
+        samples = self._samples[: min(self.count, len(self._samples))]
+        values = (np.percentile(samples, METRICS_PERCENTILES) * self.scale if len(samples)
+                  else [0.0] * len(METRICS_PERCENTILES))
+        for p, value in zip(METRICS_PERCENTILES, values):
+            result[f"p{p}"] = float(value)
+        return result
+
+
+class Metrics:
+    """Low overhead instrumentation of the acquisition pipeline.
+    Stages are timed with time.perf_counter by the code that runs them:
+        if metrics.enabled:
+            start = time.perf_counter()
+        ...
+        if metrics.enabled:
+            metrics.add("copy", time.perf_counter() - start)
+    Set enabled to False to skip all of it. Each EvaluationKit has its own Metrics, camera.metrics."""
+
+    def __init__(self, enabled=True, window=1024):
+        """Constructor
+        :param enabled: Record the metrics.
+        :param window: Number of most recent durations kept for the percentiles of each stage."""
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """This function clears all the metrics."""
+        with self._lock:
+            self._stages = {}
+            self._values = {}
+            self.counters = dict.fromkeys(METRICS_COUNTERS, 0)
+            self._last_block_id = None
+            self._started = time.perf_counter()
+
+    def add(self, stage, duration):
+        """This function records the duration of a stage.
+        :param stage: Name of the stage, e.g. "get_buffer", "copy", "unpack", "requeue", "process".
+        :param duration: Duration in seconds."""
+        with self._lock:
+            timer = self._stages.get(stage)
+            if timer is None:
+                timer = self._stages[stage] = StageTimer(self.window)
+            timer.add(duration)
+
+    def sample(self, name, value):
+        """This function records a value that is not a duration, e.g. the output queue occupancy.
+        :param name: Name of the value.
+        :param value: The value."""
+        with self._lock:
+            timer = self._values.get(name)
+            if timer is None:
+                timer = self._values[name] = StageTimer(self.window, scale=1)
+            timer.add(value)
+
+    def count(self, name, n=1):
+        """This function increments a counter.
+        :param name: Name of the counter.
+        :param n: Increment."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def frame(self, ImageInfos):
+        """This function counts a retrieved buffer: frames, bytes, incomplete buffers and block id gaps.
+        :param ImageInfos: tImageInfos of the buffer."""
+        with self._lock:
+            counters = self.counters
+            counters["frames"] += 1
+            counters["bytes"] += ImageInfos.iImageSize
+            if ImageInfos.isIncomplete:
+                counters["incomplete"] += 1
+            block_id = ImageInfos.iBlockId
+            if self._last_block_id is not None and block_id > self._last_block_id + 1:
+                counters["gaps"] += 1
+                counters["lost"] += block_id - self._last_block_id - 1
+            self._last_block_id = block_id
+
+    def snapshot(self):
+        """This function gets the current state of the metrics.
+        returns dict of the elapsed time, the frame and byte rates, the counters, a summary of each stage and of each
+                sampled value"""
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            return {
+                "time": time.time(),
+                "elapsed": elapsed,
+                "fps": self.counters["frames"] / elapsed if elapsed > 0 else 0.0,
+                "MB/s": self.counters["bytes"] / elapsed / 1e6 if elapsed > 0 else 0.0,
+                "counters": dict(self.counters),
+                "stages": {name: timer.summary() for name, timer in self._stages.items()},
+                "samples": {name: timer.summary() for name, timer in self._values.items()},
+            }
+
+    def to_json(self, path=None):
+        """This function exports a snapshot as JSON.
+        :param path: Optionally the file to write.
+        returns the JSON text"""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_csv(self, path):
+        """This function appends a snapshot to a CSV file, one row per stage and sampled value, to follow the metrics
+        over time. The columns are METRICS_CSV_FIELDS, counters that are not in METRICS_COUNTERS only go to to_json.
+        :param path: The CSV file, its header is written when it is created."""
+        snapshot = self.snapshot()
+        values = {name: snapshot[name] for name in ("time", "elapsed", "fps", "MB/s")}
+        values.update(snapshot["counters"])
+        try:
+            new_file = os.path.getsize(path) == 0
+        except OSError:
+            new_file = True
+        if not new_file:
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), None)
+            if header != list(METRICS_CSV_FIELDS):
+                raise Exception(f"{path} has other columns than METRICS_CSV_FIELDS: {header}")
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(METRICS_CSV_FIELDS)
+            summaries = dict(snapshot["stages"], **snapshot["samples"])
+            rows = [dict(values, stage=stage, **summary) for stage, summary in summaries.items()] or [values]
+            for row in rows:
+                writer.writerow([row.get(name, "") for name in METRICS_CSV_FIELDS])
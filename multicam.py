@@ -0,0 +1,141 @@
+from evaluationkit import *
+from sensor import Topaz
+
+# how frames of different cameras are matched: same block id (cameras triggered together) or close sensor timestamps
+MATCH_MODES = ("block_id", "timestamp")
+
+
+class MultiCamera:
+    """Acquires several cameras at once, each one grabbed by its own FrameGrabber thread, and groups their frames into
+    synchronized sets. The grab threads run in parallel (ctypes releases the GIL while waiting for the SDK), only the
+    matching of the sets runs in the consumer loop:
+        with MultiCamera(["serial-1", "serial-2"]) as cameras:
+            for frames in cameras.stream(100):
+                left, right = frames[0].image, frames[1].image"""
+
+    def __init__(self, cameras=None, match="timestamp", tolerance=0.001, size=8, policy="block", cls=Topaz, **kwargs):
+        """Constructor
+        :param cameras: List of camera indexes or serial numbers. By default all the cameras found.
+        :param match: One of MATCH_MODES. "block_id" needs the cameras to be started before the first trigger,
+                      "timestamp" compares the sensor timestamps mapped on the host clock.
+        :param tolerance: Maximum difference in seconds between the timestamps of a set.
+        :param size: Number of frames of the ring of each grabber.
+        :param policy: Overflow policy of each grabber, see grabber.OVERFLOW_POLICIES.
+        :param cls: Class of the cameras.
+        :param kwargs: Other arguments of the camera constructor, e.g. dll_path."""
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode {match}, expected one of {MATCH_MODES}")
+        self.match = match
+        self.tolerance = tolerance
+        self.cameras = []
+        try:
+            first = cls(camera=0 if cameras is None else cameras[0], **kwargs)
+            self.cameras.append(first)
+            if cameras is None:
+                cameras = range(len(first.cameras))
+            for camera in list(cameras)[1:]:
+                self.cameras.append(cls(camera=camera, **kwargs))
+        except Exception:
+            self.close()
+            raise
+        self.grabbers = [camera.grabber(size=size, policy=policy) for camera in self.cameras]
+        # frames skipped because no frame of the other cameras matched them
+        self.unmatched = 0
+        self.sets = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def start(self):
+        """This function starts the acquisition of all the cameras.
+        returns the first error code"""
+        for grabber in self.grabbers:
+            err = grabber.start()
+            if err != CAM_ERR_SUCCESS:
+                self.stop()
+                return err
+        return CAM_ERR_SUCCESS
+
+    def stop(self):
+        """This function stops the acquisition of all the cameras.
+        returns the first error code"""
+        err = CAM_ERR_SUCCESS
+        for grabber in self.grabbers:
+            err_stop = grabber.stop()
+            if err == CAM_ERR_SUCCESS:
+                err = err_stop
+        return err
+
+    def close(self):
+        """This function stops the acquisition and closes all the cameras."""
+        if getattr(self, "grabbers", None):
+            self.stop()
+        for camera in self.cameras:
+            camera.close()
+        self.cameras = []
+        self.grabbers = []
+
+    def _key(self, index):
+        # position of the frame held by a grabber in the matching order
+        grabber = self.grabbers[index]
+        info = grabber.frame_info()
+        if self.match == "block_id":
+            return info["block_id"]
+        return info["timestamp"] * TIMESTAMP_TICK + grabber.clock_offset
+
+    def get(self, timeout=None):
+        """This function gets the next set of matching frames, one per camera.
+        The frames of a camera that are older than the frames of the others are skipped.
+        :param timeout: Maximum time to wait for each frame in seconds, None to wait forever.
+        returns list of Frame, in the order of the cameras, or None when the acquisition is stopped
+        NOTE: The images belong to the grabbers, they stay valid until the next call to get()."""
+        tolerance = 0 if self.match == "block_id" else self.tolerance
+        images = [grabber.get(timeout) for grabber in self.grabbers]
+        while True:
+            if any(image is None for image in images):
+                return None
+            keys = [self._key(i) for i in range(len(images))]
+            newest = max(keys)
+            if newest - min(keys) <= tolerance:
+                break
+            for i, key in enumerate(keys):
+                if newest - key > tolerance:
+                    images[i] = self.grabbers[i].get(timeout)
+                    self.unmatched += 1
+        self.sets += 1
+        frames = []
+        for grabber, image in zip(self.grabbers, images):
+            info = grabber.frame_info()
+            frames.append(Frame(image, info["block_id"], info["timestamp"], info["arrival"]))
+        return frames
+
+    def stream(self, n=None, timeout=None):
+        """This function yields synchronized sets of frames, the acquisition runs while the generator is iterated.
+        :param n: Number of sets, None to stream until the generator is closed.
+        :param timeout: Maximum time to wait for each frame in seconds, None to wait forever."""
+        err = self.start()
+        if err != CAM_ERR_SUCCESS:
+            raise Exception(f"start_acquisition: {err}")
+        try:
+            count = 0
+            while n is None or count < n:
+                frames = self.get(timeout)
+                if frames is None:
+                    break
+                yield frames
+                count += 1
+        finally:
+            self.stop()
+
+    def stats(self):
+        return {
+            "sets": self.sets,
+            "unmatched": self.unmatched,
+            "cameras": [grabber.stats() for grabber in self.grabbers],
+        }
@@ -1,9 +1,12 @@
 from evaluationkit import *
 import string
+import struct
 
-DEFAULT_BIN_DIR = "C:/Program Files/Teledyne e2v/Evalkit-Topaz/1.0/pigentl/bin"
-DEFAULT_CTI_NAME = "pigentl.cti"
-DEFAULT_DLL_NAME = "pigentl-sdk.dll"
+# the location of the SDK can be changed with the PIGENTL_BIN_DIR, PIGENTL_CTI_NAME and PIGENTL_DLL_NAME environment
+# variables, or PIGENTL_DLL and PIGENTL_CTI for the full paths
+DEFAULT_BIN_DIR = os.environ.get("PIGENTL_BIN_DIR", "C:/Program Files/Teledyne e2v/Evalkit-Topaz/1.0/pigentl/bin")
+DEFAULT_CTI_NAME = os.environ.get("PIGENTL_CTI_NAME", "pigentl.cti")
+DEFAULT_DLL_NAME = os.environ.get("PIGENTL_DLL_NAME", "pigentl-sdk.dll")
 
 # used to map sensor features address from XML file
 _xml_bootstrap_nodes_addresses = {
@@ -34,6 +37,26 @@ _xml_sensor_nodes_addresses = {
     "ChipID": 0x3007F,
 }
 
+# registers that never change while the camera is open, cached until the camera is closed
+_static_registers_addresses = (
+    _xml_bootstrap_nodes_addresses["DeviceVendorName"],
+    _xml_bootstrap_nodes_addresses["DeviceModelName"],
+    _xml_bootstrap_nodes_addresses["DeviceVersion"],
+    _xml_bootstrap_nodes_addresses["DeviceFirmwareVersion"],
+    _xml_bootstrap_nodes_addresses["SerialNumber"],
+    _xml_bootstrap_nodes_addresses["SensorWidth"],
+    _xml_bootstrap_nodes_addresses["SensorHeight"],
+)
+
+# bootstrap blocks read in one transaction, precompiled struct layouts
+# identity: DeviceVendorName 0x0, DeviceModelName 0x20, DeviceVersion 0x40, DeviceFirmwareVersion 0x60, SerialNumber 0xE0
+_bootstrap_identity_layout = struct.Struct("<32s32s32s32s96x16s")
+_bootstrap_identity_fields = ("DeviceVendorName", "DeviceModelName", "DeviceVersion", "DeviceFirmwareVersion",
+                              "SerialNumber")
+# format: SensorWidth 0x1000C, SensorHeight 0x10010, PixelFormat 0x10014
+_bootstrap_format_layout = struct.Struct("<III")
+_bootstrap_format_fields = ("SensorWidth", "SensorHeight", "PixelFormat")
+
 
 # used to get the number of bits per pixel from the EK/XML pixel format
 xml_pixel_format_nbits = {
@@ -55,11 +78,60 @@ xml_pixel_format_type = {
     "RGB24":    0x02180014   # RGB24
 }
 
+class RegisterCache:
+    """Shadow copy of camera registers keyed by address, holding the little endian bytes last read or written."""
+
+    def __init__(self, static_addresses=()):
+        self._values = {}
+        self._static = set(static_addresses)
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, address):
+        return address in self._values
+
+    def addresses(self):
+        return list(self._values)
+
+    def size(self, address):
+        # number of bytes cached for a register
+        return len(self._values.get(address, b""))
+
+    def get(self, address, size):
+        """This function gets the cached value of a register.
+        returns the first size bytes of the register, or None if they are not cached"""
+        data = self._values.get(address)
+        if data is None or len(data) < size:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data[:size]
+
+    def set(self, address, data):
+        self._values[address] = bytes(data)
+
+    def invalidate(self, address=None, static=False):
+        """This function drops cached registers.
+        :param address: Register to drop, or None to drop all of them.
+        :param static: Also drop the static registers (identity, sensor size)."""
+        if address is not None:
+            self._values.pop(address, None)
+        else:
+            for addr in list(self._values):
+                if static or addr not in self._static:
+                    del self._values[addr]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "registers": len(self._values)}
+
+
 def clean_char(text):
     # remove non printable char from ASCII chain
     return ''.join(c for c in text if c in string.printable)
 
 def print_info(ek):
+    # bootstrap registers are read in two transactions, the properties below use the shadow copy
+    ek.prefetch()
     print("Camera INFO:")
     print("\tManufacturer info          ", clean_char(ek.vendor_name))
     print("\tDevice name                ", clean_char(ek.model_name))
@@ -73,45 +145,215 @@ def print_info(ek):
     print("\tWait time                   %.2f ms" % ek.wait_time)
 
 
+class Sweep:
+    """Parameter sweep without stopping the acquisition.
+    Each step's settings are applied while streaming. Frames exposed before the change are recognized from their
+    sensor timestamp and discarded, as well as settle_frames transition frames. Iterating gives, for each step,
+    (step index, settings, iterator over the frames of the step):
+        for index, settings, frames in camera.sweep([{"exposure_time": 5}, {"exposure_time": 10}], 100):
+            for frame in frames:
+                ..."""
+
+    def __init__(self, camera, steps, frames_per_step, settle_frames=1, timeout=None, buffering=4, log=None):
+        self.camera = camera
+        self.steps = list(steps)
+        self.frames_per_step = frames_per_step
+        self.settle_frames = settle_frames
+        self.timeout = timeout
+        self.buffering = buffering
+        self.log = log
+        self.grabber = None
+        self.captured = 0
+        self.discarded = 0
+
+    def __iter__(self):
+        try:
+            for index, settings in enumerate(self.steps):
+                err = self.camera.apply_settings(settings)
+                if err != CAM_ERR_SUCCESS:
+                    raise Exception(f"Sweep step {index} {settings}: {err}")
+                applied = time.perf_counter()
+                if self.grabber is None:
+                    # the first settings are applied before the acquisition starts
+                    self.grabber = self.camera.grabber(size=self.buffering, policy="block", log=self.log)
+                    err = self.grabber.start()
+                    if err != CAM_ERR_SUCCESS:
+                        raise Exception(f"start_acquisition: {err}")
+                yield index, settings, self._step_frames(applied)
+        finally:
+            if self.grabber is not None:
+                self.grabber.stop()
+                self.grabber = None
+
+    def _step_frames(self, applied):
+        settle = self.settle_frames
+        captured = 0
+        while captured < self.frames_per_step:
+            frame = self.grabber.get(self.timeout)
+            if frame is None:
+                return
+            info = self.grabber.frame_info()
+            offset = self.grabber.clock_offset
+            if offset is not None and info["timestamp"] * TIMESTAMP_TICK + offset <= applied:
+                # produced before the settings were applied
+                self.discarded += 1
+                continue
+            if settle > 0:
+                # exposed while the settings were changing
+                settle -= 1
+                self.discarded += 1
+                continue
+            captured += 1
+            self.captured += 1
+            yield frame
+
+
 class Topaz(EvaluationKit):
-    def __init__(self, dll_path=None, cti_path=None):
+    def __init__(self, dll_path=None, cti_path=None, buffers=None, camera=0):
         self.DEFAULT_BIN_DIR = DEFAULT_BIN_DIR
         self.DEFAULT_CTI_NAME = DEFAULT_CTI_NAME
         self.DEFAULT_DLL_NAME = DEFAULT_DLL_NAME
+        self.registers = RegisterCache(_static_registers_addresses)
+        # arguments of auto_buffers, re-applied when the pixel format changes
+        self._buffer_sizing = None
         if dll_path is None:
-            dll_path = os.path.join(os.path.dirname(__file__), self.DEFAULT_BIN_DIR, self.DEFAULT_DLL_NAME)
+            dll_path = os.environ.get("PIGENTL_DLL") or os.path.join(
+                os.path.dirname(__file__), self.DEFAULT_BIN_DIR, self.DEFAULT_DLL_NAME)
         if cti_path is None:
-            cti_path = os.path.join(os.path.dirname(__file__), self.DEFAULT_BIN_DIR, self.DEFAULT_CTI_NAME)
-        super().__init__(dll_path, cti_path)
+            cti_path = os.environ.get("PIGENTL_CTI") or os.path.join(
+                os.path.dirname(__file__), self.DEFAULT_BIN_DIR, self.DEFAULT_CTI_NAME)
+        super().__init__(dll_path, cti_path, buffers, camera)
 
     def __del__(self):
         super().__del__()
 
+    def write(self, address, data):
+        # write-through: the shadow copy holds what was sent to the camera
+        err = super().write(address, data)
+        if err == CAM_ERR_SUCCESS:
+            self.registers.set(address, self._pack(data))
+        else:
+            self.registers.invalidate(address)
+        return err
+
+    def read_cached(self, address, size):
+        """This function reads a camera register, from the shadow copy when it is cached.
+        returns (error code, raw bytes)
+        NOTE: Registers updated by the camera itself (auto exposure, auto white balance) are only seen after
+              invalidate() or refresh()."""
+        data = self.registers.get(address, size)
+        if data is not None:
+            return CAM_ERR_SUCCESS, data
+        err, data = self.read(address=address, size=size, decode=False)
+        if err == CAM_ERR_SUCCESS:
+            self.registers.set(address, data)
+        return err, data
+
+    def write_many(self, writes):
+        writes = list(writes)
+        err = super().write_many(writes)
+        for address, value in writes:
+            if err == CAM_ERR_SUCCESS:
+                self.registers.set(address, self._pack(value))
+            else:
+                self.registers.invalidate(address)
+        return err
+
+    def _coalescable(self, address):
+        # the sensor window holds a 16 bits register per address, only the 32 bits bootstrap registers are merged,
+        # write_sensor_regs batches the sensor registers
+        return address < _xml_sensor_nodes_addresses["BaseAddress"]
+
+    def _write_sensor_block(self, address, values):
+        # consecutive sensor registers in one transaction, 2 bytes per register, written through the shadow copy
+        addr = address + _xml_sensor_nodes_addresses["BaseAddress"]
+        data = struct.pack(f"<{len(values)}H", *(int(np.uint16(value)) for value in values))
+        err = self.write_block(addr, data)
+        for i in range(len(values)):
+            if err == CAM_ERR_SUCCESS:
+                self.registers.set(addr + i, data[2 * i:2 * i + 2])
+            else:
+                self.registers.invalidate(addr + i)
+        return err
+
+    def _read_block_cached(self, address, layout, names):
+        # read a bootstrap block in one transaction and fill the shadow copy of each field
+        err, data = self.read_block(address, layout.size)
+        if err != CAM_ERR_SUCCESS:
+            return err, {}
+        fields = dict(zip(names, layout.unpack(data)))
+        for name, value in fields.items():
+            if isinstance(value, bytes):
+                self.registers.set(_xml_bootstrap_nodes_addresses[name], value)
+            else:
+                self.registers.set(_xml_bootstrap_nodes_addresses[name], struct.pack("<I", value))
+        return err, fields
+
+    def read_identity(self):
+        """This function reads vendor, model, version, firmware and serial number in one transaction.
+        returns (error code, dict of the decoded strings)"""
+        err, fields = self._read_block_cached(
+            _xml_bootstrap_nodes_addresses["DeviceVendorName"], _bootstrap_identity_layout, _bootstrap_identity_fields
+        )
+        return err, {name: clean_char(value.decode("latin-1")) for name, value in fields.items()}
+
+    def read_format(self):
+        """This function reads sensor width, height and pixel format in one transaction.
+        returns (error code, dict of the values)"""
+        return self._read_block_cached(
+            _xml_bootstrap_nodes_addresses["SensorWidth"], _bootstrap_format_layout, _bootstrap_format_fields
+        )
+
+    def prefetch(self):
+        """This function fills the shadow copy of the bootstrap registers with two transactions.
+        returns error code"""
+        err = self.read_identity()[0]
+        err_format = self.read_format()[0]
+        return err if err != CAM_ERR_SUCCESS else err_format
+
+    def invalidate(self, static=False):
+        # forget cached registers, next accesses read them again from the camera
+        self.registers.invalidate(static=static)
+
+    def refresh(self):
+        """This function reads again all the cached registers from the camera.
+        returns error code"""
+        err = CAM_ERR_SUCCESS
+        for address in self.registers.addresses():
+            size = self.registers.size(address)
+            err_read, data = self.read(address=address, size=size, decode=False)
+            if err_read == CAM_ERR_SUCCESS:
+                self.registers.set(address, data)
+            else:
+                self.registers.invalidate(address)
+                err = err_read
+        return err
+
     @property
     def clkref(self):
         return 50  # MHz
 
     @property
     def model_name(self):
-        return self.read(address=_xml_bootstrap_nodes_addresses["DeviceModelName"], size=32)[1]
+        return self.read_cached(address=_xml_bootstrap_nodes_addresses["DeviceModelName"], size=32)[1].decode()
 
     @property
     def vendor_name(self):
-        return self.read(address=_xml_bootstrap_nodes_addresses["DeviceVendorName"], size=32)[1]
+        return self.read_cached(address=_xml_bootstrap_nodes_addresses["DeviceVendorName"], size=32)[1].decode()
 
     @property
     def firmware_version(self):
-        return self.read(address=_xml_bootstrap_nodes_addresses["DeviceFirmwareVersion"], size=32)[1]
+        return self.read_cached(address=_xml_bootstrap_nodes_addresses["DeviceFirmwareVersion"], size=32)[1].decode()
 
     @property
     def serial_number(self):
-        return self.read(address=_xml_bootstrap_nodes_addresses["SerialNumber"], size=16)[1]
+        return self.read_cached(address=_xml_bootstrap_nodes_addresses["SerialNumber"], size=16)[1].decode()
 
     @property
     def pixel_format(self):
         return xml_pixel_format_type[
             int.from_bytes(
-                self.read(address=_xml_bootstrap_nodes_addresses["PixelFormat"], size=4, decode=False)[1],
+                self.read_cached(address=_xml_bootstrap_nodes_addresses["PixelFormat"], size=4)[1],
                 byteorder="little",
             )
         ]
@@ -119,28 +361,39 @@ class Topaz(EvaluationKit):
     @property
     def sensor_width(self):
         return int.from_bytes(
-            self.read(address=_xml_bootstrap_nodes_addresses["SensorWidth"], size=4, decode=False)[1],
+            self.read_cached(address=_xml_bootstrap_nodes_addresses["SensorWidth"], size=4)[1],
             byteorder="little",
         )
 
     @property
     def sensor_height(self):
         return int.from_bytes(
-            self.read(address=_xml_bootstrap_nodes_addresses["SensorHeight"], size=4, decode=False)[1],
+            self.read_cached(address=_xml_bootstrap_nodes_addresses["SensorHeight"], size=4)[1],
             byteorder="little",
         )
 
+    @property
+    def frame_shape(self):
+        # shape of the images returned by get_image for the current pixel format
+        if self.pixel_format == "RGB24":
+            return self.sensor_height, self.sensor_width * 3
+        return self.sensor_height, self.sensor_width
+
+    @property
+    def frame_dtype(self):
+        return xml_pixel_format_nptypes[self.pixel_format]
+
     @property
     def line_length(self):  # in
         return int.from_bytes(
-            self.read(address=_xml_sensor_nodes_addresses["LineLength"], size=2, decode=False)[1], byteorder="little"
+            self.read_cached(address=_xml_sensor_nodes_addresses["LineLength"], size=2)[1], byteorder="little"
         )
 
     @property
     def wait_time(self):  # in ms
         return (
             int.from_bytes(
-                self.read(address=_xml_sensor_nodes_addresses["WaitTime"], size=2, decode=False)[1],
+                self.read_cached(address=_xml_sensor_nodes_addresses["WaitTime"], size=2)[1],
                 byteorder="little",
             )
             * (self.line_length / self.clkref)
@@ -150,7 +403,7 @@ class Topaz(EvaluationKit):
     def exposure_time(self):  # in ms
         return (
             int.from_bytes(
-                self.read(address=_xml_sensor_nodes_addresses["ExposureTime"], size=2, decode=False)[1],
+                self.read_cached(address=_xml_sensor_nodes_addresses["ExposureTime"], size=2)[1],
                 byteorder="little",
             )
             * (self.line_length / self.clkref)
@@ -158,20 +411,29 @@ class Topaz(EvaluationKit):
 
     @exposure_time.setter
     def exposure_time(self, value):  # in ms
-        return self.write(
-            address=_xml_sensor_nodes_addresses["ExposureTime"],
-            data=np.uint16((value * self.clkref / self.line_length) * 1e3),
+        return self.write_sensor_reg(
+            _xml_sensor_nodes_addresses["ExposureTime"] - _xml_sensor_nodes_addresses["BaseAddress"],
+            (value * self.clkref / self.line_length) * 1e3,
         )
 
+    def grabber(self, size=8, policy="drop-oldest", shape=None, dtype=None, log=None):
+        # preallocate the ring for the current pixel format
+        if shape is None:
+            shape, dtype = self.frame_shape, self.frame_dtype
+        return super().grabber(size=size, policy=policy, shape=shape, dtype=dtype, log=log)
+
     def close(self):
         super().__del__()
 
     def white_balance(self, red, green, blue):
         # Enable AWB and write red-gree-blue color gains
         # err = self.write(address=_xml_bootstrap_nodes_addresses["AWBenable"], data=int(0b1))
-        err = self.write(address=_xml_bootstrap_nodes_addresses["AWBredGain"], data=int(red * 1e6))
-        err = self.write(address=_xml_bootstrap_nodes_addresses["AWBgreenGain"], data=int(green * 1e6))
-        err = self.write(address=_xml_bootstrap_nodes_addresses["AWBblueGain"], data=int(blue * 1e6))
+        # the three gains are contiguous and written in one transaction
+        err = self.write_many([
+            (_xml_bootstrap_nodes_addresses["AWBredGain"], int(red * 1e6)),
+            (_xml_bootstrap_nodes_addresses["AWBgreenGain"], int(green * 1e6)),
+            (_xml_bootstrap_nodes_addresses["AWBblueGain"], int(blue * 1e6)),
+        ])
         return err
 
     def enable_white_balance(self, enable):
@@ -200,23 +462,112 @@ class Topaz(EvaluationKit):
             # Vertical subsampling 2
         return err		
 
-    def read_sensor_reg(self, address):
+    def read_sensor_reg(self, address, cached=False):
         addr=address+_xml_sensor_nodes_addresses["BaseAddress"]
-        rval=int.from_bytes(self.read(address=addr, size=2, decode=False)[1], byteorder="little", )
+        if cached:
+            rval=int.from_bytes(self.read_cached(address=addr, size=2)[1], byteorder="little", )
+        else:
+            rval=int.from_bytes(self.read(address=addr, size=2, decode=False)[1], byteorder="little", )
         # print("RD 0x{:05x} = 0x{:04x}".format(addr, rval))
         return rval
 
+    def read_sensor_regs(self, address, count):
+        """This function reads consecutive sensor registers in one transaction, and fills the shadow copy.
+        The sensor window holds one 16 bits register per address, count registers are 2 * count bytes.
+        :param address: Sensor address of the first register.
+        :param count: Number of registers.
+        returns (error code, list of the register values)"""
+        addr = address + _xml_sensor_nodes_addresses["BaseAddress"]
+        err, data = self.read_block(addr, 2 * count)
+        if err != CAM_ERR_SUCCESS:
+            return err, []
+        values = list(struct.unpack(f"<{count}H", data))
+        for i in range(count):
+            self.registers.set(addr + i, data[2 * i:2 * i + 2])
+        return err, values
+
     def write_sensor_reg(self, address, value):
-        addr=address+_xml_sensor_nodes_addresses["BaseAddress"]
-        val = np.uint16(value)
-        # print("WR 0x{:05x} = 0x{:04x}".format(addr, val))
-        error = self.write(address=addr, data=val)
-        return error
+        # 2 bytes: a wider write would also set the next register
+        return self._write_sensor_block(address, [value])
+
+    def write_sensor_regs(self, values):
+        """This function writes a list of sensor registers, e.g. a full sensor configuration.
+        Consecutive entries of the list that are also consecutive sensor addresses are written in one transaction.
+        :param values: List of (sensor register address, value).
+        returns the first error code"""
+        runs = []
+        for address, value in values:
+            if runs and runs[-1][0] + len(runs[-1][1]) == address:
+                runs[-1][1].append(value)
+            else:
+                runs.append((address, [value]))
+        err = CAM_ERR_SUCCESS
+        for address, run in runs:
+            err_write = self._write_sensor_block(address, run)
+            if err == CAM_ERR_SUCCESS:
+                err = err_write
+        return err
+
+    def apply_settings(self, settings):
+        """This function applies several settings at once, sensor registers are written in one batch.
+        :param settings: dict of property name (e.g. "exposure_time" in ms) or sensor register name (e.g.
+                         "AnalogGain", "WaitTime", "ClampOffset") to value.
+        returns the first error code"""
+        base = _xml_sensor_nodes_addresses["BaseAddress"]
+        registers = []
+        err = CAM_ERR_SUCCESS
+        for name, value in settings.items():
+            if name in _xml_sensor_nodes_addresses and name != "BaseAddress":
+                registers.append((_xml_sensor_nodes_addresses[name] - base, value))
+                continue
+            setting = getattr(type(self), name, None)
+            if not isinstance(setting, property) or setting.fset is None:
+                raise ValueError(f"Unknown setting {name}")
+            # the setter returns the error code of its write, setattr would drop it
+            err_set = setting.fset(self, value)
+            if err == CAM_ERR_SUCCESS and err_set is not None:
+                err = err_set
+        if registers:
+            err_write = self.write_sensor_regs(registers)
+            if err == CAM_ERR_SUCCESS:
+                err = err_write
+        return err
+
+    def sweep(self, steps, frames_per_step, settle_frames=1, timeout=None, buffering=4, log=None):
+        """This function sweeps settings while the acquisition keeps running, see Sweep.
+        :param steps: List of settings, each one a dict as accepted by apply_settings.
+        :param frames_per_step: Number of settled frames acquired for each step.
+        :param settle_frames: Number of frames discarded after each change, while the sensor switches to it.
+        :param timeout: Maximum time to wait for each frame in seconds, None to wait forever.
+        :param buffering: Number of frames grabbed ahead of the consumer.
+        :param log: Optionally a FrameLog the metadata of every grabbed frame is appended to, discarded ones included."""
+        return Sweep(self, steps, frames_per_step, settle_frames, timeout, buffering, log)
 
     def set_camera_format(self, format):
         err = self.write(address=_xml_bootstrap_nodes_addresses["PixelFormat"], data=xml_pixel_format_nbits[format])
+        if err == CAM_ERR_SUCCESS and self._buffer_sizing is not None:
+            # the frame size changed
+            err = self.auto_buffers(**self._buffer_sizing)
         return err
 
+    @property
+    def frame_bytes(self):
+        # size of the images returned by get_image for the current pixel format
+        return int(np.prod(self.frame_shape)) * np.dtype(self.frame_dtype).itemsize
+
+    def auto_buffers(self, fps=None, burst=None, budget=BUFFER_MEMORY_BUDGET, stall=BUFFER_STALL):
+        """This function sizes the pigentl buffers for the current pixel format, see EvaluationKit.buffers_for.
+        The sizing is applied again by set_camera_format. The acquisition has to be stopped.
+        :param fps: Expected frame rate. By default the free running rate of the current exposure time.
+        :param burst: Optionally the number of frames of a trigger burst.
+        :param budget: Maximum host memory used by the buffers in bytes.
+        :param stall: Consumer stall in seconds absorbed without dropping a frame.
+        returns error code"""
+        self._buffer_sizing = {"fps": fps, "burst": burst, "budget": budget, "stall": stall}
+        if fps is None:
+            fps = 1e3 / max(self.exposure_time, 1e-3)
+        return self.set_number_of_buffers(self.buffers_for(self.frame_bytes, fps, burst, budget, stall))
+
     def set_trigger_source(self, source):
         #trigger source: 0=Trig_None 1=Trig_Generator 2=Trig_Ext1 4=Trig_Sensor_Rdy
         err = self.write(address=_xml_bootstrap_nodes_addresses["TriggerSource"], data=source)
@@ -0,0 +1,157 @@
+import os
+import struct
+import numpy as np
+from utils import xml_pixel_format_nptypes
+from sensor import xml_pixel_format_type
+
+# Sequence file layout, all little endian:
+#   header (SEQ_HEADER_SIZE bytes)
+#   frame_count frames of height x width x channels samples, contiguous
+#   frame_count metadata records (SEQ_METADATA_DTYPE)
+SEQ_MAGIC = b"EKSEQ\x00\x00\x00"
+SEQ_VERSION = 1
+SEQ_HEADER_SIZE = 64
+# magic, version, header size, width, height, channels, pixel format, dtype, frame count, metadata offset
+_seq_header = struct.Struct("<8sHHIIII8sQQ")
+
+SEQ_METADATA_DTYPE = np.dtype([("block_id", "<u8"), ("timestamp", "<u8"), ("exposure", "<f8")])
+
+
+class SequenceWriter:
+    """Writes a sequence of frames into a single file, that SequenceReader opens without loading it in memory.
+    Frames are appended as they come, the header and the metadata table are written when the writer is closed."""
+
+    def __init__(self, path, width, height, pixel_format="Mono10p", dtype=None):
+        """Constructor
+        :param path: Name of the sequence file.
+        :param width: Width of the frames in pixels.
+        :param height: Height of the frames in pixels.
+        :param pixel_format: EK/XML pixel format name, e.g. camera.pixel_format.
+        :param dtype: Numpy type of the samples. By default the type used by get_image for this pixel format."""
+        if dtype is None:
+            dtype = xml_pixel_format_nptypes[pixel_format]
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = 3 if pixel_format == "RGB24" else 1
+        self.pixel_format = pixel_format
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.frame_bytes = width * height * self.channels * self.dtype.itemsize
+        self.frame_count = 0
+        self._metadata = np.zeros(1024, dtype=SEQ_METADATA_DTYPE)
+        self._file = open(path, "wb")
+        self._write_header(0)
+
+    @classmethod
+    def for_camera(cls, path, camera):
+        # sequence matching the current camera setting
+        return cls(path, camera.sensor_width, camera.sensor_height, camera.pixel_format, camera.frame_dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_header(self, metadata_offset):
+        header = _seq_header.pack(
+            SEQ_MAGIC,
+            SEQ_VERSION,
+            SEQ_HEADER_SIZE,
+            self.width,
+            self.height,
+            self.channels,
+            xml_pixel_format_type[self.pixel_format],
+            self.dtype.str.encode(),
+            self.frame_count,
+            metadata_offset,
+        )
+        self._file.write(header.ljust(SEQ_HEADER_SIZE, b"\x00"))
+
+    def append(self, image, block_id=0, timestamp=0, exposure=np.nan):
+        """This function appends a frame at the end of the sequence.
+        :param image: The frame, as returned by get_image or image_rearange.
+        :param block_id: Block id of the frame.
+        :param timestamp: Timestamp of the frame.
+        :param exposure: Exposure time of the frame in ms."""
+        if image.size != self.width * self.height * self.channels or image.dtype.itemsize != self.dtype.itemsize:
+            # same number of bytes is not enough: the samples are converted to the sequence type
+            raise ValueError(f"Frame {image.shape} {image.dtype} does not match the sequence "
+                             f"({self.height}, {self.width}) x {self.channels} {self.dtype}")
+        self._file.write(np.ascontiguousarray(image, dtype=self.dtype).data)
+        if self.frame_count == len(self._metadata):
+            self._metadata = np.resize(self._metadata, 2 * len(self._metadata))
+        self._metadata[self.frame_count] = (block_id, timestamp, exposure)
+        self.frame_count += 1
+
+    def close(self):
+        """This function writes the metadata table and the final header."""
+        if self._file.closed:
+            return
+        metadata_offset = SEQ_HEADER_SIZE + self.frame_count * self.frame_bytes
+        self._file.write(self._metadata[: self.frame_count].data)
+        self._file.seek(0)
+        self._write_header(metadata_offset)
+        self._file.close()
+
+
+class SequenceReader:
+    """Random access to the frames of a sequence file through a numpy memmap.
+    reader.frames is a (frame count, height, width[, 3]) array read from the disk on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(_seq_header.size)
+        if len(header) < _seq_header.size or header[:8] != SEQ_MAGIC:
+            raise ValueError(f"{path} is not an EK sequence file")
+        (
+            _,
+            self.version,
+            header_size,
+            self.width,
+            self.height,
+            self.channels,
+            pixel_format,
+            dtype,
+            self.frame_count,
+            metadata_offset,
+        ) = _seq_header.unpack(header)
+        if self.version > SEQ_VERSION:
+            raise ValueError(f"{path}: unsupported sequence version {self.version}")
+        self.pixel_format = xml_pixel_format_type[pixel_format]
+        self.dtype = np.dtype(dtype.rstrip(b"\x00").decode())
+        self.shape = (self.height, self.width, 3) if self.channels == 3 else (self.height, self.width)
+        frame_bytes = self.width * self.height * self.channels * self.dtype.itemsize
+        if metadata_offset == 0:
+            # writer not closed: recover the complete frames, there is no metadata
+            self.frame_count = (os.path.getsize(path) - header_size) // frame_bytes
+        if self.frame_count == 0:
+            self.frames = np.zeros((0,) + self.shape, dtype=self.dtype)
+        else:
+            self.frames = np.memmap(path, dtype=self.dtype, mode="r", offset=header_size,
+                                    shape=(self.frame_count,) + self.shape)
+        if metadata_offset == 0 or self.frame_count == 0:
+            self.metadata = np.zeros(self.frame_count, dtype=SEQ_METADATA_DTYPE)
+        else:
+            self.metadata = np.memmap(path, dtype=SEQ_METADATA_DTYPE, mode="r", offset=metadata_offset,
+                                      shape=(self.frame_count,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def close(self):
+        self.frames = None
+        self.metadata = None
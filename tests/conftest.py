@@ -0,0 +1,157 @@
+import ctypes
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+# the modules of the repository are imported by name, as the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import evaluationkit
+from decoders import tImagePixelType
+
+FAKE_ERR_TIMEOUT = -1011
+# sensor window of the Topaz: one 16 bits register per address
+FAKE_SENSOR_BASE = 0x30000
+
+
+class FakeFunction:
+    # an SDK function: takes the argtypes set by _register_lib_args and counts its calls
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.function(*args)
+
+
+class FakeSdk:
+    """In memory stand-in for the pigentl SDK: one camera, a few buffers filled with a counter, and a register space.
+    The register space is byte addressed, except the sensor window where each address holds 2 bytes.
+    errors maps a function name, e.g. "PiGentlSdkStopAcquisition", to the error code it returns instead of running."""
+
+    def __init__(self, height=8, width=8, pixel_type=tImagePixelType.eMono10, bytes_per_pixel=2, buffers=4):
+        self.height = height
+        self.width = width
+        self.set_format(pixel_type, bytes_per_pixel, buffers)
+        self.block_id = 0
+        self.registers = bytearray(0x40000)
+        # (address, bytes) of each register write
+        self.writes = []
+        self.errors = {}
+
+    def set_format(self, pixel_type, bytes_per_pixel, buffers=4):
+        # eImagePixelType and size of the buffers, e.g. 1.25 bytes per pixel for packed Mono10p
+        self.pixel_type = pixel_type
+        self.image_size = int(self.height * self.width * bytes_per_pixel)
+        self.buffers = [ctypes.create_string_buffer(self.image_size) for _ in range(buffers)]
+        self.free = list(range(buffers))
+
+    def __getattr__(self, name):
+        if not name.startswith("PiGentlSdk"):
+            raise AttributeError(name)
+        handler = getattr(self, "_" + name[len("PiGentlSdk"):], None)
+
+        def call(*args):
+            if name in self.errors:
+                return self.errors[name]
+            return handler(*args) if handler is not None else evaluationkit.CAM_ERR_SUCCESS
+
+        function = FakeFunction(call)
+        setattr(self, name, function)
+        return function
+
+    def _UpdateCameraList(self, count):
+        count._obj.value = 1
+        return evaluationkit.CAM_ERR_SUCCESS
+
+    def _GetCameraInfo(self, index, camera_info):
+        camera_info._obj.serial = b"FAKE0001"
+        camera_info._obj.pcID = b"fake-camera-0"
+        return evaluationkit.CAM_ERR_SUCCESS
+
+    def _GetBuffer(self, handle, image_infos, timeout):
+        if not self.free:
+            return FAKE_ERR_TIMEOUT
+        index = self.free.pop(0)
+        ctypes.memset(self.buffers[index], self.block_id % 256, self.image_size)
+        infos = image_infos._obj
+        infos.hBuffer = index + 1
+        infos.isNewData = 1
+        infos.isIncomplete = 0
+        infos.pDatas = ctypes.addressof(self.buffers[index])
+        infos.iImageSize = self.image_size
+        infos.iImageWidth = self.width
+        infos.iImageHeight = self.height
+        infos.eImagePixelType = self.pixel_type
+        infos.iBlockId = self.block_id
+        infos.iTimestamp = int(time.perf_counter() * 1e9)
+        self.block_id += 1
+        return evaluationkit.CAM_ERR_SUCCESS
+
+    def _RequeueBuffer(self, handle, buffer):
+        self.free.append(buffer - 1)
+        return evaluationkit.CAM_ERR_SUCCESS
+
+    @staticmethod
+    def _offset(address):
+        # offset of a register in the register space
+        if address >= FAKE_SENSOR_BASE:
+            return FAKE_SENSOR_BASE + 2 * (address - FAKE_SENSOR_BASE)
+        return address
+
+    def sensor_register(self, address):
+        offset = self._offset(FAKE_SENSOR_BASE + address)
+        return int.from_bytes(self.registers[offset:offset + 2], "little")
+
+    def set_sensor_register(self, address, value):
+        offset = self._offset(FAKE_SENSOR_BASE + address)
+        self.registers[offset:offset + 2] = value.to_bytes(2, "little")
+
+    def _ReadRegister(self, handle, address, buffer, size):
+        offset, size = self._offset(address.value), size._obj.value
+        ctypes.memmove(buffer, bytes(self.registers[offset:offset + size]), size)
+        return evaluationkit.CAM_ERR_SUCCESS
+
+    def _WriteRegister(self, handle, address, buffer, size):
+        address, data = address.value, bytes(buffer)[: size._obj.value]
+        offset = self._offset(address)
+        self.registers[offset:offset + len(data)] = data
+        self.writes.append((address, data))
+        return evaluationkit.CAM_ERR_SUCCESS
+
+
+@pytest.fixture
+def sdk(monkeypatch, tmp_path):
+    # the cameras opened by the test use the fake SDK
+    sdk = FakeSdk()
+    for name in ("PIGENTL_DLL", "PIGENTL_CTI"):
+        path = tmp_path / name
+        path.touch()
+        monkeypatch.setenv(name, str(path))
+    monkeypatch.setattr(evaluationkit.EvaluationKit, "_load_library", staticmethod(lambda dll_path, cti_path: sdk))
+    return sdk
+
+
+@pytest.fixture
+def camera(sdk):
+    camera = evaluationkit.EvaluationKit(buffers=len(sdk.buffers))
+    yield camera
+    camera.__del__()
+
+
+@pytest.fixture
+def topaz(sdk):
+    from sensor import Topaz
+
+    camera = Topaz(buffers=len(sdk.buffers))
+    yield camera
+    camera.close()
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
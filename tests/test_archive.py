@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from archive import ARC_CODECS, ARC_INDEX_DTYPE, ArchiveReader, ArchiveWriter, _arc_header, _arc_index_dtype_v1
+
+
+def _frames(n=10, shape=(16, 64)):
+    # the same row on every line, every codec makes them smaller
+    row = np.arange(shape[1], dtype=np.uint16) * 8
+    return np.stack([np.tile((row + i) % 1024, (shape[0], 1)) for i in range(n)])
+
+
+@pytest.mark.parametrize("codec", ARC_CODECS)
+@pytest.mark.parametrize("packing", ["mono10p", "none"])
+def test_archive_round_trip(tmp_path, codec, packing):
+    path = tmp_path / "capture.eka"
+    frames = _frames()
+    with ArchiveWriter(path, 64, 16, "Mono10p", codec=codec, frames_per_chunk=4, packing=packing,
+                       workers=0) as writer:
+        for i, frame in enumerate(frames):
+            writer.append(frame, block_id=i, timestamp=1000 * i, exposure=10.0)
+    with ArchiveReader(path) as archive:
+        assert (archive.codec, archive.packing) == (codec, packing)
+        assert archive.dtype == np.uint16
+        assert len(archive) == len(frames)
+        assert archive.index["first_frame"].tolist() == [0, 4, 8]
+        assert archive.index["frame_count"].tolist() == [4, 4, 2]
+        assert np.all(np.diff(archive.index["offset"].astype(np.int64)) == archive.index["size"][:-1])
+        assert archive.index["compressed"].tolist() == [codec != "none"] * 3
+        assert np.array_equal(np.stack(list(archive)), frames)
+        # ranges across chunks, random access
+        assert np.array_equal(archive.read(3, 9), frames[3:9])
+        assert np.array_equal(archive[-1], frames[-1])
+        assert np.array_equal(archive[5], frames[5])
+        assert archive.metadata["block_id"].tolist() == list(range(len(frames)))
+        assert archive.metadata["timestamp"].tolist() == [1000 * i for i in range(len(frames))]
+    # 1.25 bytes per pixel once packed, 2 otherwise
+    chunk_bytes = 4 * 16 * 64 * (1.25 if packing == "mono10p" else 2)
+    if codec == "none":
+        assert writer.ratio == pytest.approx(2 / (1.25 if packing == "mono10p" else 2))
+        assert archive.index["size"][0] == chunk_bytes
+    else:
+        assert archive.index["size"][0] < chunk_bytes
+
+
+def test_archive_stores_the_chunks_compression_does_not_shrink(tmp_path, rng):
+    path = tmp_path / "capture.eka"
+    noise = rng.integers(0, 1024, (4, 16, 64), dtype=np.uint16)
+    with ArchiveWriter(path, 64, 16, "Mono10p", codec="lzma", frames_per_chunk=4, workers=0) as writer:
+        for frame in noise:
+            writer.append(frame)
+        for frame in _frames(4):
+            writer.append(frame)
+    # never worse than packing alone
+    assert writer.ratio >= 1.6
+    with ArchiveReader(path) as archive:
+        assert archive.index["compressed"].tolist() == [False, True]
+        assert archive.index["size"][0] == 4 * 16 * 64 * 5 // 4
+        assert np.array_equal(archive.read(0, 8), np.concatenate([noise, _frames(4)]))
+
+
+def test_archive_rgb_frames_in_worker_processes(tmp_path, rng):
+    path = tmp_path / "capture.eka"
+    frames = rng.integers(0, 8, (5, 6, 8, 3), dtype=np.uint8)
+    with ArchiveWriter(path, 8, 6, "RGB24", codec="zlib", frames_per_chunk=2, workers=2) as writer:
+        for frame in frames:
+            # as returned by get_image
+            writer.append(frame.reshape(6, 24))
+    with ArchiveReader(path) as archive:
+        assert archive.packing == "none"
+        assert archive.shape == (6, 8, 3)
+        assert np.array_equal(archive.read(0, 5), frames)
+
+
+def test_unclosed_archive_is_refused(tmp_path):
+    path = tmp_path / "capture.eka"
+    writer = ArchiveWriter(path, 64, 16, "Mono10p", workers=0)
+    writer.append(_frames(1)[0])
+    writer._file.flush()
+    with pytest.raises(ValueError, match="not closed"):
+        ArchiveReader(path)
+    writer.close()
+    with pytest.raises(ValueError, match="does not match"):
+        ArchiveWriter(tmp_path / "other.eka", 8, 6, "Mono8", codec="none").append(np.zeros((6, 6), np.uint8))
+
+
+def test_version_1_archives_are_read(tmp_path):
+    # version 1 compressed every chunk, its index has no compressed field
+    path = tmp_path / "capture.eka"
+    frames = _frames(6)
+    with ArchiveWriter(path, 64, 16, "Mono10p", codec="zlib", frames_per_chunk=4, workers=0) as writer:
+        for frame in frames:
+            writer.append(frame)
+    data = bytearray(path.read_bytes())
+    header = list(_arc_header.unpack_from(data))
+    chunk_count, index_offset = header[-2:]
+    index = np.frombuffer(data, ARC_INDEX_DTYPE, chunk_count, index_offset)
+    metadata = bytes(data[index_offset + index.nbytes:])
+    old_index = np.empty(chunk_count, _arc_index_dtype_v1)
+    for name in _arc_index_dtype_v1.names:
+        old_index[name] = index[name]
+    header[1] = 1
+    data[:_arc_header.size] = _arc_header.pack(*header)
+    path.write_bytes(bytes(data[:index_offset]) + old_index.tobytes() + metadata)
+    with ArchiveReader(path) as archive:
+        assert archive.version == 1
+        assert archive.index["compressed"].tolist() == [True, True]
+        assert np.array_equal(archive.read(0, 6), frames)
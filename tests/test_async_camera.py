@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+from async_camera import AsyncCamera
+from evaluationkit import CAM_ERR_TIMEOUT
+
+
+def _stream_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith(("FrameGrabber", "EK-stream"))]
+
+
+def test_astream_stops_the_grabber_on_break(camera, sdk):
+    async def main():
+        async_camera = AsyncCamera(camera)
+        async with async_camera.astream(100) as frames:
+            async for frame in frames:
+                if frame.block_id == 2:
+                    break
+        return frames
+
+    frames = asyncio.run(main())
+    assert frames.count == 3
+    assert not frames.grabber.running
+    assert len(sdk.free) == len(sdk.buffers)
+    assert sdk.PiGentlSdkStopAcquisition.calls == 1
+
+
+def test_astream_stops_the_grabber_on_cancel(camera, sdk):
+    # no image ever arrives: the consumer is cancelled while it waits
+    sdk.errors["PiGentlSdkGetBuffer"] = CAM_ERR_TIMEOUT
+
+    async def consume(frames):
+        async for _ in frames:
+            pass
+
+    async def main():
+        frames = AsyncCamera(camera).astream()
+        task = asyncio.ensure_future(consume(frames))
+        while sdk.PiGentlSdkGetBuffer.calls < 5:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return frames
+
+    frames = asyncio.run(main())
+    assert not frames.grabber.running
+    assert sdk.PiGentlSdkStopAcquisition.calls == 1
+    for thread in _stream_threads():
+        thread.join(timeout=1)
+    assert not [thread for thread in _stream_threads() if thread.is_alive()]
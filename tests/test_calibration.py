@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from calibration import Calibration
+
+
+def _frames(rng, level, n=4, shape=(6, 8)):
+    return [rng.normal(level, 2, shape).clip(0, 1023).astype(np.uint16) for _ in range(n)]
+
+
+def test_calibration_round_trip(tmp_path, rng):
+    calibration = Calibration()
+    calibration.add_dark(_frames(rng, 40), exposure=5)
+    calibration.add_dark(_frames(rng, 80), exposure=10)
+    prnu = rng.uniform(0.8, 1.2, (6, 8))
+    calibration.add_flat([(80 + 400 * prnu).astype(np.uint16) for _ in range(4)], exposure=10)
+    path = tmp_path / "calibration.npz"
+    calibration.save(path)
+    loaded = Calibration.load(path)
+    assert loaded.bits == calibration.bits and loaded.gain_bits == calibration.gain_bits
+    assert loaded.dark_tolerance == calibration.dark_tolerance
+    assert sorted(loaded.darks) == [5.0, 10.0]
+    for exposure in (5.0, 10.0):
+        assert np.array_equal(loaded.darks[exposure], calibration.darks[exposure])
+        assert loaded.darks[exposure].dtype == np.uint16
+    assert np.array_equal(loaded.gain, calibration.gain)
+    frame = (80 + 400 * prnu).astype(np.uint16)
+    corrected = loaded.apply(frame.copy(), exposure=10)
+    assert np.array_equal(corrected, calibration.apply(frame.copy(), exposure=10))
+    # the flat is uniform once corrected
+    assert corrected.std() < 0.01 * corrected.mean()
+
+
+def test_dark_for_refuses_distant_exposures():
+    calibration = Calibration(dark_tolerance=0.1)
+    calibration.darks[10.0] = np.zeros((2, 2), dtype=np.uint16)
+    assert calibration.dark_for(10.5) is calibration.darks[10.0]
+    with pytest.raises(ValueError, match="No master dark within 10%"):
+        calibration.dark_for(20)
+    with pytest.raises(ValueError):
+        calibration.apply(np.zeros((2, 2), dtype=np.uint16), exposure=5)
@@ -0,0 +1,22 @@
+import numpy as np
+
+from defects import DefectMap
+
+
+def test_flat_integer_dark_only_flags_real_defects(rng):
+    # MAD of 0: most pixels at the median, a few 1 DN off, two hot pixels
+    dark = np.full((64, 80), 16, dtype=np.uint16)
+    dark.flat[rng.choice(dark.size, 1000, replace=False)] += 1
+    dark[10, 20] = 200
+    dark[30, 40] = 1023
+    defects = DefectMap.detect(dark)
+    assert len(defects) == 2
+    rows, cols, _ = defects.coordinates()
+    assert list(zip(rows, cols)) == [(10, 20), (30, 40)]
+
+
+def test_apply_replaces_defects_by_their_neighbours():
+    image = np.full((8, 8), 100, dtype=np.uint16)
+    image[3, 4] = 1023
+    DefectMap([3 * 8 + 4], 8, 8).apply(image)
+    assert image[3, 4] == 100
@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pytest
+
+from decoders import decode, pack_mono10p, tImagePixelType
+from evaluationkit import ACQUISITION_RETRY_ERRORS, CAM_ERR_SUCCESS
+
+FAKE_ERR_INVALID_PARAMETER = -1009
+
+
+def test_lease_image_is_read_only(camera, sdk):
+    assert camera.start_acquisition() == CAM_ERR_SUCCESS
+    with camera.lease_image() as lease:
+        assert lease.image.shape == (sdk.height, sdk.width)
+        assert lease.image.flags.writeable is False
+    assert len(sdk.free) == len(sdk.buffers)
+
+
+def test_get_image_copy_is_writable(camera):
+    assert camera.start_acquisition() == CAM_ERR_SUCCESS
+    err, image = camera.get_image()
+    assert err == CAM_ERR_SUCCESS
+    assert image.flags.writeable
+    out = np.empty_like(image)
+    err, image = camera.get_image(out=out)
+    assert image is out
+
+
+def test_permanent_acquisition_errors_are_not_retried(camera, sdk):
+    sdk.errors["PiGentlSdkStopAcquisition"] = FAKE_ERR_INVALID_PARAMETER
+    start = time.perf_counter()
+    assert camera.stop_acquisition(timeout=1) == FAKE_ERR_INVALID_PARAMETER
+    assert time.perf_counter() - start < 0.5
+    assert sdk.PiGentlSdkStopAcquisition.calls == 1
+
+
+def test_busy_acquisition_engine_is_retried(camera, sdk):
+    sdk.errors["PiGentlSdkStartAcquisition"] = ACQUISITION_RETRY_ERRORS[-1]
+    assert camera.start_acquisition(timeout=0.05) == ACQUISITION_RETRY_ERRORS[-1]
+    assert sdk.PiGentlSdkStartAcquisition.calls > 1
+
+
+@pytest.mark.parametrize("bytes_per_pixel, expected", [(1.25, [0x202, 0x80, 0x20, 0x8]), (2, [0x202] * 4)])
+def test_mono10p_is_unpacked_only_when_packed(camera, sdk, bytes_per_pixel, expected):
+    # the 10 bits format is delivered either packed, 4 pixels in 5 bytes, or on 2 bytes per pixel
+    sdk.set_format(tImagePixelType.eMono10p, bytes_per_pixel)
+    sdk.block_id = 2  # every byte of the buffer is 0x02
+    assert camera.start_acquisition() == CAM_ERR_SUCCESS
+    err, image = camera.get_image()
+    assert err == CAM_ERR_SUCCESS
+    assert image.shape == (sdk.height, sdk.width)
+    assert image.dtype == np.uint16
+    assert image.reshape(-1, 4).tolist() == [expected] * (image.size // 4)
+
+
+def test_decode_layouts():
+    raw = np.arange(4 * 6 * 3, dtype=np.uint8)
+    rgb = decode(raw, tImagePixelType.eRGB8, 4, 6, copy=False)
+    assert rgb.shape == (4, 18)
+    assert np.shares_memory(rgb, raw)
+    mono = decode(raw[: 4 * 6], tImagePixelType.eMono8, 4, 6)
+    assert mono.shape == (4, 6)
+    assert not np.shares_memory(mono, raw)
+    image = np.arange(16, dtype=np.uint16).reshape(4, 4) * 60
+    assert np.array_equal(decode(pack_mono10p(image), tImagePixelType.eMono10p, 4, 4), image)
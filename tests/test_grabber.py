@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import pytest
+
+from evaluationkit import CAM_ERR_SUCCESS, CAM_ERR_TIMEOUT
+from grabber import FrameGrabber
+
+FAKE_ERR_IO = -1010
+
+
+def test_grabber_delivers_frames_in_order(camera):
+    with camera.grabber(size=2, policy="block") as grabber:
+        block_ids = []
+        for _ in range(5):
+            assert grabber.get(timeout=1) is not None
+            block_ids.append(grabber.frame_info()["block_id"])
+    assert block_ids == [0, 1, 2, 3, 4]
+
+
+def test_grabber_gives_up_after_consecutive_errors(camera, sdk):
+    sdk.errors["PiGentlSdkGetBuffer"] = FAKE_ERR_IO
+    grabber = FrameGrabber(camera, max_errors=3)
+    assert grabber.start() == CAM_ERR_SUCCESS
+    with pytest.raises(Exception, match="3 consecutive errors"):
+        grabber.get(timeout=5)
+    assert sdk.PiGentlSdkGetBuffer.calls == 3
+    assert grabber.errors == 3
+    assert not grabber.running
+    assert grabber.stop() == CAM_ERR_SUCCESS
+    # a new start clears the failure
+    del sdk.errors["PiGentlSdkGetBuffer"]
+    assert grabber.start() == CAM_ERR_SUCCESS
+    assert grabber.get(timeout=1) is not None
+    grabber.stop()
+
+
+def test_stream_raises_when_the_camera_is_lost(camera, sdk):
+    sdk.errors["PiGentlSdkGetBuffer"] = FAKE_ERR_IO
+    with pytest.raises(Exception, match="consecutive errors"):
+        for _ in camera.stream(10, timeout=None):
+            pass
+
+
+def test_grabber_gives_up_when_frames_can_not_be_stored(camera, sdk):
+    # ring of the wrong shape: every copy fails
+    grabber = FrameGrabber(camera, shape=(4, 4), dtype=np.uint16, max_errors=3)
+    assert grabber.start() == CAM_ERR_SUCCESS
+    with pytest.raises(Exception, match="3 consecutive errors"):
+        grabber.get(timeout=5)
+    assert grabber.failure is not None
+    grabber.stop()
+    # the buffers and the frames of the ring were all given back
+    assert len(sdk.free) == len(sdk.buffers)
+    assert len(grabber._free) == grabber.size + 1
+
+
+def test_grabber_timeouts_are_not_failures(camera, sdk):
+    sdk.errors["PiGentlSdkGetBuffer"] = CAM_ERR_TIMEOUT
+    grabber = FrameGrabber(camera, max_errors=3)
+    assert grabber.start() == CAM_ERR_SUCCESS
+    deadline = time.perf_counter() + 5
+    while sdk.PiGentlSdkGetBuffer.calls < 20 and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    assert grabber.running
+    assert grabber.failure is None
+    del sdk.errors["PiGentlSdkGetBuffer"]
+    assert grabber.get(timeout=1) is not None
+    grabber.stop()
@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+
+# the headless modules import numpy and ctypes only, without matplotlib and OpenCV they load in about 150 ms
+IMPORT_BUDGET = 1.0  # s
+
+_IMPORT_CHECK = """
+import json, sys, time
+start = time.perf_counter()
+import evaluationkit, utils, sensor, grabber
+print(json.dumps({"time": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def test_headless_import_is_lazy():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    output = subprocess.run([sys.executable, "-c", _IMPORT_CHECK], cwd=root, capture_output=True, text=True,
+                            check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    assert "matplotlib" not in result["modules"]
+    assert "cv2" not in result["modules"]
+    assert "win32api" not in result["modules"]
+    assert result["time"] < IMPORT_BUDGET
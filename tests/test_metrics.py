@@ -0,0 +1,30 @@
+import csv
+
+import pytest
+
+from metrics import METRICS_CSV_FIELDS, Metrics
+
+
+def test_to_csv_columns_follow_the_header(tmp_path):
+    path = tmp_path / "metrics.csv"
+    metrics = Metrics()
+    metrics.to_csv(path)
+    metrics.add("copy", 0.002)
+    metrics.count("errors")
+    metrics.count("custom")
+    metrics.to_csv(path)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == list(METRICS_CSV_FIELDS)
+    assert all(None not in row for row in rows)
+    assert rows[0]["stage"] == ""
+    assert rows[1]["stage"] == "copy"
+    assert rows[1]["errors"] == "1"
+    assert float(rows[1]["mean"]) == pytest.approx(2.0)
+
+
+def test_to_csv_refuses_other_columns(tmp_path):
+    path = tmp_path / "metrics.csv"
+    path.write_text("time,frames\n1,2\n")
+    with pytest.raises(Exception, match="other columns"):
+        Metrics().to_csv(path)
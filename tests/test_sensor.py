@@ -0,0 +1,90 @@
+import struct
+
+from evaluationkit import CAM_ERR_SUCCESS
+from sensor import _xml_bootstrap_nodes_addresses
+
+FAKE_ERR_IO = -1010
+
+
+def test_write_sensor_regs_writes_each_register(topaz, sdk):
+    # sensor registers 4 apart are not contiguous: one 16 bits register per address
+    assert topaz.write_sensor_regs([(0x03, 1), (0x07, 2), (0x0B, 3)]) == CAM_ERR_SUCCESS
+    assert sdk.writes == [(0x30003 + 4 * i, struct.pack("<H", i + 1)) for i in range(3)]
+    assert [topaz.read_sensor_reg(address) for address in (0x03, 0x07, 0x0B)] == [1, 2, 3]
+
+
+def test_consecutive_sensor_registers_are_one_transaction(topaz, sdk):
+    sdk.set_sensor_register(0x24, 0xBEEF)
+    values = [(0x20, 1), (0x21, 0x1234), (0x22, 3), (0x30, 4), (0x23, 5)]
+    assert topaz.write_sensor_regs(values) == CAM_ERR_SUCCESS
+    assert sdk.writes == [(0x30020, struct.pack("<3H", 1, 0x1234, 3)), (0x30030, struct.pack("<H", 4)),
+                          (0x30023, struct.pack("<H", 5))]
+    # 2 bytes per register: the register after the block is left as is
+    assert [sdk.sensor_register(address) for address in range(0x20, 0x25)] == [1, 0x1234, 3, 5, 0xBEEF]
+    reads = sdk.PiGentlSdkReadRegister.calls
+    assert topaz.read_sensor_regs(0x20, 5) == (CAM_ERR_SUCCESS, [1, 0x1234, 3, 5, 0xBEEF])
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 1
+    # the block read filled the shadow copy
+    assert topaz.read_sensor_reg(0x24, cached=True) == 0xBEEF
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 1
+
+
+def test_white_balance_is_one_transaction(topaz, sdk):
+    assert topaz.white_balance(1.0, 2.0, 3.0) == CAM_ERR_SUCCESS
+    assert sdk.writes == [(_xml_bootstrap_nodes_addresses["AWBredGain"], struct.pack("<3i", 1000000, 2000000, 3000000))]
+
+
+def test_apply_settings_returns_the_write_errors(topaz, sdk):
+    sdk.set_sensor_register(0x06, 1000)
+    assert topaz.apply_settings({"exposure_time": 10, "AnalogGain": 2, "WaitTime": 3}) == CAM_ERR_SUCCESS
+    # ExposureTime 0x3000B, AnalogGain 0x3000D and WaitTime 0x30008 are each written on their own
+    assert [address for address, _ in sdk.writes] == [0x3000B, 0x3000D, 0x30008]
+    assert topaz.exposure_time == 10
+    sdk.errors["PiGentlSdkWriteRegister"] = FAKE_ERR_IO
+    assert topaz.apply_settings({"exposure_time": 20}) == FAKE_ERR_IO
+    assert topaz.apply_settings({"AnalogGain": 1}) == FAKE_ERR_IO
+
+
+def test_register_cache_writes_through(topaz, sdk):
+    address = _xml_bootstrap_nodes_addresses["TriggerSource"]
+    assert topaz.set_trigger_source(2) == CAM_ERR_SUCCESS
+    reads, hits = sdk.PiGentlSdkReadRegister.calls, topaz.registers.hits
+    assert topaz.read_cached(address, 4) == (CAM_ERR_SUCCESS, struct.pack("<I", 2))
+    assert topaz.write_sensor_reg(0x08, 300) == CAM_ERR_SUCCESS
+    assert topaz.read_sensor_reg(0x08, cached=True) == 300
+    assert sdk.PiGentlSdkReadRegister.calls == reads
+    assert topaz.registers.hits == hits + 2
+    # a failed write drops the register, the next read goes to the camera
+    sdk.errors["PiGentlSdkWriteRegister"] = FAKE_ERR_IO
+    assert topaz.set_trigger_source(4) == FAKE_ERR_IO
+    assert address not in topaz.registers
+    del sdk.errors["PiGentlSdkWriteRegister"]
+    assert topaz.read_cached(address, 4) == (CAM_ERR_SUCCESS, struct.pack("<I", 2))
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 1
+
+
+def test_register_cache_keeps_the_static_registers(topaz, sdk):
+    sdk.registers[0x0:0x6] = b"Vendor"
+    sdk.registers[0xE0:0xE8] = b"FAKE0001"
+    struct.pack_into("<III", sdk.registers, _xml_bootstrap_nodes_addresses["SensorWidth"], 64, 16, 0x010A0046)
+    topaz.invalidate(static=True)
+    stats = topaz.registers.stats()
+    reads = sdk.PiGentlSdkReadRegister.calls
+    assert topaz.prefetch() == CAM_ERR_SUCCESS
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 2
+    assert topaz.vendor_name.rstrip("\x00") == "Vendor"
+    assert topaz.serial_number.rstrip("\x00") == "FAKE0001"
+    assert (topaz.sensor_width, topaz.sensor_height, topaz.pixel_format) == (64, 16, "Mono10p")
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 2
+    assert topaz.registers.stats()["hits"] == stats["hits"] + 5
+    assert topaz.registers.stats()["misses"] == stats["misses"]
+    # the identity and the sensor size stay cached, the pixel format is read again
+    topaz.invalidate()
+    for name in ("DeviceVendorName", "SerialNumber", "SensorWidth", "SensorHeight"):
+        assert _xml_bootstrap_nodes_addresses[name] in topaz.registers
+    assert _xml_bootstrap_nodes_addresses["PixelFormat"] not in topaz.registers
+    assert topaz.pixel_format == "Mono10p"
+    assert topaz.registers.stats()["misses"] == stats["misses"] + 1
+    assert sdk.PiGentlSdkReadRegister.calls == reads + 3
+    topaz.invalidate(static=True)
+    assert topaz.registers.stats()["registers"] == 0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from sequence import SEQ_HEADER_SIZE, SequenceReader, SequenceWriter
+
+
+def _frames(rng, n=5, shape=(6, 8)):
+    return rng.integers(0, 1024, (n,) + shape, dtype=np.uint16)
+
+
+def test_sequence_round_trip(tmp_path, rng):
+    path = tmp_path / "EK-sequence.seq"
+    frames = _frames(rng)
+    with SequenceWriter(path, 8, 6, "Mono10p") as writer:
+        for i, frame in enumerate(frames):
+            writer.append(frame, block_id=i, timestamp=1000 * i, exposure=10.0)
+    with SequenceReader(path) as reader:
+        assert (reader.width, reader.height, reader.channels) == (8, 6, 1)
+        assert reader.pixel_format == "Mono10p"
+        assert reader.dtype == np.uint16
+        assert len(reader) == len(frames)
+        # read from the disk on demand
+        assert isinstance(reader.frames, np.memmap)
+        assert np.array_equal(reader[3], frames[3])
+        assert np.array_equal(np.stack(list(reader)), frames)
+        assert reader.metadata["block_id"].tolist() == list(range(len(frames)))
+        assert reader.metadata["timestamp"].tolist() == [1000 * i for i in range(len(frames))]
+        assert np.all(reader.metadata["exposure"] == 10.0)
+
+
+def test_sequence_rgb_frames(tmp_path, rng):
+    path = tmp_path / "EK-sequence.seq"
+    frame = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    with SequenceWriter(path, 8, 6, "RGB24") as writer:
+        # as returned by get_image, or by image_rearange
+        writer.append(frame.reshape(6, 24))
+        writer.append(frame)
+    with SequenceReader(path) as reader:
+        assert reader.frames.shape == (2, 6, 8, 3)
+        assert np.array_equal(reader[0], frame) and np.array_equal(reader[1], frame)
+
+
+def test_unclosed_sequence_keeps_the_complete_frames(tmp_path, rng):
+    path = tmp_path / "EK-sequence.seq"
+    frames = _frames(rng, n=3)
+    writer = SequenceWriter(path, 8, 6, "Mono10p")
+    for frame in frames:
+        writer.append(frame)
+    # crash in the middle of the fourth frame: no metadata, header never updated
+    writer._file.write(frames[0].tobytes()[:50])
+    writer._file.flush()
+    with SequenceReader(path) as reader:
+        assert len(reader) == 3
+        assert np.array_equal(np.asarray(reader.frames), frames)
+        assert reader.metadata["block_id"].tolist() == [0, 0, 0]
+    writer.close()
+    # an empty sequence
+    SequenceWriter(tmp_path / "empty.seq", 8, 6).close()
+    with SequenceReader(tmp_path / "empty.seq") as reader:
+        assert len(reader) == 0 and reader.frames.shape == (0, 6, 8)
+
+
+def test_sequence_refuses_mismatching_frames(tmp_path):
+    with SequenceWriter(tmp_path / "EK-sequence.seq", 8, 6, "Mono10p") as writer:
+        with pytest.raises(ValueError, match="does not match"):
+            writer.append(np.zeros((6, 6), dtype=np.uint16))
+        # same number of bytes, twice the samples
+        with pytest.raises(ValueError, match="does not match"):
+            writer.append(np.zeros((6, 16), dtype=np.uint8))
+        writer.append(np.zeros((6, 8), dtype=np.uint16))
+        assert writer.frame_count == 1
+    path = tmp_path / "other.seq"
+    path.write_bytes(b"\x00" * SEQ_HEADER_SIZE)
+    with pytest.raises(ValueError, match="not an EK sequence file"):
+        SequenceReader(path)
@@ -0,0 +1,86 @@
+import ctypes
+import gc
+
+import numpy as np
+import pytest
+
+from utils import Histogram, RoiStats, TemporalStats, imageHist, make_nd_array
+
+
+def test_make_nd_array_view_is_read_only():
+    memory = (ctypes.c_uint16 * 12)(*range(12))
+    view = make_nd_array(ctypes.addressof(memory), (3, 4), dtype=np.uint16, copy=False)
+    assert view.flags.writeable is False
+    assert view[2, 3] == 11
+    # the view follows the memory, the copy does not
+    copy = make_nd_array(ctypes.addressof(memory), (3, 4), dtype=np.uint16)
+    memory[0] = 100
+    assert view[0, 0] == 100
+    assert copy[0, 0] == 0
+    assert copy.flags.writeable
+
+
+def test_histogram_percentiles():
+    hist = Histogram(bits=10)
+    hist.update(np.array([100, 100, 200, 300], dtype=np.uint16))
+    assert hist.percentile([0, 25, 50, 75, 100]).tolist() == [[100, 100, 100, 200, 300]]
+    assert Histogram(bits=8).percentile(0).tolist() == [0]
+
+
+def test_image_hist_updates_the_same_artists(rng):
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import utils
+
+    plt.close("all")
+    for _ in range(5):
+        imageHist(rng.integers(0, 1024, (16, 16), dtype=np.uint16))
+    for number in (3, 4):
+        assert len(plt.figure(number).axes) == 1
+        assert len(plt.figure(number).axes[0].patches) == 1
+    assert len(utils._hist_artists) == 2
+    plt.close("all")
+    gc.collect()
+    assert len(utils._hist_artists) == 0
+
+
+@pytest.mark.parametrize("decimation", [1, 2])
+def test_roi_stats_reuse_their_buffers(rng, decimation):
+    cv2 = pytest.importorskip("cv2")
+    im = rng.integers(0, 1024, (64, 64), dtype=np.uint16)
+    stats = RoiStats(decimation=decimation)
+    stats.set_rois([((8, 4), (40, 30))])
+    first = stats.compute(im)[0]
+    buffers = [stats._laplacians[0]] + list(stats._decimated.values())
+    assert len(buffers) == (1 if decimation == 1 else 2)
+    assert stats.compute(im)[0] == first
+    assert all(a is b for a, b in zip([stats._laplacians[0]] + list(stats._decimated.values()), buffers))
+    view = np.ascontiguousarray(im[4:30:decimation, 8:40:decimation])
+    assert first["mean"] == pytest.approx(view.mean())
+    assert first["std"] == pytest.approx(view.std())
+    assert (first["min"], first["max"]) == (view.min(), view.max())
+    assert first["sharpness"] == pytest.approx(cv2.Laplacian(view, cv2.CV_64F).var(), rel=1e-5)
+
+
+def test_temporal_stats_match_numpy(rng):
+    stack = rng.integers(0, 1024, (12, 6, 5), dtype=np.uint16)
+    stats = TemporalStats()
+    for frame in stack:
+        stats.update(frame)
+    # the same frames split between two workers
+    first, second = TemporalStats(), TemporalStats()
+    for frame in stack[:5]:
+        first.update(frame)
+    for frame in stack[5:]:
+        second.update(frame)
+    merged = TemporalStats().merge(first).merge(second)
+    for result in (stats, merged):
+        assert result.count == len(stack)
+        assert np.allclose(result.mean, stack.mean(axis=0))
+        assert np.allclose(result.variance(), stack.var(axis=0, ddof=1))
+        assert np.allclose(result.variance(ddof=0), stack.var(axis=0))
+        assert np.array_equal(result.min, stack.min(axis=0))
+        assert np.array_equal(result.max, stack.max(axis=0))
+        assert np.allclose(result.frame_means, stack.mean(axis=(1, 2)))
+        assert np.allclose(result.frame_stds, stack.std(axis=(1, 2)))
@@ -0,0 +1,15 @@
+import numpy as np
+
+from writer import ImageWriter
+
+
+def test_writer_counts_files_and_errors(tmp_path):
+    image = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    with ImageWriter(workers=4) as writer:
+        for i in range(50):
+            writer.write(str(tmp_path / f"im_{i}.raw"), image)
+            writer.write(str(tmp_path / "missing" / f"im_{i}.raw"), image)
+    assert writer.files_written == 50
+    assert writer.errors == 50
+    assert isinstance(writer.last_error, OSError)
+    assert np.array_equal(np.fromfile(tmp_path / "im_7.raw", dtype=np.uint16).reshape(3, 4), image)
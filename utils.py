@@ -1,8 +1,28 @@
 import os
+import time
 import ctypes
+import importlib
+import weakref
 import numpy as np
-import matplotlib.pyplot as plt
-import cv2
+from decoders import rgb24_view, subsampling22
+
+
+class _LazyModule:
+    """A module imported on first use: matplotlib and OpenCV take seconds to import and are not needed by headless
+    workers, e.g. for make_nd_array or the decoders."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+plt = _LazyModule("matplotlib.pyplot")
+cv2 = _LazyModule("cv2")
 
 
 # used to convert from the EK/XML pixel format to colormap
@@ -34,61 +54,178 @@ xml_pixel_format_nptypes = {
 
 def image_rearange(aux, pixel_format):
     if pixel_format == "RGB24":  # RGB
-        # RGB24 is (5760 x 1080) uint8 array R-G-B
-        red = aux[:, 0::3].copy()
-        green = aux[:, 1::3].copy()
-        blue = aux[:, 2::3].copy()
-        image = np.stack((red, green, blue), axis=2)
+        # RGB24 is (5760 x 1080) uint8 array R-G-B, viewed as (1080 x 1920 x 3) then copied once
+        image = rgb24_view(aux).copy()
     else:  # Mono
         image = aux[:, :].copy()
     return image
 
 
 def image_rearange_subsampling22(aux, pixel_format):
-    if pixel_format == "RGB24":  # RGB
-        # RGB24 is (2880 x 1080) uint8 array R-G-B
-        red = aux[:, 0::6].copy()
-        green = aux[:, 1::6].copy()
-        blue = aux[:, 2::6].copy()
-        image = np.stack((red, green, blue), axis=2)
-    else:  # Mono
-        image = aux[:, 0::2].copy()
-    return image
+    # RGB24 is (2880 x 1080) uint8 array R-G-B
+    return subsampling22(aux, pixel_format)
 
 
 def init_figure(ek):
-    plt.ion()
-    fig = plt.figure(1)
-    fig.clf()
-    ax = fig.add_subplot(111)
-    shape = (ek.sensor_height, ek.sensor_width)
-    image = np.zeros(shape, dtype=xml_pixel_format_nptypes[ek.pixel_format])
-    fig_handle = ax.imshow(np.flip(image, 0), origin="lower", cmap=xml_pixel_format_cmap[ek.pixel_format])
-    fig_handle.autoscale()
-    return fig_handle
+    return ImageViewer(cmap=xml_pixel_format_cmap[ek.pixel_format], profiles=False)
 
 
 def update_figure(fig_handle, image, INTERVAL_PLOT, nim):
-    fig_handle.set_data(np.flip(image, 0))
-    fig_handle.autoscale()
-    plt.title("#" + str(nim))
-    plt.pause(INTERVAL_PLOT)
-    plt.draw()
-
-
-def make_nd_array(c_pointer, shape, dtype=np.uint16, order="C"):
-    """Safely copy an array from a given pointer into a numpy array."""
-    # set up access to Python 3 PyMemoryView_FromMemory() function
-    PyBUF_READ = 0x200
-    buf_from_mem = ctypes.pythonapi.PyMemoryView_FromMemory
-    buf_from_mem.restype = ctypes.py_object
-    buf_from_mem.argtypes = (ctypes.c_void_p, ctypes.c_int, ctypes.c_int)
-    arr_size = np.prod(shape[:]) * np.dtype(dtype).itemsize
+    # INTERVAL_PLOT is kept for compatibility, redraws are throttled by the viewer fps
+    fig_handle.update(image, "#" + str(nim))
+
+
+class ImageViewer:
+    """Matplotlib viewer of the acquired images, with optional H-V profiles.
+    The artists are created with the first image, then only their data is updated and the canvas is blitted.
+    Redraws are throttled to fps, images arriving in between are skipped."""
+
+    def __init__(self, cmap="gray", profiles=True, fps=20, num=1):
+        """Constructor
+        :param cmap: Colormap of mono images.
+        :param profiles: Also plot the vertical and horizontal profiles below the image.
+        :param fps: Maximum number of redraws per second.
+        :param num: Number of the matplotlib figure."""
+        self.cmap = cmap
+        self.profiles = profiles
+        self.fps = fps
+        self.num = num
+        self.fig = None
+        self.skipped = 0
+        self._last_draw = 0.0
+        self._background = None
+
+    def _create(self, image):
+        plt.ion()
+        self.fig = plt.figure(self.num)
+        self.fig.clf()
+        if self.profiles:
+            grid = self.fig.add_gridspec(4, 1)
+            self.ax = self.fig.add_subplot(grid[:2, 0])
+            self.ax_cols = self.fig.add_subplot(grid[2, 0])
+            self.ax_rows = self.fig.add_subplot(grid[3, 0])
+        else:
+            self.ax = self.fig.add_subplot(111)
+        # origin upper shows the image the right way up without flipping it
+        self.image_artist = self.ax.imshow(image, origin="upper", cmap=self.cmap, animated=True)
+        self.title = self.ax.set_title("", animated=True)
+        self.ax.set_xlabel("#cols")
+        self.ax.set_ylabel("#rows")
+        self.artists = [self.image_artist, self.title]
+        if self.profiles:
+            self.cols_lines = self.ax_cols.plot(np.mean(image, axis=0), animated=True)
+            self.rows_lines = self.ax_rows.plot(np.mean(image, axis=1), animated=True)
+            for ax, label, title in ((self.ax_cols, "#cols", "Vertical profile"),
+                                     (self.ax_rows, "#rows", "Horizontal profile")):
+                ax.grid()
+                ax.set_xlabel(label)
+                ax.set_ylabel("Signal level[LSB]")
+                ax.set_title(title)
+            self.artists += self.cols_lines + self.rows_lines
+        self.autoscale(image)
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+        plt.show(block=False)
+        self.fig.canvas.draw()
+
+    def _on_draw(self, event):
+        # full redraw: save the static background and draw the animated artists on top of it
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def autoscale(self, image):
+        # fit the color scale and the profile axes to the image
+        self.image_artist.set_clim(np.min(image), np.max(image))
+        if self.profiles:
+            for ax, lines in ((self.ax_cols, self.cols_lines), (self.ax_rows, self.rows_lines)):
+                low = min(np.min(line.get_ydata()) for line in lines)
+                high = max(np.max(line.get_ydata()) for line in lines)
+                ax.set_ylim(low, high if high > low else low + 1)
+
+    def update(self, image, title=None, autoscale=False):
+        """This function shows a new image.
+        :param title: Optionally a new title.
+        :param autoscale: Fit the color scale and the profiles to this image, which needs a full redraw.
+        returns True if the image was drawn, False if it was skipped to respect fps"""
+        now = time.perf_counter()
+        if self.fig is not None and now - self._last_draw < 1.0 / self.fps and not autoscale:
+            self.skipped += 1
+            return False
+        if self.fig is None or not plt.fignum_exists(self.num):
+            self._create(image)
+        self.image_artist.set_data(image)
+        if title is not None:
+            self.title.set_text(title)
+        if self.profiles:
+            self._set_profile(self.cols_lines, np.mean(image, axis=0))
+            self._set_profile(self.rows_lines, np.mean(image, axis=1))
+        canvas = self.fig.canvas
+        if autoscale:
+            self.autoscale(image)
+            canvas.draw()
+        elif self._background is not None:
+            canvas.restore_region(self._background)
+            for artist in self.artists:
+                self.fig.draw_artist(artist)
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        self._last_draw = time.perf_counter()
+        return True
+
+    @staticmethod
+    def _set_profile(lines, profile):
+        if profile.ndim == 1:
+            lines[0].set_ydata(profile)
+        else:
+            for line, channel in zip(lines, profile.T):
+                line.set_ydata(channel)
+
+
+# set up access to Python 3 PyMemoryView_FromMemory() function
+# the views on the driver memory are read-only, 0x200 would be PyBUF_WRITE
+PyBUF_READ = 0x100
+buf_from_mem = ctypes.pythonapi.PyMemoryView_FromMemory
+buf_from_mem.restype = ctypes.py_object
+buf_from_mem.argtypes = (ctypes.c_void_p, ctypes.c_ssize_t, ctypes.c_int)
+
+
+def make_nd_array(c_pointer, shape, dtype=np.uint16, order="C", copy=True, out=None):
+    """Safely copy an array from a given pointer into a numpy array.
+    :param copy: If False, return a read-only view on the memory at c_pointer instead of a copy.
+                 The view is only valid as long as the underlying buffer is not requeued.
+    :param out: Optionally copy into this preallocated array instead of allocating a new one."""
+    arr_size = int(np.prod(shape[:])) * np.dtype(dtype).itemsize
     buffer = buf_from_mem(c_pointer, arr_size, PyBUF_READ)
     arr = np.ndarray(tuple(shape[:]), dtype, buffer, order=order)
+    if out is not None:
+        np.copyto(out, arr.reshape(out.shape))
+        return out
+    if not copy:
+        return arr
     return arr.copy()
 
 
+class FramePool:
+    """A ring of preallocated frames, handed out in turn so that get_image(out=...) never allocates."""
+
+    def __init__(self, shape, dtype=np.uint16, count=2):
+        """Constructor
+        :param shape: Shape of one frame, as returned by get_image.
+        :param dtype: Numpy type of the frame.
+        :param count: Number of frames in the pool. A frame is overwritten after count calls to next()."""
+        self.frames = np.zeros((count,) + tuple(shape), dtype=dtype)
+        self._index = 0
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def next(self):
+        """This function returns the next free frame of the pool."""
+        frame = self.frames[self._index]
+        self._index = (self._index + 1) % self.frames.shape[0]
+        return frame
+
+
 def imgWriteOpenCV(dirOut, imgs):
     import cv2 as cv
     import os
@@ -103,12 +240,15 @@ def imgWriteOpenCV(dirOut, imgs):
 
 
 def write_image(dirOut, imgs):
+    from writer import ImageWriter
+
     # Create directory if it doesn't exist
     if not (os.path.exists(dirOut)):
         os.mkdir(dirOut)
     # Save images in non-loss quality compression and 16b
-    for i in range(imgs.shape[0]):
-        cv.imwrite(dirOut + "/im_" + str(i) + ".tiff", imgs[i, :, :].copy() << 4)
+    with ImageWriter() as writer:
+        for i in range(imgs.shape[0]):
+            writer.write(dirOut + "/im_" + str(i) + ".tiff", imgs[i, :, :], fmt="cv-tiff", shift=4, copy=False)
     return 0
 
 
@@ -144,30 +284,120 @@ def imageProfile(im):
     plt.title("Horizontal profile")
 
 
-def imageHist(im):
-    # Histogram
-    fig = plt.figure(3)
-    aux = im.copy()
-    fig.clf()
-    plt.hist(aux.ravel(), bins=1024, fc="k", ec="k")
-    plt.grid()
-    plt.ylabel("Number of pixels")
-    plt.xlabel("Signal level[LSB]")
-    plt.title("Histogram")
+def _hist_axes(number, title, log=False):
+    # axes of a histogram figure, created on the first call and kept so that the next calls only update the counts
+    fig = plt.figure(number)
+    if fig.axes:
+        return fig.axes[0]
+    ax = fig.gca()
+    if log:
+        ax.set_yscale("log")
+    ax.grid()
+    ax.set_ylabel("Number of pixels")
+    ax.set_xlabel("Signal level[LSB]")
+    ax.set_title(title)
+    return ax
+
+
+def imageHist(im, hist=None):
+    # Histogram, counted with integer bins then drawn from the counts
+    if hist is None:
+        hist = Histogram(bits=8 if im.dtype == np.uint8 else 10)
+        hist.update(im)
+    hist.plot(_hist_axes(3, "Histogram"))
 
     # Accumulated Histogram
-    fig = plt.figure(4)
-    aux = im.copy()
-    fig.clf()
-    plt.hist(aux.ravel(), bins=1024, fc="k", ec="k")
-    plt.gca().set_yscale("log")
-    plt.grid()
-    plt.ylabel("Number of pixels")
-    plt.xlabel("Signal level[LSB]")
-    plt.title("Accumulated histogram")
+    hist.plot(_hist_axes(4, "Accumulated histogram", log=True))
+    return hist
 
-def imageRoi(im, roi):
-    # roi[start_point, end_point]
+
+# axes -> {channel: weak reference to the stairs artist} drawn by Histogram.plot, shared by all the histograms so that
+# drawing a new one on the same axes updates the artist in place. Nothing here keeps the axes alive, closed figures
+# drop out with their axes.
+_hist_artists = weakref.WeakKeyDictionary()
+
+
+class Histogram:
+    """Histogram of sensor codes with one integer bin per code, counted with np.bincount.
+    Counts accumulate across frames until reset(), percentiles and cumulative histogram are computed from the bins."""
+
+    def __init__(self, bits=10, channels=1):
+        """Constructor
+        :param bits: Number of bits of the codes, 8 for Mono8/RGB24 and 10 for Mono10p.
+        :param channels: 3 to count the R, G and B channels of an RGB24 image separately."""
+        self.bins = 1 << bits
+        self.channels = channels
+        self.counts = np.zeros((channels, self.bins), dtype=np.int64)
+        self.frames = 0
+
+    def reset(self):
+        self.counts[...] = 0
+        self.frames = 0
+
+    def _count(self, values, channel):
+        counts = np.bincount(values, minlength=self.bins)
+        if counts.size > self.bins:
+            # codes out of range are counted in the last bin
+            self.counts[channel, -1] += counts[self.bins:].sum()
+            counts = counts[: self.bins]
+        self.counts[channel] += counts
+
+    def update(self, image):
+        """This function adds the codes of an image to the histogram.
+        :param image: Mono image, or RGB24 image as (height, width * 3) or (height, width, 3)."""
+        if self.channels == 1:
+            self._count(image.ravel(), 0)
+        else:
+            pixels = image.reshape(-1, self.channels)
+            for channel in range(self.channels):
+                self._count(pixels[:, channel], channel)
+        self.frames += 1
+
+    @property
+    def total(self):
+        return self.counts.sum(axis=1)
+
+    def cumulative(self, normalize=False):
+        # cumulative histogram of each channel
+        cumulative = np.cumsum(self.counts, axis=1)
+        if normalize:
+            return cumulative / np.maximum(cumulative[:, -1:], 1)
+        return cumulative
+
+    def percentile(self, q):
+        """This function gets percentiles of the codes from the bins.
+        :param q: Percentile or sequence of percentiles, between 0 and 100.
+        returns the codes, one row per channel"""
+        cumulative = self.cumulative()
+        q = np.asarray(q, dtype=np.float64) / 100
+        # smallest code reaching q of the pixels, at least one pixel so that q = 0 gives the lowest populated code
+        return np.stack([np.searchsorted(c, np.maximum(q * c[-1], min(c[-1], 1)), side="left") for c in cumulative])
+
+    def mean(self):
+        codes = np.arange(self.bins)
+        return self.counts @ codes / np.maximum(self.total, 1)
+
+    def plot(self, ax=None, channel=0):
+        """This function draws the counts of a channel, updating the previous drawing on the same axes in place."""
+        if ax is None:
+            ax = plt.gca()
+        artists = _hist_artists.setdefault(ax, {})
+        artist = artists[channel]() if channel in artists else None
+        if artist is None or artist.axes is not ax:
+            artist = ax.stairs(self.counts[channel], np.arange(self.bins + 1), fill=True, color="k")
+            artists[channel] = weakref.ref(artist)
+        else:
+            if len(artist.get_data().edges) == self.bins + 1:
+                artist.set_data(self.counts[channel])
+            else:
+                artist.set_data(self.counts[channel], np.arange(self.bins + 1))
+            ax.relim()
+            ax.autoscale_view()
+        return artist
+
+
+def roi_slices(roi):
+    # roi[start_point, end_point] to (rows, cols) slices
     bottom= min(int(roi[0][1]), int(roi[1][1]))
     top= max(int(roi[0][1]), int(roi[1][1]))
     left= min(int(roi[0][0]), int(roi[1][0]))
@@ -175,9 +405,261 @@ def imageRoi(im, roi):
     if(top == bottom): top=bottom+1
     if (left == right): right=left+1
     # print(f'bottom={bottom}, top={top}, left= {left}, right={right}')
-    cropped= im[bottom:top, left:right]
+    return slice(bottom, top), slice(left, right)
+
+
+def imageRoi(im, roi):
+    # roi[start_point, end_point]
+    cropped= im[roi_slices(roi)]
     return cropped
+
+
 def sharpness(im):
     laplacian = cv2.Laplacian(im, cv2.CV_64F)
     variance = laplacian.var()
     return variance
+
+
+class RoiStats:
+    """Mean, standard deviation, min, max and sharpness of one or several ROIs of the live image.
+    The ROI slices are computed again only when the ROIs change. Each ROI takes four OpenCV passes, OpenCV has no
+    fused reduction: cv2.meanStdDev, cv2.minMaxLoc, the Laplacian and its cv2.meanStdDev. The Laplacian goes to a
+    preallocated float32 image, and a decimated ROI is first copied to a preallocated image, otherwise OpenCV copies
+    the strided view again for each pass."""
+
+    def __init__(self, decimation=1):
+        """Constructor
+        :param decimation: Only use one pixel every decimation rows and columns."""
+        self.decimation = decimation
+        self._rois = None
+        self._slices = []
+        self._laplacians = {}
+        self._decimated = {}
+        self.set_rois([])
+
+    def set_rois(self, rois):
+        """This function sets the ROIs.
+        :param rois: List of roi[start_point, end_point]. With no ROI, the statistics are computed on the whole
+                     image."""
+        rois = [tuple(map(tuple, roi)) for roi in rois]
+        if rois == self._rois:
+            return
+        self._rois = rois
+        d = self.decimation
+        if rois:
+            self._slices = [(slice(r.start, r.stop, d), slice(c.start, c.stop, d)) for r, c in map(roi_slices, rois)]
+        else:
+            self._slices = [(slice(None, None, d), slice(None, None, d))]
+
+    @staticmethod
+    def _buffer(buffers, index, shape, dtype):
+        # image kept from one call to the next, reallocated only when the ROI or the image format change
+        dst = buffers.get(index)
+        if dst is None or dst.shape != shape or dst.dtype != dtype:
+            dst = buffers[index] = np.empty(shape, dtype=dtype)
+        return dst
+
+    def compute(self, im):
+        """This function computes the statistics of each ROI.
+        returns a list of dict(mean, std, min, max, sharpness), one for each ROI"""
+        results = []
+        for index, roi in enumerate(self._slices):
+            view = im[roi]
+            if view.strides[-1] != view.itemsize:
+                # OpenCV takes rows with a stride, not columns
+                decimated = self._buffer(self._decimated, index, view.shape, view.dtype)
+                np.copyto(decimated, view)
+                view = decimated
+            mean, std = cv2.meanStdDev(view)
+            min_val, max_val = cv2.minMaxLoc(view)[:2]
+            laplacian = cv2.Laplacian(view, cv2.CV_32F, dst=self._buffer(self._laplacians, index, view.shape,
+                                                                          np.float32))
+            sharp = cv2.meanStdDev(laplacian)[1][0, 0] ** 2
+            results.append({"mean": float(mean[0, 0]), "std": float(std[0, 0]), "min": min_val, "max": max_val,
+                            "sharpness": float(sharp)})
+        return results
+
+
+class TemporalStats:
+    """Per-pixel temporal statistics of a stream of frames, updated one frame at a time.
+    Mean and variance use Welford's update in float64, so memory does not depend on the number of frames:
+        stats = TemporalStats()
+        for image in camera.stream(10000):
+            stats.update(image)
+        noise_map = stats.std()"""
+
+    def __init__(self, frame_stats=True):
+        """Constructor
+        :param frame_stats: Also keep the spatial mean and standard deviation of each frame."""
+        self.count = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+        self._m2 = None
+        self._delta = None
+        self._delta2 = None
+        self._frame_stats = frame_stats
+        self.frame_means = []
+        self.frame_stds = []
+
+    def _allocate(self, frame):
+        self.mean = np.zeros(frame.shape, dtype=np.float64)
+        self._m2 = np.zeros(frame.shape, dtype=np.float64)
+        self._delta = np.empty(frame.shape, dtype=np.float64)
+        self._delta2 = np.empty(frame.shape, dtype=np.float64)
+        self.min = frame.copy()
+        self.max = frame.copy()
+
+    def update(self, frame):
+        """This function adds a frame to the statistics, without allocating frame sized memory."""
+        if self.mean is None:
+            self._allocate(frame)
+        elif frame.shape != self.mean.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match the statistics {self.mean.shape}")
+        if self._frame_stats:
+            # on the scratch buffer, before the update overwrites it: np.std would allocate the deviations
+            np.copyto(self._delta2, frame)
+            frame_mean = self._delta2.mean()
+            self._delta2 -= frame_mean
+            np.square(self._delta2, out=self._delta2)
+            self.frame_means.append(float(frame_mean))
+            self.frame_stds.append(float(np.sqrt(self._delta2.mean())))
+        self.count += 1
+        np.subtract(frame, self.mean, out=self._delta)
+        np.multiply(self._delta, 1.0 / self.count, out=self._delta2)
+        self.mean += self._delta2
+        np.subtract(frame, self.mean, out=self._delta2)
+        self._delta *= self._delta2
+        self._m2 += self._delta
+        np.minimum(self.min, frame, out=self.min)
+        np.maximum(self.max, frame, out=self.max)
+
+    def merge(self, other):
+        """This function adds the statistics accumulated by another TemporalStats, e.g. from a parallel worker."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self._allocate(other.min)
+            self.mean[...] = other.mean
+            self._m2[...] = other._m2
+            self.max[...] = other.max
+            self.count = other.count
+        else:
+            count = self.count + other.count
+            np.subtract(other.mean, self.mean, out=self._delta)
+            np.multiply(self._delta, other.count / count, out=self._delta2)
+            self.mean += self._delta2
+            self._delta *= self._delta
+            self._delta *= self.count * other.count / count
+            self._m2 += other._m2
+            self._m2 += self._delta
+            np.minimum(self.min, other.min, out=self.min)
+            np.maximum(self.max, other.max, out=self.max)
+            self.count = count
+        self.frame_means.extend(other.frame_means)
+        self.frame_stds.extend(other.frame_stds)
+        return self
+
+    def variance(self, ddof=1):
+        # per-pixel temporal variance
+        if self.count <= ddof:
+            raise ValueError("Not enough frames for the variance")
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        # per-pixel temporal noise map
+        return np.sqrt(self.variance(ddof))
+
+    def temporal_noise(self, ddof=1):
+        # temporal noise of the sensor, RMS of the per-pixel noise
+        return float(np.sqrt(np.mean(self.variance(ddof))))
+
+
+class ToneMapper:
+    """Display stage mapping sensor codes to 8b display values through a lookup table.
+    The image is first decimated to the display size, then mapped with the LUT. The LUT is only rebuilt when the
+    black/white window or the gamma change, e.g. when auto-contrast moves the window."""
+
+    def __init__(self, bits=10, black=0, white=None, gamma=1.0, auto=None, max_size=None):
+        """Constructor
+        :param bits: Number of bits of the sensor codes.
+        :param black: Code displayed as 0.
+        :param white: Code displayed as 255, by default the maximum code.
+        :param gamma: Display gamma.
+        :param auto: Optionally (low, high) percentiles used as black and white codes, computed on each image.
+        :param max_size: Optionally (width, height) of the display, larger images are decimated to fit."""
+        self.bits = bits
+        self.black = black
+        self.white = (1 << bits) - 1 if white is None else white
+        self.gamma = gamma
+        self.auto = auto
+        self.max_size = max_size
+        # decimation step from the image to the display
+        self.step = 1
+        self._lut = None
+        self._lut_key = None
+        self._out = None
+        self._hist = Histogram(bits=bits)
+
+    def set_window(self, black, white):
+        self.black, self.white = black, white
+
+    def lut(self):
+        # codes to display values, rebuilt only when the window or the gamma changed
+        key = (self.black, self.white, self.gamma)
+        if key != self._lut_key:
+            codes = np.arange(1 << self.bits, dtype=np.float64)
+            level = np.clip((codes - self.black) / max(self.white - self.black, 1), 0, 1)
+            if self.gamma != 1.0:
+                level **= 1.0 / self.gamma
+            self._lut = np.round(level * 255).astype(np.uint8)
+            self._lut_key = key
+        return self._lut
+
+    def downscale(self, im):
+        # view of the image decimated to fit in max_size
+        if self.max_size is None:
+            self.step = 1
+        else:
+            self.step = max(1, -(-im.shape[1] // self.max_size[0]), -(-im.shape[0] // self.max_size[1]))
+        return im[:: self.step, :: self.step]
+
+    def apply(self, im):
+        """This function maps an image to display values.
+        :param im: Mono image, or (height, width, 3) color image.
+        returns the 8b display image, a buffer reused for the next image"""
+        small = self.downscale(im)
+        if self.auto is not None:
+            self._hist.reset()
+            self._hist.update(small)
+            black, white = self._hist.percentile(self.auto)[0]
+            self.set_window(int(black), int(max(white, black + 1)))
+        if self._out is None or self._out.shape != small.shape:
+            self._out = np.empty(small.shape, dtype=np.uint8)
+        np.take(self.lut(), small, out=self._out, mode="clip")
+        return self._out
+
+    def to_image(self, point):
+        # display coordinates to image coordinates
+        return point[0] * self.step, point[1] * self.step
+
+
+class RateMeter:
+    """Rate of a counter, e.g. frames per second, averaged over a window of time."""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.rate = 0.0
+        self._count = None
+        self._time = None
+
+    def update(self, count):
+        """This function gives the current value of the counter.
+        returns the rate in counts per second, updated once per window"""
+        now = time.perf_counter()
+        if self._time is None:
+            self._count, self._time = count, now
+        elif now - self._time >= self.window:
+            self.rate = (count - self._count) / (now - self._time)
+            self._count, self._time = count, now
+        return self.rate
@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# "raw": image buffer as is, "tiff": TIFF saved with Pillow, "cv-tiff": 16b TIFF saved with OpenCV
+WRITER_FORMATS = ("raw", "tiff", "cv-tiff")
+
+
+def _format_from_name(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".raw":
+        return "raw"
+    if ext in (".tif", ".tiff"):
+        return "tiff"
+    raise ValueError(f"Can not guess the image format of {path}")
+
+
+class ImageWriter:
+    """Saves images on a pool of threads fed by a bounded queue, so the acquisition loop never waits for the disk.
+    Use it as a context manager, all queued images are written when it is closed:
+        with ImageWriter() as writer:
+            for image in camera.stream(100):
+                writer.write("EK-image.raw", image)"""
+
+    def __init__(self, workers=2, queue_size=16):
+        """Constructor
+        :param workers: Number of writing threads.
+        :param queue_size: Number of images waiting to be written before write() blocks."""
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # copies of the images waiting in the queue, reused once written
+        self._buffers = {}
+        self._local = threading.local()
+        self._closed = False
+        self.files_written = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._first_write = None
+        self._last_write = None
+        self._threads = [
+            threading.Thread(target=self._write_loop, name=f"ImageWriter-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def queue_depth(self):
+        # number of images waiting to be written
+        return self._queue.qsize()
+
+    @property
+    def throughput(self):
+        # written MB/s, from the first submitted image to the last written one
+        with self._lock:
+            if self._first_write is None or self._last_write is None or self._last_write <= self._first_write:
+                return 0.0
+            return self.bytes_written / (self._last_write - self._first_write) / 1e6
+
+    def stats(self):
+        return {
+            "files": self.files_written,
+            "MB": self.bytes_written / 1e6,
+            "MB/s": self.throughput,
+            "queue": self.queue_depth,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def write(self, path, image, fmt=None, shift=0, copy=True, block=True):
+        """This function queues an image to be written.
+        :param path: Name of the file to write.
+        :param image: The image.
+        :param fmt: One of WRITER_FORMATS. By default guessed from the file extension.
+        :param shift: Left shift applied before writing a "cv-tiff", e.g. 4 to save 10b images on 16b.
+        :param copy: Copy the image first. Set it to False only if the image is not modified until it is written.
+        :param block: Wait for room in the queue. If False, the image is dropped when the queue is full.
+        returns True if the image was queued"""
+        if self._closed:
+            raise Exception("ImageWriter is closed")
+        if fmt is None:
+            fmt = _format_from_name(path)
+        if fmt not in WRITER_FORMATS:
+            raise ValueError(f"Unknown image format {fmt}, expected one of {WRITER_FORMATS}")
+        buffer = None
+        if copy:
+            buffer = self._take_buffer(image.shape, image.dtype)
+            np.copyto(buffer, image)
+            image = buffer
+        with self._lock:
+            if self._first_write is None:
+                self._first_write = time.perf_counter()
+        try:
+            self._queue.put((path, image, fmt, shift, buffer), block=block)
+        except queue.Full:
+            self._give_buffer(buffer)
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """This function waits until all queued images are written."""
+        self._queue.join()
+
+    def close(self):
+        """This function writes all queued images and stops the writing threads."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _take_buffer(self, shape, dtype):
+        with self._lock:
+            buffers = self._buffers.get((shape, dtype))
+            if buffers:
+                return buffers.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def _give_buffer(self, buffer):
+        if buffer is None:
+            return
+        with self._lock:
+            self._buffers.setdefault((buffer.shape, buffer.dtype), deque()).append(buffer)
+
+    def _shifted(self, image, shift):
+        # per thread scratch image, so shifting does not allocate for each image
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None or scratch.shape != image.shape or scratch.dtype != image.dtype:
+            scratch = self._local.scratch = np.empty_like(image)
+        return np.left_shift(image, shift, out=scratch)
+
+    def _write_one(self, path, image, fmt, shift):
+        if fmt == "raw":
+            with open(path, "wb") as f:
+                f.write(np.ascontiguousarray(image).data)
+        elif fmt == "tiff":
+            from PIL import Image
+
+            Image.fromarray(image).save(path)
+        else:
+            import cv2
+
+            if shift:
+                image = self._shifted(image, shift)
+            cv2.imwrite(path, image)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            path, image, fmt, shift, buffer = item
+            try:
+                self._write_one(path, image, fmt, shift)
+                with self._lock:
+                    self.files_written += 1
+                    self.bytes_written += image.nbytes
+                    self._last_write = time.perf_counter()
+            except Exception as e:
+                # counters are shared by the writing threads
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = e
+            finally:
+                self._give_buffer(buffer)
+                self._queue.task_done()